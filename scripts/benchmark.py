@@ -0,0 +1,179 @@
+"""
+Benchmark of the payment cost calculation.
+
+Generates synthetic data (scripts/generate_data.py) or uses an existing data folder and reports time, rows/s
+and peak RSS of the stages - Fees.get_fees, Rates.set_rates and Component.run.
+
+    python scripts/benchmark.py --sessions 100000
+    python scripts/benchmark.py --data /tmp/bench/data --engine batch --workers 4 --json result.json
+    python scripts/benchmark.py --sessions 100000 --baseline result.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+import generate_data  # noqa: E402
+
+
+def peak_rss_mb():
+    """
+    Peak RSS of the process and its finished child processes in MB
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+@contextlib.contextmanager
+def data_dir(path):
+    """
+    Component reads the data folder of KBC_DATADIR - the arguments of the benchmark (its --data would override
+    KBC_DATADIR) are hidden from it
+    """
+    original = os.environ.get('KBC_DATADIR')
+    argv = sys.argv
+    os.environ['KBC_DATADIR'] = path
+    sys.argv = argv[:1]
+    try:
+        yield
+    finally:
+        sys.argv = argv
+        if original is None:
+            os.environ.pop('KBC_DATADIR')
+        else:
+            os.environ['KBC_DATADIR'] = original
+
+
+def count_rows(path):
+    """
+    Number of data rows of a csv file
+    """
+    with open(path, mode='rb') as f:
+        return sum(1 for _ in f) - 1
+
+
+def measure(name, func, rows=None):
+    """
+    Run the stage, return its result and metrics
+    """
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+
+    metrics = {'stage': name, 'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss_mb(), 1)}
+    if rows is not None:
+        metrics['rows'] = rows
+        metrics['rows_per_s'] = round(rows / seconds) if seconds else None
+
+    return result, metrics
+
+
+def run(data, parameters):
+    """
+    Benchmark the stages over the data folder
+    """
+    from component import Component
+    from lib import fee, rate
+
+    tables = os.path.join(data, 'in', 'tables')
+    sessions = count_rows(os.path.join(tables, 'payments-sessions-stage.csv'))
+    results = []
+
+    _, metrics = measure('Fees.get_fees', lambda: fee.Fees(os.path.join(tables, 'payment_fees.csv')).get_fees(),
+                         count_rows(os.path.join(tables, 'payment_fees.csv')))
+    results.append(metrics)
+
+    _, metrics = measure('Rates.set_rates', lambda: rate.Rates(os.path.join(tables, 'gopay_rates.csv'),
+                                                               os.path.join(tables, 'eur_rates.csv')).set_rates(),
+                         count_rows(os.path.join(tables, 'gopay_rates.csv'))
+                         + count_rows(os.path.join(tables, 'eur_rates.csv')))
+    results.append(metrics)
+
+    # the run reads a temporary copy of the data folder with the config parameters of the run,
+    # the data folder is not changed
+    with open(os.path.join(data, 'config.json'), encoding='utf-8') as f:
+        config = json.load(f)
+    config['parameters'].update(parameters)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run_data = os.path.join(tmp, 'data')
+        shutil.copytree(os.path.join(data, 'in'), os.path.join(run_data, 'in'))
+        for name in ('tables', 'files'):
+            os.makedirs(os.path.join(run_data, 'out', name))
+        with open(os.path.join(run_data, 'config.json'), mode='w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2)
+
+        with data_dir(run_data):
+            _, metrics = measure('Component.run', lambda: Component().run(), sessions)
+
+        metrics['rows_out'] = count_rows(os.path.join(run_data, 'out', 'tables', 'payment_costs.csv'))
+
+    results.append(metrics)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the stages slower than the baseline by more than the tolerance
+    """
+    baseline = {r['stage']: r for r in baseline}
+    regressions = []
+
+    for r in results:
+        b = baseline.get(r['stage'])
+        if b and b.get('rows_per_s') and r.get('rows_per_s') and r['rows_per_s'] < b['rows_per_s'] * (1 - tolerance):
+            regressions.append('{}: {} rows/s, baseline {} rows/s'.format(r['stage'], r['rows_per_s'], b['rows_per_s']))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', help='existing data folder, otherwise data are generated into a temporary folder')
+    parser.add_argument('--sessions', type=int, default=100000, help='number of generated payment sessions')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--engine', default='decimal', help='engine config parameter')
+    parser.add_argument('--workers', type=int, default=1, help='workers config parameter')
+    parser.add_argument('--json', help='write the results to the json file')
+    parser.add_argument('--baseline', help='json file with results to compare with, exits with 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed drop of rows/s against the baseline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = args.data
+        if data is None:
+            data = os.path.join(tmp, 'data')
+            _, metrics = measure('generate_data', lambda: generate_data.generate(data, args.sessions, seed=args.seed),
+                                 args.sessions)
+            print('Generated {} payment sessions in {} s'.format(args.sessions, metrics['seconds']))
+
+        results = run(data, {'engine': args.engine, 'workers': args.workers})
+
+    logging.getLogger().handlers = []
+    print('{:<16} {:>10} {:>12} {:>12} {:>14}'.format('stage', 'seconds', 'rows', 'rows/s', 'peak RSS MB'))
+    for r in results:
+        print('{:<16} {:>10} {:>12} {:>12} {:>14}'.format(r['stage'], r['seconds'], r.get('rows', ''),
+                                                          r.get('rows_per_s', ''), r['peak_rss_mb']))
+
+    if args.json:
+        with open(args.json, mode='w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        for r in regressions:
+            print('REGRESSION ' + r)
+        sys.exit(1 if regressions else 0)
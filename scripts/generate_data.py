@@ -0,0 +1,176 @@
+"""
+Synthetic input data for the payment cost calculation.
+
+Writes config.json and in/tables/ (payments-sessions-stage.csv, payment_fees.csv, gopay_rates.csv, eur_rates.csv)
+of a data folder. The fee sheet covers every generated payment with exactly one fee, so the run does not fail.
+
+    python scripts/generate_data.py --sessions 100000 --data /tmp/bench/data
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+
+CURRENCIES = {'CZK': None, 'EUR': (25.5, 1), 'USD': (22.4, 1), 'PLN': (5.9, 1), 'HUF': (7.1, 100), 'GBP': (29.3, 1)}
+CHANNELS = ['BANK_ACCOUNT', 'GOPAY', 'PAYPAL', 'BITCOIN', 'PRSMS']
+CARD_CHANNEL = 'PAYMENT_CARD'
+CARD_TYPES = ['VISA', 'VISA ELECTRON', 'MASTERCARD', 'MAESTRO']
+CARD_SERVICE_TYPES = ['STANDARD', 'PREMIUM']
+AREAS_OF_EVENT = ['DOMESTIC', 'EEA', 'NON_EEA']
+STATES = ['PAID'] * 14 + ['PARTIALLY_REFUNDED', 'REFUNDED', 'CANCELED', 'TIMEOUTED', 'CREATED']
+EXCEPTION_PARTNERSHIP = '33198173'
+
+FEE_COLUMNS = ['payment_channel', 'currency', 'valid_from', 'valid_to', 'MID', 'MIN_amount', 'card_type',
+               'card_is_business', 'card_service_type', 'area_of_event', 'cost_algorithm', 'transaction_fee',
+               'transaction_fee_currency', 'fee']
+SESSION_COLUMNS = ['payment_session_id', 'date_created', 'date_performed', 'session_state', 'payment_channel',
+                   'currency', 'mid', 'partnership_id', 'amount', 'amount_refunded', 'card_type', 'card_is_business',
+                   'card_service_type', 'card_aoe', 'interchange_fee', 'association_fee', 'payment_instrument']
+
+
+def write_rates(tables, date_from, date_to, rnd):
+    """
+    Daily rates (working days) from a week before date_from to date_to
+    """
+    with open(os.path.join(tables, 'gopay_rates.csv'), mode='w', encoding='utf-8', newline='') as g, \
+            open(os.path.join(tables, 'eur_rates.csv'), mode='w', encoding='utf-8', newline='') as e:
+
+        gopay = csv.writer(g)
+        gopay.writerow(['relevant_date', 'target_currency', 'price', 'target_currency_amount'])
+        eur = csv.writer(e)
+        eur.writerow(['date', 'toCurrency', 'rate'])
+
+        day = date_from - datetime.timedelta(days=7)
+        while day <= date_to:
+            if day.weekday() < 5:
+                czk = {c: (price * rnd.uniform(0.97, 1.03), amount) for c, (price, amount) in
+                       ((c, v) for c, v in CURRENCIES.items() if v is not None)}
+
+                for c, (price, amount) in czk.items():
+                    gopay.writerow([day.isoformat(), c, '%.3f' % price, amount])
+
+                eur_czk = czk['EUR'][0]
+                for c, (price, amount) in czk.items():
+                    if c != 'EUR':
+                        eur.writerow([day.isoformat(), c, '%.4f' % (eur_czk / (price / amount))])
+                eur.writerow([day.isoformat(), 'CZK', '%.4f' % eur_czk])
+
+            day += datetime.timedelta(days=1)
+
+
+def write_fees(tables, date_from, mids):
+    """
+    Fee sheet - two validity periods, exactly one fee applicable for every generated payment
+    """
+    change = (date_from + datetime.timedelta(days=180)).isoformat()
+    before = (date_from + datetime.timedelta(days=179)).isoformat()
+    start = (date_from - datetime.timedelta(days=30)).isoformat()
+    fees = []
+
+    for periods, (valid_from, valid_to) in enumerate([(start, before), (change, '')]):
+        for channel in CHANNELS:
+            fees.append([channel, '', valid_from, valid_to, '', '', '', '', '', '', 'STD', '2,50', 'CZK', '1,2 %'])
+            fees.append([channel, 'EUR', valid_from, valid_to, '', '0', '', '', '', '', 'STD-MAX', '0.25', 'EUR',
+                         '0.9'])
+            fees.append([channel, 'EUR', valid_from, valid_to, '', '1000', '', '', '', '', 'STD', '0.2', 'EUR', '0.7'])
+            for mid in mids[:3]:
+                fees.append([channel, '', valid_from, valid_to, mid, '', '', '', '', '', 'STD', '1', '', '0.5'])
+
+        for card_type in CARD_TYPES:
+            card = [CARD_CHANNEL, '', valid_from, valid_to, '', '', card_type]
+            fees.append(card + ['', '', '', 'IFPP', '1', 'CZK', '0.25'])
+            fees.append(card + ['TRUE', '', '', 'IFPP_FIX_CP', '', '', '1.9'])
+            fees.append(card + ['', 'PREMIUM', '', 'IFPP', '0.5', 'EUR', '0.45'])
+            fees.append(card + ['', '', 'NON_EEA', 'IFPP', '2', 'CZK', '0.6'])
+
+        for mid in mids[3:5]:
+            fees.append([CARD_CHANNEL, '', valid_from, valid_to, mid, '', ', '.join(CARD_TYPES), '', '', '',
+                         'IFPP_FIX_CP', '0.5', 'EUR', '1.1'])
+
+    with open(os.path.join(tables, 'payment_fees.csv'), mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(FEE_COLUMNS)
+        writer.writerows(fees)
+
+
+def write_sessions(tables, sessions, date_from, days, mids, rnd):
+    """
+    Payment sessions ordered by date_performed
+    """
+    currencies = ['CZK'] * 6 + ['EUR'] * 3 + [c for c in CURRENCIES if c not in ('CZK', 'EUR')]
+    channels = CHANNELS + [CARD_CHANNEL] * len(CHANNELS)
+    partnerships = [EXCEPTION_PARTNERSHIP] + [str(1000 + i) for i in range(200)]
+    start = datetime.datetime.combine(date_from, datetime.time())
+    step = days * 86400 / sessions
+
+    with open(os.path.join(tables, 'payments-sessions-stage.csv'), mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SESSION_COLUMNS)
+
+        for i in range(sessions):
+            performed = start + datetime.timedelta(seconds=int(i * step))
+            created = performed - datetime.timedelta(seconds=rnd.randint(5, 900))
+            state = rnd.choice(STATES)
+            channel = rnd.choice(channels)
+            amount = round(rnd.lognormvariate(6, 1.4), 2)
+            refunded = {'REFUNDED': amount, 'PARTIALLY_REFUNDED': round(amount * rnd.random(), 2)}.get(state, '')
+            row = [str(3000000000 + i), created.strftime('%Y-%m-%d %H:%M:%S'),
+                   performed.strftime('%Y-%m-%d %H:%M:%S') + '.%03d' % rnd.randint(0, 999), state, channel,
+                   rnd.choice(currencies), rnd.choice(mids) if rnd.random() < 0.3 else '', rnd.choice(partnerships),
+                   '%.2f' % amount, refunded if refunded == '' else '%.2f' % refunded]
+
+            if channel == CARD_CHANNEL:
+                row += [rnd.choice(CARD_TYPES), 'TRUE' if rnd.random() < 0.1 else 'FALSE',
+                        rnd.choice(CARD_SERVICE_TYPES), rnd.choice(AREAS_OF_EVENT), '%.4f' % (amount * 0.002),
+                        '%.4f' % (amount * 0.0005), 'CARD']
+            else:
+                row += ['', '', '', '', '', '', channel]
+
+            writer.writerow(row)
+
+
+def write_config(data, date_from):
+    """
+    config.json
+    """
+    config = {'parameters': {
+        'date_performed_from': date_from.isoformat(),
+        'partnership_cost_exceptions': {
+            EXCEPTION_PARTNERSHIP: [{'merchant': 'Benchmark', 'description': 'synthetic', 'podio_link': '',
+                                     'date_from': date_from.isoformat(), 'date_to': None, 'gopay_percent': 0.5}]
+        }
+    }}
+
+    with open(os.path.join(data, 'config.json'), mode='w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+
+def generate(data, sessions, date_from=datetime.date(2021, 1, 1), days=365, seed=1):
+    """
+    Generate the data folder
+    """
+    rnd = random.Random(seed)
+    tables = os.path.join(data, 'in', 'tables')
+    for folder in (tables, os.path.join(data, 'in', 'files'), os.path.join(data, 'out', 'tables'),
+                   os.path.join(data, 'out', 'files')):
+        os.makedirs(folder, exist_ok=True)
+
+    mids = ['M%03d' % i for i in range(50)]
+    write_config(data, date_from)
+    write_rates(tables, date_from, date_from + datetime.timedelta(days=days), rnd)
+    write_fees(tables, date_from, mids)
+    write_sessions(tables, sessions, date_from, days, mids, rnd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', required=True, help='data folder to write')
+    parser.add_argument('--sessions', type=int, default=10000, help='number of payment sessions (10k - 10M)')
+    parser.add_argument('--date-from', default='2021-01-01', help='first date_performed')
+    parser.add_argument('--days', type=int, default=365, help='days of payment sessions')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    generate(args.data, args.sessions, datetime.date.fromisoformat(args.date_from), args.days, args.seed)
@@ -0,0 +1,62 @@
+"""
+Partitioned backfill of the payment costs (lib/backfill.py) - plan the jobs, compute them on the nodes
+(or locally in several processes) and merge their outputs.
+
+    python backfill.py plan --plan /shared/backfill [--window month | --window-days 7]
+    python backfill.py run /shared/backfill/2019-01-01_2019-01-31/job.json
+    python backfill.py local --plan /shared/backfill --nodes 4
+    python backfill.py merge --plan /shared/backfill
+"""
+import argparse
+import logging
+import os
+import sys
+
+from lib import backfill
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Partitioned backfill of the payment costs')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan = commands.add_parser('plan', help='split the payment sessions to the jobs of the plan directory')
+    plan.add_argument('--data', default='../data', help='data folder with config.json and in/tables')
+    plan.add_argument('--plan', required=True, help='plan directory')
+    plan.add_argument('--window-days', type=int, default=None, help='days of a partition, calendar months if not set')
+
+    run = commands.add_parser('run', help='compute one job - a node')
+    run.add_argument('job', help='job.json of the partition')
+
+    local = commands.add_parser('local', help='compute all jobs in local processes acting as the nodes')
+    local.add_argument('--plan', required=True, help='plan directory')
+    local.add_argument('--nodes', type=int, default=os.cpu_count())
+
+    merge = commands.add_parser('merge', help='merge the outputs of the jobs to the payment_costs table')
+    merge.add_argument('--plan', required=True, help='plan directory')
+    merge.add_argument('--out', default='../data/out/tables/payment_costs.csv')
+
+    args = parser.parse_args()
+
+    # logging setup
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, datefmt='%Y-%m-%d %H:%M:%S%z',
+                        format='%(asctime)s | %(module)s | %(levelname)s | %(message)s')
+
+    if args.command == 'plan':
+        if args.window_days is not None and args.window_days < 1:
+            logging.error('Wrong value of --window-days! It has to be 1 or more.')
+            raise Exception('Wrong value of --window-days! It has to be 1 or more.')
+        backfill.plan(args.data, args.plan, 'month' if args.window_days is None else args.window_days)
+    elif args.command == 'run':
+        backfill.run_job(args.job)
+    elif args.command == 'local':
+        backfill.run_local(args.plan, args.nodes)
+    else:
+        backfill.merge(args.plan, args.out)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        logging.exception(exc)
+        exit(2)
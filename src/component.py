@@ -2,13 +2,14 @@
 Template Component main class.
 
 """
-import csv
 import logging
-from datetime import datetime
+import sys
 
 from keboola.component.base import ComponentBase
 from keboola.component.exceptions import UserException
 
+from lib import config, run
+
 # configuration variables
 # # test
 
@@ -37,88 +38,32 @@ class Component(ComponentBase):
         Main execution code
         """
 
-        import logging, csv, sys, datetime
-        from lib import config, fee, payment, rate
-        
         # logging setup
         logging.basicConfig(level=logging.DEBUG, stream=sys.stdout, datefmt='%Y-%m-%d %H:%M:%S%z', format='%(asctime)s | %(module)s | %(levelname)s | %(message)s')
-        
-        # loading cost fee definitions
-        fees = fee.Fees('../data/in/tables/payment_fees.csv').get_fees()
-
-        # loading currency rates
-        rates = rate.Rates( '../data/in/tables/gopay_rates.csv', # gopay rates loaded from CNB
-                            '../data/in/tables/eur_rates.csv' # EUR from Keboola
-                        ).set_rates()
 
         # config parameters
-        cfg = config.Config().set_parameters()
-        cfg_date_from = cfg.get_date_from()
-        cfg_exceptions = cfg.get_cost_exceptions()
-
-        # in/out file for payment sessions
-        with open('../data/in/tables/payments-sessions-stage.csv', mode='r', encoding='utf-8') as ps, \
-            open('../data/out/tables/payment_costs.csv' , mode='w', encoding='utf-8') as pc:
-            
-            payments = csv.DictReader(ps) # reader of payment sessions
-            fieldnames = ['payment_session_id', 'amount', 'amount_czk',
-                        'amount_refunded', 'amount_refunded_czk','cost_algorithm',
-                        'interchange_fee', 'interchange_fee_czk', 'association_fee', 
-                        'association_fee_czk', 'provider_transaction_fee', 'provider_transaction_fee_czk',
-                        'provider_percent_fee', 'provider_percent_fee_czk','total_fee', 'total_fee_czk']
-            writer = csv.DictWriter(pc, fieldnames=fieldnames)
-            writer.writeheader()
-
-            # counter
-            stats = {'processed': 0, 'ignored': 0}
-            
-            # loop over payment sessions in in-file
-            for ps in payments:
-
-                # ignore ps before a date_performed_from set in config
-                try:
-                    ps_date_performed = datetime.datetime.strptime(ps['date_performed'][0:10],'%Y-%m-%d').date()
-                    if cfg_date_from > ps_date_performed:
-                        stats['ignored'] += 1
-                        continue
-
-                except Exception as e:
-                    logging.error('Cannot parse date_performed for payment: {}' . format(ps))
-                    raise e
-
-                # only successful payments
-                if ps['session_state'] in ('PAID', 'PARTIALLY_REFUNDED', 'REFUNDED'):
-
-                    # prepare payment details
-                    p = payment.Payment(ps, fees, rates, cfg_exceptions).process_payment()
-
-                    # final payment output
-                    p_final = {
-                        'payment_session_id': p.parsed['payment_session_id'],
-                        'amount': p.parsed['amount'],
-                        'amount_czk': p.parsed['amount_czk'],
-                        'amount_refunded': p.parsed['amount_refunded'],
-                        'amount_refunded_czk': p.parsed['amount_refunded_czk'],
-                        'cost_algorithm': p.parsed['cost_algorithm'],
-                        'interchange_fee': p.parsed['interchange_fee'],
-                        'interchange_fee_czk': p.parsed['interchange_fee_czk'],
-                        'association_fee': p.parsed['association_fee'], 
-                        'association_fee_czk': p.parsed['association_fee_czk'],
-                        'provider_transaction_fee': p.parsed['provider_transaction_fee'], 
-                        'provider_transaction_fee_czk': p.parsed['provider_transaction_fee_czk'],
-                        'provider_percent_fee': p.parsed['provider_percent_fee'], 
-                        'provider_percent_fee_czk': p.parsed['provider_percent_fee_czk'],
-                        'total_fee': p.parsed['total_fee'], 
-                        'total_fee_czk': p.parsed['total_fee_czk']
-                    }
-
-                    # writer row to file
-                    writer.writerow(p_final)
-                    
-                    stats['processed'] += 1
-
-
-        logging.info('Finished! Run stats: {}'. format(str(stats)))
+        cfg = config.Config(self.data_folder_path).set_parameters()
+        costs_run = run.Run(self.data_folder_path, cfg.params, cfg.get_date_from(), cfg.get_cost_exceptions(),
+                            workers=cfg.get_workers(), incremental=cfg.get_incremental(),
+                            lookback_days=cfg.get_lookback_days(), engine=cfg.get_engine(), metrics=cfg.get_metrics(),
+                            fault_tolerant=cfg.get_fault_tolerant(), max_error_rate=cfg.get_max_error_rate(),
+                            checkpoint=cfg.get_checkpoint(), pipeline=cfg.get_pipeline(),
+                            pipeline_queue_size=cfg.get_pipeline_queue_size(), output_slices=cfg.get_output_slices(),
+                            output_gzip=cfg.get_output_gzip(), format=cfg.get_format(),
+                            cache_dir=cfg.get_cache_dir(), prune_inputs=cfg.get_prune_inputs(),
+                            output_mode=cfg.get_output_mode(), fee_impact=cfg.get_fee_impact(),
+                            diff_store=cfg.get_diff_store(), diff_deletions=cfg.get_diff_deletions(),
+                            shadow_rate=cfg.get_shadow_rate(), dedup=cfg.get_dedup(),
+                            dedup_max_entries=cfg.get_dedup_max_entries())
+
+        # incremental mode - the state of the last run
+        costs_run.run(self.get_state_file() if costs_run.incremental else None)
+
+        if costs_run.state is not None:
+            self.write_state_file(costs_run.state)
+
+        for table, definition in costs_run.manifests:
+            self.write_manifest(self.create_out_table_definition(table, **definition))
 
 
 
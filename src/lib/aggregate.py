@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+Aggregated output - counts and exact sums of the payment costs by day, partnership, payment channel, currency
+and cost algorithm, kept in memory while the payments are streamed. The memory depends on the number of groups,
+not on the number of payments.
+"""
+
+import csv
+import operator
+from decimal import Context, Decimal, Inexact
+
+from lib import payment
+
+D = Decimal
+
+# columns of the payment output needed for the groups - added to the output of payment.process_sessions
+GROUP_INPUT_FIELDS = ['date_performed', 'partnership_id', 'payment_channel', 'currency']
+
+# columns of the aggregated output
+GROUP_FIELDS = ['date', 'partnership_id', 'payment_channel', 'currency', 'cost_algorithm']
+SUM_FIELDS = [k for k in payment.OUTPUT_FIELDS if k not in ('payment_session_id', 'cost_algorithm')]
+AGGREGATE_FIELDS = GROUP_FIELDS + ['count'] + SUM_FIELDS
+
+# output of payment.process_sessions in the aggregated mode
+INPUT_FIELDS = payment.OUTPUT_FIELDS + GROUP_INPUT_FIELDS
+
+# sums are exact - an inexact sum fails instead of rounding
+EXACT = Context(prec=60, traps=[Inexact])
+
+get_sums = operator.itemgetter(*SUM_FIELDS)
+
+
+class Aggregates():
+    """
+    Running counts and sums per group. It is a writer of the payment output rows (writerow, writerows),
+    so it can be used in place of the csv writer.
+    """
+
+    def __init__(self):
+        self.groups = {}  # group key -> [count, sums in the SUM_FIELDS order]
+
+    def writerow(self, row):
+        """
+        Add a payment output row with the GROUP_INPUT_FIELDS columns
+        """
+        key = (row['date_performed'].isoformat()[0:10], row['partnership_id'], row['payment_channel'], row['currency'],
+               row['cost_algorithm'])
+
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0] + [D(0)] * len(SUM_FIELDS)
+
+        group[0] += 1
+        # values are Decimal or text
+        group[1:] = map(EXACT.add, group[1:], map(D, get_sums(row)))
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def merge(self, other):
+        """
+        Add the groups of other (i.e. of a chunk)
+        """
+        for key, other_group in other.groups.items():
+            group = self.groups.get(key)
+            if group is None:
+                self.groups[key] = list(other_group)
+                continue
+
+            group[0] += other_group[0]
+            for i in range(1, len(group)):
+                group[i] = EXACT.add(group[i], other_group[i])
+
+        return self
+
+    def get_rows(self):
+        """
+        Rows of the aggregated output sorted by the group
+        """
+        for key in sorted(self.groups, key=lambda k: tuple('' if v is None else v for v in k)):
+            group = self.groups[key]
+            row = dict(zip(GROUP_FIELDS, key))
+            row['count'] = group[0]
+            row.update(zip(SUM_FIELDS, group[1:]))
+            yield row
+
+    def write(self, path):
+        """
+        Write the aggregated output table
+        """
+        with open(path, mode='w', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=AGGREGATE_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.get_rows())
+
+
+class RowWriter():
+    """
+    Writer of the payment output rows to the writer and to the aggregates - both outputs at once
+    """
+
+    def __init__(self, writer, aggregates):
+        self.writer = writer
+        self.aggregates = aggregates
+
+    def writerow(self, row):
+        self.aggregates.writerow(row)
+        self.writer.writerow({k: row[k] for k in payment.OUTPUT_FIELDS})
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+Library API - the cost calculation of payment sessions in-process, without the input and output tables.
+
+    from lib import api
+
+    fees = api.load_fees(fee_path)
+    rates = api.load_rates(gopay_rates_path, eur_rates_path)
+    for cost in api.calculate_costs(sessions, fees, rates, exceptions):
+        ...
+
+Sessions are mappings with the columns of the payment sessions table (payment.INPUT_COLUMNS) as text, numbers
+can be Decimal too. Costs are dicts of the payment output columns, the values are Decimal. The file run
+of the component (lib/run.py) is built on top of it.
+"""
+
+import datetime
+
+from lib import cache, payment
+
+
+def load_fees(fee_path, cache_dir=None, scope=None):
+    """
+    Fee index of the fee sheet - from the cache directory (lib/cache.py), if set, only fees of the scope
+    (lib/scope.py), if set
+    """
+    return cache.get_fees(fee_path, cache_dir, scope)
+
+
+def load_rates(gopay_rates_path, eur_rates_path, cache_dir=None, scope=None):
+    """
+    Rates of the rate tables - from the cache directory, if set, only rates of the scope, if set
+    """
+    return cache.get_rates(gopay_rates_path, eur_rates_path, cache_dir, scope)
+
+
+def calculate_costs(sessions, fees, rates, exceptions, date_from=datetime.date.min, since=None, engine='decimal',
+                    stats=None, metrics=None, rejects=None, fields=payment.OUTPUT_FIELDS, shadow=None):
+    """
+    Costs of the payment sessions - a generator, the sessions are read lazily and every cost is yielded
+    as soon as it is computed. Only successful payments performed on or after date_from (and after since,
+    if set) are processed.
+    sessions    iterable of payment session mappings
+    fees        fee index, load_fees()
+    rates       rates, load_rates()
+    exceptions  cost exceptions, Config.get_cost_exceptions()
+    engine      'decimal' or 'batch'
+    stats       run counters (payment.get_stats()), if set
+    metrics     stage timers (lib/metrics.py), if set
+    rejects     failing payments are rejected to rejects (errors.Rejects), if set, otherwise the error is raised
+    fields      columns of the costs
+    shadow      a sample of the costs is verified by the reference path (lib/shadow.py), if set
+    """
+    if stats is None:
+        stats = payment.get_stats()
+
+    if shadow is None:
+        return payment.process_sessions(sessions, fees, rates, date_from, exceptions, stats, since, engine, metrics,
+                                        rejects, fields)
+
+    # the fee rule of the output is compared too
+    costs = payment.process_sessions(shadow.sample(sessions), fees, rates, date_from, exceptions, stats, since, engine,
+                                     metrics, rejects, fields if 'fee_rule' in fields else fields + ['fee_rule'])
+    return shadow.verify(costs, fields)
+
+
+def calculate_costs_batch(sessions, fees, rates, exceptions, **kwargs):
+    """
+    Costs of a list of payment sessions as a list, same arguments as calculate_costs
+    """
+    return list(calculate_costs(sessions, fees, rates, exceptions, **kwargs))
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+"""
+Partitioned backfill - the history of the payment sessions is split by date_performed into windows (months or
+a number of days) computed as independent jobs, i.e. on separate nodes, and merged into one payment_costs table.
+
+    plan    the sessions are split to the partition directories of the plan directory, each with a job spec
+            (job.json) and the input of the job. The fee and rate files are copied to the plan directory,
+            so a node needs only the plan directory (shared or copied).
+    run     a node computes one job - only fees and rates of the window and currencies of the job are loaded,
+            the output and run stats are written to the partition directory
+    merge   the outputs of all jobs are concatenated in the order of the plan and their stats are added up,
+            a job missing or computed from another spec fails the merge
+
+Every session is in exactly one partition (those before the first window in the first one), so the merged
+output and stats are the same as of one run over the whole history, the rows are ordered by the partition.
+"""
+
+import bisect
+import csv
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from lib import api, config, dedup, payment, scope, tables
+
+PLAN_FILE = 'plan.json'
+JOB_FILE = 'job.json'
+STATS_FILE = 'stats.json'
+SESSIONS_FILE = 'payments-sessions-stage.csv'
+COSTS_FILE = 'payment_costs.csv'
+
+# input files of the run copied to the plan directory
+INPUT_FILES = ('payment_fees.csv', 'gopay_rates.csv', 'eur_rates.csv')
+
+
+def get_windows(date_from, date_to, window='month'):
+    """
+    Windows covering the days from date_from to date_to - calendar months or window days long
+    Returns     list of (first day, last day)
+    """
+    windows = []
+    start = date_from
+
+    while start <= date_to:
+        if window == 'month':
+            end = (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+        else:
+            end = start + datetime.timedelta(days=window - 1)
+        windows.append((start, end))
+        start = end + datetime.timedelta(days=1)
+
+    return windows
+
+
+def get_partition_name(window):
+    return '{}_{}' . format(window[0].isoformat(), window[1].isoformat())
+
+
+def get_digest(path):
+    with open(path, mode='rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def plan(data_dir, plan_dir, window='month'):
+    """
+    Split the payment sessions of the data folder to the jobs of the plan directory
+    window      'month' or a number of days
+    Returns     the plan - partitions in order and the stats of the split (superseded versions of the sessions)
+    """
+    cfg = config.Config(data_dir).set_parameters()
+    date_from = cfg.get_date_from()
+    tables_dir = os.path.join(data_dir, 'in', 'tables')
+    sessions_path = tables.get_input_path(os.path.join(tables_dir, SESSIONS_FILE))
+
+    if os.path.exists(plan_dir) and os.listdir(plan_dir):
+        logging.error('Backfill: the plan directory {} is not empty.' . format(plan_dir))
+        raise Exception('Backfill: the plan directory {} is not empty.' . format(plan_dir))
+
+    os.makedirs(os.path.join(plan_dir, 'in'), exist_ok=True)
+    for name in INPUT_FILES:
+        shutil.copyfile(os.path.join(tables_dir, name), os.path.join(plan_dir, 'in', name))
+
+    # windows from the first processed day to the last day of the sessions
+    run_scope = scope.get_scope(sessions_path, date_from)
+    windows = get_windows(run_scope.date_from, run_scope.date_to, window)
+    starts = [w[0].isoformat() for w in windows]
+    first_day = starts[0]
+
+    # superseded versions of the sessions are left out of the jobs
+    stats = payment.get_stats()
+    payments = tables.read_table(sessions_path, payment.INPUT_COLUMNS)
+    run_dedup = None
+    if cfg.get_dedup():
+        run_dedup = dedup.Dedup(sessions_path, cfg.get_dedup_max_entries()).index()
+        payments = run_dedup.select(payments, stats)
+
+    # split - sessions before the first window (ignored by the job) and with a wrong date to the first partition
+    files = {}
+    writers = {}
+    currencies = {}
+    try:
+        for ps in payments:
+            day = ps['date_performed'][0:10]
+            i = max(0, bisect.bisect_right(starts, day) - 1)
+
+            if i not in writers:
+                partition_dir = os.path.join(plan_dir, get_partition_name(windows[i]))
+                os.makedirs(partition_dir)
+                files[i] = open(os.path.join(partition_dir, SESSIONS_FILE), mode='w', encoding='utf-8', newline='')
+                writers[i] = csv.DictWriter(files[i], fieldnames=payment.INPUT_COLUMNS, extrasaction='ignore')
+                writers[i].writeheader()
+                currencies[i] = set()
+
+            writers[i].writerow(ps)
+            if day >= first_day and ps['session_state'] in payment.SUCCESSFUL_STATES:
+                currencies[i].add(ps['currency'])
+
+    finally:
+        for f in files.values():
+            f.close()
+        if run_dedup is not None:
+            run_dedup.remove()
+
+    # job specs of the partitions with sessions
+    partitions = []
+    for i in sorted(writers):
+        name = get_partition_name(windows[i])
+        spec = {'partition': name, 'date_from': windows[i][0].isoformat(), 'date_to': windows[i][1].isoformat(),
+                'currencies': sorted(currencies[i]), 'parameters': cfg.params}
+        with open(os.path.join(plan_dir, name, JOB_FILE), mode='w', encoding='utf-8') as f:
+            json.dump(spec, f, indent=2, sort_keys=True)
+        partitions.append(name)
+
+    result = {'partitions': partitions, 'stats': stats}
+    with open(os.path.join(plan_dir, PLAN_FILE), mode='w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+
+    logging.info('Backfill: {} jobs planned in {}.' . format(len(partitions), plan_dir))
+    return result
+
+
+def run_job(job_path):
+    """
+    Compute the job of a partition - a node of the backfill
+    Returns     run stats of the job
+    """
+    partition_dir = os.path.dirname(os.path.abspath(job_path))
+    input_dir = os.path.join(os.path.dirname(partition_dir), 'in')
+    with open(job_path, mode='r', encoding='utf-8') as f:
+        spec = json.load(f)
+
+    cfg = config.Config(None).set_parameters(spec['parameters'])
+    job_scope = scope.Scope(spec['currencies'], payment.parse_day(spec['date_from']),
+                            payment.parse_day(spec['date_to']))
+
+    # fees and rates of the window only
+    fees = api.load_fees(os.path.join(input_dir, INPUT_FILES[0]), cfg.get_cache_dir(), job_scope)
+    rates = api.load_rates(os.path.join(input_dir, INPUT_FILES[1]), os.path.join(input_dir, INPUT_FILES[2]),
+                           cfg.get_cache_dir(), job_scope.with_fee_currencies(fees))
+
+    stats = payment.get_stats()
+    costs_path = os.path.join(partition_dir, COSTS_FILE)
+    with open(costs_path + '.tmp', mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=payment.OUTPUT_FIELDS)
+        writer.writeheader()
+        writer.writerows(api.calculate_costs(tables.read_table(os.path.join(partition_dir, SESSIONS_FILE)), fees, rates,
+                                             cfg.get_cost_exceptions(), cfg.get_date_from(), engine=cfg.get_engine(),
+                                             stats=stats))
+    os.replace(costs_path + '.tmp', costs_path)
+
+    # the stats mark the job as finished
+    with open(os.path.join(partition_dir, STATS_FILE), mode='w', encoding='utf-8') as f:
+        json.dump({'job': get_digest(job_path), 'stats': stats}, f)
+
+    logging.info('Backfill: job {} finished, run stats: {}' . format(spec['partition'], stats))
+    return stats
+
+
+def run_local(plan_dir, nodes):
+    """
+    Compute all jobs of the plan in a pool of processes acting as the nodes
+    """
+    with open(os.path.join(plan_dir, PLAN_FILE), mode='r', encoding='utf-8') as f:
+        partitions = json.load(f)['partitions']
+
+    with ProcessPoolExecutor(max_workers=nodes) as pool:
+        list(pool.map(run_job, [os.path.join(plan_dir, name, JOB_FILE) for name in partitions]))
+
+
+def merge(plan_dir, costs_path):
+    """
+    Merge the outputs of the jobs to the payment_costs table
+    Returns     run stats of the whole backfill
+    """
+    with open(os.path.join(plan_dir, PLAN_FILE), mode='r', encoding='utf-8') as f:
+        backfill = json.load(f)
+
+    # all jobs finished from the current specs
+    stats = backfill['stats']
+    for name in backfill['partitions']:
+        stats_path = os.path.join(plan_dir, name, STATS_FILE)
+        if not os.path.exists(stats_path):
+            logging.error('Backfill: job {} is not finished.' . format(name))
+            raise Exception('Backfill: job {} is not finished.' . format(name))
+
+        with open(stats_path, mode='r', encoding='utf-8') as f:
+            job = json.load(f)
+        if job['job'] != get_digest(os.path.join(plan_dir, name, JOB_FILE)):
+            logging.error('Backfill: output of job {} is of another job spec.' . format(name))
+            raise Exception('Backfill: output of job {} is of another job spec.' . format(name))
+
+        payment.merge_stats(stats, job['stats'])
+
+    # rows of the jobs as they are
+    with open(costs_path, mode='w', encoding='utf-8', newline='') as out:
+        csv.writer(out).writerow(payment.OUTPUT_FIELDS)
+        for name in backfill['partitions']:
+            with open(os.path.join(plan_dir, name, COSTS_FILE), mode='r', encoding='utf-8', newline='') as f:
+                f.readline()
+                shutil.copyfileobj(f, out)
+
+    logging.info('Backfill: {} jobs merged, run stats: {}' . format(len(backfill['partitions']), stats))
+    return stats
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batch engine for the cost algorithms.
+
+Payment sessions are read in batches. The payments of a batch are grouped by the fee, the rates and the scheme
+cost multiplier, so the values constant for a group (the fee percent, the provider transaction fees, the zero
+values) are computed once, and the costs of the group are computed in one loop with the same Decimal operations
+as Payment.compute_costs - the results are identical. The fees of the payments are cached by the values the fee
+depends on - payments share the payment channels, currencies, MIDs, card columns and days.
+"""
+
+import bisect
+import itertools
+import time
+
+from lib import payment
+
+BATCH_SIZE = 10000
+ALGORITHMS = ('STD', 'STD-MAX', 'IFPP', 'IFPP_FIX_CP')
+
+# cached fee lookups and fees of the payments, the cache is cleared over it
+MAX_CACHED_LOOKUPS = 100000
+
+DP = payment.DECIMAL_PLACES
+ZERO = payment.D(0).quantize(DP)
+
+
+class Fees():
+    """
+    Fee index with the lookups and the fees of the payments cached
+    """
+
+    def __init__(self, fees):
+        self.fees = fees
+        self.cache = {}
+        self.min_amounts = {}
+        self.resolved = {}
+
+    def find(self, payment_channel, currency, mid, date):
+        """
+        The same as FeeIndex.find, the result must not be changed
+        """
+        key = (payment_channel, currency, mid, date)
+        result = self.cache.get(key)
+        if result is None:
+            if len(self.cache) >= MAX_CACHED_LOOKUPS:
+                self.cache.clear()
+                self.min_amounts.clear()
+            result = self.cache[key] = self.fees.find(payment_channel, currency, mid, date)
+
+        return result
+
+    def get_fee(self, p):
+        """
+        Payment.get_fee of the parsed payment - the fee depends only on the columns of the key, the day and
+        the MIN_amount values of the fees valid for the payment the amount reaches
+        """
+        parsed = p.parsed
+        lookup = (parsed.payment_channel, parsed.currency, parsed.mid, parsed.date_performed.date())
+        min_amounts = self.min_amounts.get(lookup)
+        if min_amounts is None:
+            min_amounts = sorted({f['MIN_amount'] for f in self.find(*lookup) if f['MIN_amount'] is not None})
+            self.min_amounts[lookup] = min_amounts
+
+        # a missing amount fails with the MIN_amount of a fee
+        if min_amounts and parsed.amount is None:
+            return p.get_fee()
+
+        key = lookup + (parsed.card_type, parsed.card_is_business, parsed.card_service_type, parsed.card_aoe,
+                        bisect.bisect_right(min_amounts, parsed.amount) if min_amounts else 0)
+        fee = self.resolved.get(key)
+        if fee is not None:
+            p.fee = fee
+            parsed.fee_rule = fee.rule_id
+            return p
+
+        p.get_fee()
+        if len(self.resolved) >= MAX_CACHED_LOOKUPS:
+            self.resolved.clear()
+        self.resolved[key] = p.fee
+
+        return p
+
+
+class Group():
+    """
+    Payments sharing the fee, the rates and the multiplier
+    """
+
+    def __init__(self, fee, rates, multiplier):
+        self.fee = fee
+        self.rates = rates
+        self.multiplier = multiplier
+        self.payments = []
+
+
+def compute_group(group):
+    """
+    Compute the costs of the payments in the group, results are stored in the parsed payments
+    """
+    fee = group.fee
+    algorithm = fee['cost_algorithm']
+    multiplier = group.multiplier
+    czk_rate, czk_rate_fee, rate_fee = group.rates
+
+    # constant in the group
+    fee_percent = fee['fee'] / 100
+    transaction_fee = fee['transaction_fee']
+    provider_transaction_fee = ZERO if transaction_fee is None else (transaction_fee * rate_fee).quantize(DP)
+    if algorithm == 'STD':
+        provider_transaction_fee_czk = (provider_transaction_fee * czk_rate_fee).quantize(DP)
+    else:
+        provider_transaction_fee_czk = (ZERO if transaction_fee is None
+                                        else (transaction_fee * czk_rate_fee).quantize(DP))
+
+    for p in group.payments:
+        parsed = p.parsed
+
+        # amounts
+        amount = ZERO if parsed.amount is None else parsed.amount.quantize(DP)
+        amount_czk = (amount * czk_rate).quantize(DP)
+        amount_refunded = ZERO if parsed.amount_refunded is None else parsed.amount_refunded.quantize(DP)
+        parsed.amount = amount
+        parsed.amount_czk = amount_czk
+        parsed.amount_refunded = amount_refunded
+        parsed.amount_refunded_czk = (amount_refunded * czk_rate).quantize(DP)
+        parsed.cost_algorithm = algorithm
+
+        # costs
+        if algorithm == 'STD':
+            provider_percent_fee = (amount * fee_percent).quantize(DP)
+            provider_percent_fee_czk = (amount_czk * fee_percent).quantize(DP)
+
+            parsed.provider_transaction_fee = provider_transaction_fee
+            parsed.provider_transaction_fee_czk = provider_transaction_fee_czk
+            parsed.provider_percent_fee = provider_percent_fee
+            parsed.provider_percent_fee_czk = provider_percent_fee_czk
+            parsed.interchange_fee = parsed.interchange_fee_czk = ZERO
+            parsed.association_fee = parsed.association_fee_czk = ZERO
+            parsed.total_fee = (provider_transaction_fee + provider_percent_fee).quantize(DP)
+            parsed.total_fee_czk = (provider_transaction_fee_czk + provider_percent_fee_czk).quantize(DP)
+
+        elif algorithm == 'STD-MAX':
+            max_fee = max([provider_transaction_fee, (amount * fee_percent).quantize(DP)])
+            max_fee_czk = (max_fee * czk_rate).quantize(DP)
+
+            parsed.provider_transaction_fee = parsed.provider_transaction_fee_czk = ZERO
+            parsed.interchange_fee = parsed.interchange_fee_czk = ZERO
+            parsed.association_fee = parsed.association_fee_czk = ZERO
+            parsed.provider_percent_fee = parsed.total_fee = max_fee
+            parsed.provider_percent_fee_czk = parsed.total_fee_czk = max_fee_czk
+
+        else:
+            # scheme fees are not quantized after the multiplier
+            interchange_fee = parsed.interchange_fee
+            interchange_fee = ZERO if interchange_fee is None else interchange_fee.quantize(DP) * multiplier
+            association_fee = parsed.association_fee
+            association_fee = ZERO if association_fee is None else association_fee.quantize(DP) * multiplier
+            interchange_fee_czk = (interchange_fee * czk_rate).quantize(DP)
+            association_fee_czk = (association_fee * czk_rate).quantize(DP)
+
+            parsed.interchange_fee = interchange_fee
+            parsed.association_fee = association_fee
+            parsed.interchange_fee_czk = interchange_fee_czk
+            parsed.association_fee_czk = association_fee_czk
+            parsed.provider_transaction_fee = provider_transaction_fee
+            parsed.provider_transaction_fee_czk = provider_transaction_fee_czk
+
+            if algorithm == 'IFPP':
+                provider_percent_fee = (amount * fee_percent).quantize(DP)
+                provider_percent_fee_czk = (provider_percent_fee * czk_rate).quantize(DP)
+
+                parsed.provider_percent_fee = provider_percent_fee
+                parsed.provider_percent_fee_czk = provider_percent_fee_czk
+                parsed.total_fee = (provider_transaction_fee + provider_percent_fee + interchange_fee
+                                    + association_fee).quantize(DP)
+                parsed.total_fee_czk = (provider_transaction_fee_czk + provider_percent_fee_czk + interchange_fee_czk
+                                        + association_fee_czk).quantize(DP)
+
+            else:
+                volume_fee = amount * fee_percent
+                volume_fee_czk = amount_czk * fee_percent
+
+                parsed.provider_percent_fee = (volume_fee - (interchange_fee + association_fee)).quantize(DP)
+                parsed.provider_percent_fee_czk = (volume_fee_czk
+                                                   - (interchange_fee_czk + association_fee_czk)).quantize(DP)
+                parsed.total_fee = (volume_fee + provider_transaction_fee).quantize(DP)
+                parsed.total_fee_czk = (volume_fee_czk + provider_transaction_fee_czk).quantize(DP)
+
+
+def is_grouped(p):
+    """
+    The payment can be computed in a group - a known algorithm with a fee percent
+    """
+    return p.fee['cost_algorithm'] in ALGORITHMS and p.fee['fee'] is not None
+
+
+def process_batches(payments, fees, rates, date_from, exceptions, stats, since=None, batch_size=BATCH_SIZE,
+                    metrics=None, rejects=None, fields=payment.OUTPUT_FIELDS):
+    """
+    Process payment sessions in batches - yield the same output as payment.process_sessions
+    """
+    fees = Fees(fees)
+    sessions = payment.select_sessions(payments, date_from, stats, since, rejects)
+
+    while True:
+        batch = list(itertools.islice(sessions, batch_size))
+        if not batch:
+            break
+
+        # group payments by the fee, rates and multiplier
+        groups = {}
+        batch_payments = []
+        for ps in batch:
+            p = payment.Payment(ps, fees, rates, exceptions)
+            try:
+                if metrics is None:
+                    fees.get_fee(p.parse_payment()).get_payment_rates()
+                else:
+                    start = time.perf_counter()
+                    p.parse_payment()
+                    parsed = time.perf_counter()
+                    fees.get_fee(p)
+                    fee_found = time.perf_counter()
+                    p.get_payment_rates()
+                    metrics.add('parse', parsed - start)
+                    metrics.add('fee', fee_found - parsed)
+                    metrics.add('rate', time.perf_counter() - fee_found)
+                    metrics.add_payment(p.fee['cost_algorithm'], p.parsed['payment_channel'], fee_found - parsed, 0.0)
+
+                if is_grouped(p):
+                    key = (id(p.fee), id(p.payment_rates), p.multiplier)
+                    if key not in groups:
+                        groups[key] = Group(p.fee, p.payment_rates, p.multiplier)
+                    groups[key].payments.append(p)
+
+                # others (deprecated fees, ...) by the reference path
+                elif metrics is None:
+                    p.compute_costs()
+                else:
+                    start = time.perf_counter()
+                    p.compute_costs()
+                    metrics.add('cost', time.perf_counter() - start)
+
+            except Exception as e:
+                if rejects is None:
+                    raise e
+                rejects.add(ps, e, stats)
+                continue
+
+            batch_payments.append(p)
+
+        # a failing group is computed again payment by payment (from the raw payments, the group may have changed
+        # the parsed values), only the failing payments are rejected
+        failed = set()
+        for group in groups.values():
+            start = time.perf_counter()
+            try:
+                compute_group(group)
+
+            except Exception as e:
+                if rejects is None:
+                    raise e
+
+                for p in group.payments:
+                    try:
+                        p.prepare_payment().compute_costs()
+                    except Exception as e:
+                        rejects.add(p.raw, e, stats)
+                        failed.add(id(p))
+
+            if metrics is not None:
+                metrics.add('cost', time.perf_counter() - start)
+
+        # final payment output in the input order
+        for p in batch_payments:
+            if failed and id(p) in failed:
+                continue
+            yield {k: p.parsed[k] for k in fields}
+
+        stats['processed'] += len(batch_payments) - len(failed)
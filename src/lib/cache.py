@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of the compiled fees (FeeIndex) and rates (Rates with the day tables).
+
+A cache file is a pickle of the content hash of the source files followed by the compiled structure. The hash is
+read first, so a stale cache costs only the hashing of the sources, and the structure is rebuilt and saved again.
+Structures of a scope (lib/scope.py) have a cache file of their own, the least recently used files over
+MAX_ENTRIES of a structure are removed. The cache directory has to be private to the component - pickles are loaded
+without any other check.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+
+from lib import fee, rate
+
+# bump when the compiled structures change, old cache files are then rebuilt
+CACHE_VERSION = 4
+
+# cache files of a structure (fees, rates) - the unscoped one and the scoped ones of the recent runs
+MAX_ENTRIES = 16
+
+
+def get_key(paths, scope=None):
+    """
+    Content hash of the source files and the scope of the run (lib/scope.py), if set
+    Returns     hex digest
+    """
+    h = hashlib.sha256(str(CACHE_VERSION).encode('utf-8'))
+    h.update(repr(scope).encode('utf-8'))
+
+    for path in paths:
+        with open(path, mode='rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+
+class Cache():
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, name, scope=None):
+        """
+        Cache file of the structure, a file of its own for each scope
+        """
+        if scope is not None:
+            name += '-' + hashlib.sha1(repr(scope).encode('utf-8')).hexdigest()[0:16]
+        return os.path.join(self.directory, name + '.pickle')
+
+    def load(self, name, key, scope=None):
+        """
+        Return the cached structure of the same key or None
+        """
+        path = self.get_path(name, scope)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, mode='rb') as f:
+                if pickle.load(f) != key:
+                    logging.info('Cache: {} changed, rebuilding.' . format(name))
+                    return None
+                value = pickle.load(f)
+
+            # the least recently used files are removed
+            os.utime(path)
+            return value
+
+        except Exception:
+            logging.warning('Cache {} cannot be read, rebuilding.' . format(path))
+            return None
+
+    def save(self, name, key, value, scope=None):
+        """
+        Save the structure - atomic replace, a crash cannot leave a half-written cache file
+        and parallel workers do not write to the same file
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.get_path(name, scope)
+        tmp = '{}.{}.tmp' . format(path, os.getpid())
+
+        with open(tmp, mode='wb') as f:
+            pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self.evict(name)
+
+    def evict(self, name):
+        """
+        Remove the least recently used cache files of the structure over MAX_ENTRIES
+        """
+        paths = [os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                 if f.endswith('.pickle') and (f == name + '.pickle' or f.startswith(name + '-'))]
+        if len(paths) <= MAX_ENTRIES:
+            return
+
+        paths.sort(key=lambda path: os.stat(path).st_mtime_ns, reverse=True)
+        for path in paths[MAX_ENTRIES:]:
+            try:
+                os.remove(path)
+            except OSError:
+                # removed by a parallel worker
+                pass
+
+    def get(self, name, paths, build, scope=None):
+        """
+        Cached structure of the source files, build() is called on a missing or stale cache
+        """
+        key = get_key(paths, scope)
+        value = self.load(name, key, scope)
+
+        if value is None:
+            value = build()
+            try:
+                self.save(name, key, value, scope)
+            except Exception:
+                logging.warning('Cache {} cannot be saved.' . format(self.get_path(name, scope)))
+        else:
+            logging.info('Cache: {} loaded.' . format(name))
+
+        return value
+
+
+def get_fees(fee_path, cache_dir=None, scope=None):
+    """
+    Fee index - from the cache directory, if set, only fees of the scope, if set
+    """
+    def build():
+        return fee.Fees(fee_path, scope).get_index()
+
+    if not cache_dir:
+        return build()
+
+    return Cache(cache_dir).get('fees', [fee_path], build, scope)
+
+
+def get_rates(gopay_rates_path, eur_rates_path, cache_dir=None, scope=None):
+    """
+    Rates - from the cache directory, if set, only rates of the scope, if set
+    """
+    def build():
+        return rate.Rates(gopay_rates_path, eur_rates_path, scope).set_rates()
+
+    if not cache_dir:
+        return build()
+
+    return Cache(cache_dir).get('rates', [gopay_rates_path, eur_rates_path], build, scope)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+
+# payment sessions are processed in chunks of this size in bytes, a checkpoint is saved after every chunk
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# bytes from the end of the payment sessions file in the fingerprint
+TAIL_SIZE = 64 * 1024
+
+
+def get_fingerprint(sessions_path, fee_path, gopay_rates_path, eur_rates_path, config):
+    """
+    Fingerprint of the inputs of the run - the fee and rate files, the size, header and end of the payment
+    sessions file (it is too big to be hashed on every run) and the config.
+    Returns     hex digest
+    """
+    h = hashlib.sha256()
+
+    for path in (fee_path, gopay_rates_path, eur_rates_path):
+        with open(path, mode='rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+
+    size = os.path.getsize(sessions_path)
+    with open(sessions_path, mode='rb') as f:
+        h.update(str(size).encode('utf-8'))
+        h.update(f.readline())
+        f.seek(max(0, size - TAIL_SIZE))
+        h.update(f.read())
+
+    h.update(json.dumps(config, sort_keys=True, default=str).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+class Checkpoint():
+    """
+    Progress of a run - offset of the payment sessions file processed so far, sizes of the output files
+    and stats at that point. A restarted run with the same inputs continues from the last checkpoint.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+
+    def load(self):
+        """
+        Return the last checkpoint of the same inputs or None
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, mode='rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            logging.warning('Checkpoint {} cannot be read, starting from the beginning.' . format(self.path))
+            return None
+
+        if data.get('fingerprint') != self.fingerprint:
+            logging.info('Checkpoint: inputs or config have changed, starting from the beginning.')
+            return None
+
+        logging.info('Checkpoint: resuming from byte {} of the payment sessions, {} output rows.' . format(
+            data['offset'], data['rows']))
+        return data
+
+    def save(self, offset, out, rejected, stats, rejected_date_min=None):
+        """
+        Save a checkpoint - the output files are flushed to the disk first
+        offset      processed bytes of the payment sessions file
+        out         payment costs output file
+        rejected    rejected payments output file or None
+        """
+        files = [f for f in (out, rejected) if f is not None]
+        for f in files:
+            f.flush()
+            os.fsync(f.fileno())
+
+        data = {'fingerprint': self.fingerprint, 'offset': offset, 'rows': stats['processed'],
+                'out_size': out.tell(), 'rejected_size': None if rejected is None else rejected.tell(),
+                'rejected_date_min': rejected_date_min, 'stats': stats}
+
+        # atomic replace, a crash cannot leave a half-written checkpoint
+        tmp = self.path + '.tmp'
+        with open(tmp, mode='wt', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        """
+        Remove the checkpoint after a finished run
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def open_output(path, size=None):
+    """
+    Open an output file - a new one, or the partial output of a resumed run truncated to the checkpoint size
+    """
+    if size is None:
+        return open(path, mode='w', encoding='utf-8')
+
+    f = open(path, mode='r+', encoding='utf-8')
+    f.seek(size)
+    f.truncate()
+    return f
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+Columnar input and output - Parquet and Arrow IPC (feather) files, read and written by pyarrow.
+
+pyarrow is an optional dependency, it is needed only for the parquet format of the run.
+
+Input columns are converted to the values the csv parsers expect - nulls to empty strings, dates and timestamps
+to the csv formats, booleans to TRUE / FALSE. Decimal columns of the payment sessions are passed as Decimal values
+(no conversion from and to text), so the computed costs are the same as from the csv input.
+"""
+
+import csv
+import io
+import logging
+import os
+from decimal import Decimal
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+D = Decimal
+
+# file suffix -> pyarrow dataset format
+SUFFIXES = {'.parquet': 'parquet', '.arrow': 'ipc', '.feather': 'ipc'}
+
+# rows in a batch
+BATCH_SIZE = 10000
+
+# decimal type of the numeric output columns, values are quantized to 5 decimal places
+DECIMAL_PRECISION = 38
+DECIMAL_SCALE = 5
+
+# scheme fees of IFPP and IFPP_FIX_CP are not quantized after the cost multiplier - 5 decimal places of the fee
+# times 5 decimal places of the multiplier
+DECIMAL_SCALES = {'interchange_fee': 2 * DECIMAL_SCALE, 'association_fee': 2 * DECIMAL_SCALE}
+
+
+def check_pyarrow():
+    """
+    Fail with a readable message when pyarrow is not installed
+    """
+    if pa is None:
+        logging.error('The parquet format needs pyarrow - pip install pyarrow')
+        raise Exception('Error: the parquet format needs pyarrow - pip install pyarrow')
+
+
+def is_columnar(path):
+    """
+    Parquet or Arrow file
+    """
+    return os.path.splitext(path)[1] in SUFFIXES
+
+
+def get_input_path(path):
+    """
+    Path of the columnar input table - path with the .csv suffix replaced by .parquet, .arrow or .feather
+    """
+    base = os.path.splitext(path)[0]
+    for suffix in SUFFIXES:
+        if os.path.exists(base + suffix):
+            return base + suffix
+
+    logging.error('Missing input table: {}' . format(base + '.parquet'))
+    raise Exception('Error: missing input table: ' + base + '.parquet')
+
+
+def to_values(column, text=False):
+    """
+    Arrow column -> python values accepted by the csv parsers. Decimals are kept as Decimal unless text is set.
+    """
+    t = column.type
+
+    if pa.types.is_decimal(t):
+        if text:
+            return ['' if v is None else str(v) for v in column.to_pylist()]
+        return ['' if v is None else v for v in column.to_pylist()]
+
+    if pa.types.is_timestamp(t):
+        column = pc.strftime(column, format='%Y-%m-%d %H:%M:%S')
+    elif pa.types.is_date(t):
+        column = pc.strftime(column, format='%Y-%m-%d')
+    elif pa.types.is_boolean(t):
+        column = pc.if_else(column, 'TRUE', 'FALSE')
+    elif not pa.types.is_string(t):
+        column = pc.cast(column, pa.string())
+
+    return pc.fill_null(column, '').to_pylist()
+
+
+def read_table(path, select=None, text=False):
+    """
+    Rows of a parquet / arrow file as dicts, only the select columns if set
+    """
+    check_pyarrow()
+    dataset = ds.dataset(path, format=SUFFIXES[os.path.splitext(path)[1]])
+
+    for batch in dataset.to_batches(columns=select, batch_size=BATCH_SIZE):
+        names = batch.schema.names
+        columns = [to_values(batch.column(i), text) for i in range(len(names))]
+        for values in zip(*columns):
+            yield dict(zip(names, values))
+
+
+class ParquetWriter():
+    """
+    Output table as a parquet file - text columns as strings, numeric columns as decimals with the scale
+    of DECIMAL_SCALES or DECIMAL_SCALE, so the values are stored exactly
+    """
+
+    def __init__(self, path, fieldnames, text_fields):
+        check_pyarrow()
+        self.fieldnames = fieldnames
+        self.text_fields = text_fields
+        self.rows = []
+        self.schema = pa.schema([(k, pa.string() if k in text_fields
+                                  else pa.decimal128(DECIMAL_PRECISION, DECIMAL_SCALES.get(k, DECIMAL_SCALE)))
+                                 for k in fieldnames])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def write(self, data):
+        """
+        Write a csv text (without a header) - i.e. an output of a chunk in the parallel run
+        """
+        self.writerows(csv.DictReader(io.StringIO(data), fieldnames=self.fieldnames))
+
+    def flush(self):
+        """
+        Write the collected rows as a row group
+        """
+        if not self.rows:
+            return
+
+        columns = []
+        for k in self.fieldnames:
+            values = [r[k] for r in self.rows]
+            if k not in self.text_fields:
+                # the parallel run returns the values as strings
+                values = [None if v is None or v == '' else v if v.__class__ is D else D(v) for v in values]
+            columns.append(values)
+
+        self.writer.write_table(pa.Table.from_arrays([pa.array(c, type=f.type) for c, f in zip(columns, self.schema)],
+                                                     schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
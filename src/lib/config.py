@@ -2,26 +2,30 @@ import logging, datetime, pytz
 # from keboola import docker
 from keboola.component import CommonInterface
 
-# init the interface
-# A ValueError error is raised if the data folder path does not exist.
-ci = CommonInterface(data_folder_path='../data')
-
 
 class Config:
 
-    def __init__(self):
+    def __init__(self, data_dir='../data/'):
         # self.config_path = config_path
-        self.ci = CommonInterface('../data/')
+        # None - parameters are passed to set_parameters
+        self.ci = None if data_dir is None else CommonInterface(data_dir)
         self.params = None
 
-    def set_parameters(self):
-        """ Getting config from /data/config.json file
+    def set_parameters(self, parameters=None):
+        """ Getting config from /data/config.json file, or the parameters (i.e. of a backfill job), if set
             Returns     dict with config
         """
 
-        parameters = self.ci.configuration.parameters
+        if parameters is None:
+            parameters = self.ci.configuration.parameters
 
         configFields = ['date_performed_from', 'partnership_cost_exceptions']
+        optionalFields = {'workers': 1, 'incremental': False, 'incremental_lookback_days': 0, 'engine': 'decimal',
+                          'metrics': False, 'fault_tolerant': False, 'max_error_rate': 0.01, 'checkpoint': False,
+                          'pipeline': False, 'pipeline_queue_size': 8, 'output_slices': 1, 'output_gzip': False,
+                          'format': 'csv', 'cache_dir': '', 'prune_inputs': False,
+                          'output_mode': 'rows', 'fee_impact': False, 'diff_store': '', 'diff_deletions': False,
+                          'shadow_rate': 0, 'dedup': False, 'dedup_max_entries': 1000000}
         config = {}
 
         for field in configFields:
@@ -31,6 +35,9 @@ class Config:
             else:
                 logging.error('Missing config paramater: {}' . format(field))
                 raise Exception('Missing config paramater: {}' . format(field))
+
+        for field, default in optionalFields.items():
+            config[field] = parameters.get(field, default)
         
         self.params = config
         return self
@@ -55,9 +62,9 @@ class Config:
             logging.error('date_performed_from in config has a wrong format. It has to be \'%Y-%m-%d\' or null !')
             raise e
 
-
-    def get_cost_exceptions(self):
+    def get_cost_exceptions(self, unbounded=False):
         """ config - cost exceptions, i.e. skylink scheme costs are divided between GOPAY and TP
+            unbounded   an empty date_to is the max date (a long-running service), otherwise today
             Returns     dict with a cost exceptions
         """
         cost_exceptions = {}
@@ -69,7 +76,11 @@ class Config:
 
                 try:
                     d_from = datetime.datetime.strptime(e['date_from'],'%Y-%m-%d').date()
-                    d_to = datetime.datetime.now(pytz.timezone('Europe/Prague')).date() if e['date_to'] is None or e['date_to'] == '' else datetime.datetime.strptime(e['date_to'],'%Y-%m-%d').date()
+                    if e['date_to'] is None or e['date_to'] == '':
+                        d_to = (datetime.date.max if unbounded
+                                else datetime.datetime.now(pytz.timezone('Europe/Prague')).date())
+                    else:
+                        d_to = datetime.datetime.strptime(e['date_to'], '%Y-%m-%d').date()
                 except Exception as e:
                     logging.error('Wrong date values in cost exceptions!')
                     raise e
@@ -88,3 +99,297 @@ class Config:
 
         return cost_exceptions
 
+    def get_workers(self):
+        """ config - number of worker processes, 1 processes the payments serially
+            Returns     int
+        """
+
+        try:
+            workers = int(self.params['workers'] or 1)
+        except Exception as e:
+            logging.error('Wrong value of workers in config! Expecting integer.')
+            raise e
+
+        if workers < 1:
+            logging.error('Wrong value of workers in config! It has to be 1 or more.')
+            raise Exception('Wrong value of workers in config! It has to be 1 or more.')
+
+        return workers
+
+    def get_incremental(self):
+        """ config - incremental mode, only payments performed after the last run are processed
+            Returns     bool
+        """
+
+        if not isinstance(self.params['incremental'], bool):
+            logging.error('Wrong value of incremental in config! Expecting true or false.')
+            raise Exception('Wrong value of incremental in config! Expecting true or false.')
+
+        return self.params['incremental']
+
+    def get_lookback_days(self):
+        """ config - incremental mode, number of days before the last processed payment to process again
+            Returns     int
+        """
+
+        try:
+            days = int(self.params['incremental_lookback_days'] or 0)
+        except Exception as e:
+            logging.error('Wrong value of incremental_lookback_days in config! Expecting integer.')
+            raise e
+
+        if days < 0:
+            logging.error('Wrong value of incremental_lookback_days in config! It cannot be negative.')
+            raise Exception('Wrong value of incremental_lookback_days in config! It cannot be negative.')
+
+        return days
+
+    def get_engine(self):
+        """ config - engine of the cost algorithms, 'decimal' or 'batch' (payments of a batch grouped
+            by the fee and rates)
+            Returns     str
+        """
+
+        if self.params['engine'] not in ('decimal', 'batch'):
+            logging.error('Wrong value of engine in config! It has to be \'decimal\' or \'batch\'.')
+            raise Exception('Wrong value of engine in config! It has to be \'decimal\' or \'batch\'.')
+
+        return self.params['engine']
+
+    def get_metrics(self):
+        """ config - measure the stages of the run and write the payment_costs_metrics table
+            Returns     bool
+        """
+
+        if not isinstance(self.params['metrics'], bool):
+            logging.error('Wrong value of metrics in config! Expecting true or false.')
+            raise Exception('Wrong value of metrics in config! Expecting true or false.')
+
+        return self.params['metrics']
+
+    def get_fault_tolerant(self):
+        """ config - fault-tolerant mode, failing payments are written to the payment_costs_rejected table
+            Returns     bool
+        """
+
+        if not isinstance(self.params['fault_tolerant'], bool):
+            logging.error('Wrong value of fault_tolerant in config! Expecting true or false.')
+            raise Exception('Wrong value of fault_tolerant in config! Expecting true or false.')
+
+        return self.params['fault_tolerant']
+
+    def get_max_error_rate(self):
+        """ config - fault-tolerant mode, max share of rejected payments, the run fails over it
+            Returns     float
+        """
+
+        try:
+            rate = float(self.params['max_error_rate'])
+        except Exception as e:
+            logging.error('Wrong value of max_error_rate in config! Expecting a number.')
+            raise e
+
+        if not 0 <= rate <= 1:
+            logging.error('Wrong value of max_error_rate in config! It has to be between 0 and 1.')
+            raise Exception('Wrong value of max_error_rate in config! It has to be between 0 and 1.')
+
+        return rate
+
+    def get_checkpoint(self):
+        """ config - save checkpoints during the run, a restarted run with the same inputs continues from the last one
+            Returns     bool
+        """
+
+        if not isinstance(self.params['checkpoint'], bool):
+            logging.error('Wrong value of checkpoint in config! Expecting true or false.')
+            raise Exception('Wrong value of checkpoint in config! Expecting true or false.')
+
+        return self.params['checkpoint']
+
+    def get_pipeline(self):
+        """ config - pipelined run, reading, computing and writing in separate threads connected by bounded queues
+            Returns     bool
+        """
+
+        if not isinstance(self.params['pipeline'], bool):
+            logging.error('Wrong value of pipeline in config! Expecting true or false.')
+            raise Exception('Wrong value of pipeline in config! Expecting true or false.')
+
+        return self.params['pipeline']
+
+    def get_pipeline_queue_size(self):
+        """ config - pipelined run, max batches (1000 rows) waiting in a queue between the stages
+            Returns     int
+        """
+
+        try:
+            size = int(self.params['pipeline_queue_size'])
+        except Exception as e:
+            logging.error('Wrong value of pipeline_queue_size in config! Expecting integer.')
+            raise e
+
+        if size < 1:
+            logging.error('Wrong value of pipeline_queue_size in config! It has to be at least 1.')
+            raise Exception('Wrong value of pipeline_queue_size in config! It has to be at least 1.')
+
+        return size
+
+    def get_output_slices(self):
+        """ config - number of slices of the payment_costs output, more than 1 writes a sliced table
+            Returns     int
+        """
+
+        try:
+            slices = int(self.params['output_slices'])
+        except Exception as e:
+            logging.error('Wrong value of output_slices in config! Expecting integer.')
+            raise e
+
+        if slices < 1:
+            logging.error('Wrong value of output_slices in config! It has to be at least 1.')
+            raise Exception('Wrong value of output_slices in config! It has to be at least 1.')
+
+        return slices
+
+    def get_output_gzip(self):
+        """ config - gzip-compressed payment_costs output, written as a sliced table
+            Returns     bool
+        """
+
+        if not isinstance(self.params['output_gzip'], bool):
+            logging.error('Wrong value of output_gzip in config! Expecting true or false.')
+            raise Exception('Wrong value of output_gzip in config! Expecting true or false.')
+
+        return self.params['output_gzip']
+
+    def get_format(self):
+        """ config - format of the input and output tables, 'csv' or 'parquet' (Parquet / Arrow files, needs pyarrow)
+            Returns     str
+        """
+
+        if self.params['format'] not in ('csv', 'parquet'):
+            logging.error('Wrong value of format in config! It has to be \'csv\' or \'parquet\'.')
+            raise Exception('Wrong value of format in config! It has to be \'csv\' or \'parquet\'.')
+
+        return self.params['format']
+
+    def get_cache_dir(self):
+        """ config - directory of the cache of the compiled fees and rates, empty for no cache
+            Returns     str or None
+        """
+
+        if self.params['cache_dir'] is None or self.params['cache_dir'] == '':
+            return None
+
+        if not isinstance(self.params['cache_dir'], str):
+            logging.error('Wrong value of cache_dir in config! Expecting a directory path.')
+            raise Exception('Wrong value of cache_dir in config! Expecting a directory path.')
+
+        return self.params['cache_dir']
+
+    def get_prune_inputs(self):
+        """ config - a pre-pass over the payment sessions finds their currencies and dates,
+            only fees and rates needed for them are loaded
+            Returns     bool
+        """
+
+        if not isinstance(self.params['prune_inputs'], bool):
+            logging.error('Wrong value of prune_inputs in config! Expecting true or false.')
+            raise Exception('Wrong value of prune_inputs in config! Expecting true or false.')
+
+        return self.params['prune_inputs']
+
+    def get_output_mode(self):
+        """ config - output of the run, 'rows' (payment_costs), 'aggregates' (payment_costs_aggregated - sums by day,
+            partnership, payment channel, currency and cost algorithm) or 'both'
+            Returns     str
+        """
+
+        if self.params['output_mode'] not in ('rows', 'aggregates', 'both'):
+            logging.error('Wrong value of output_mode in config! It has to be \'rows\', \'aggregates\' or \'both\'.')
+            raise Exception('Wrong value of output_mode in config! It has to be \'rows\', \'aggregates\' or \'both\'.')
+
+        return self.params['output_mode']
+
+    def get_fee_impact(self):
+        """ config - incremental mode, after a change of the fee sheet recompute only the payments it can affect
+            Returns     bool
+        """
+
+        if not isinstance(self.params['fee_impact'], bool):
+            logging.error('Wrong value of fee_impact in config! Expecting true or false.')
+            raise Exception('Wrong value of fee_impact in config! Expecting true or false.')
+
+        return self.params['fee_impact']
+
+    def get_diff_store(self):
+        """ config - digest file of the differential output, only rows changed since the last run are written,
+            empty for the full output
+            Returns     str or None
+        """
+
+        if self.params['diff_store'] is None or self.params['diff_store'] == '':
+            return None
+
+        if not isinstance(self.params['diff_store'], str):
+            logging.error('Wrong value of diff_store in config! Expecting a file path.')
+            raise Exception('Wrong value of diff_store in config! Expecting a file path.')
+
+        return self.params['diff_store']
+
+    def get_diff_deletions(self):
+        """ config - differential output, write the payments of the last run missing in this run
+            Returns     bool
+        """
+
+        if not isinstance(self.params['diff_deletions'], bool):
+            logging.error('Wrong value of diff_deletions in config! Expecting true or false.')
+            raise Exception('Wrong value of diff_deletions in config! Expecting true or false.')
+
+        return self.params['diff_deletions']
+
+    def get_shadow_rate(self):
+        """ config - shadow verification, sampled share of the payments computed again by the reference path
+            and compared with the output, 0 for no verification
+            Returns     float or None
+        """
+
+        try:
+            rate = float(self.params['shadow_rate'])
+        except Exception as e:
+            logging.error('Wrong value of shadow_rate in config! Expecting a number.')
+            raise e
+
+        if not 0 <= rate <= 1:
+            logging.error('Wrong value of shadow_rate in config! It has to be between 0 and 1.')
+            raise Exception('Wrong value of shadow_rate in config! It has to be between 0 and 1.')
+
+        return rate if rate > 0 else None
+
+    def get_dedup(self):
+        """ config - only the latest version (the last row) of every payment_session_id is processed
+            Returns     bool
+        """
+
+        if not isinstance(self.params['dedup'], bool):
+            logging.error('Wrong value of dedup in config! Expecting true or false.')
+            raise Exception('Wrong value of dedup in config! Expecting true or false.')
+
+        return self.params['dedup']
+
+    def get_dedup_max_entries(self):
+        """ config - deduplication, ids kept in memory, over it they are spilled to sorted runs on disk
+            Returns     int
+        """
+
+        try:
+            entries = int(self.params['dedup_max_entries'])
+        except Exception as e:
+            logging.error('Wrong value of dedup_max_entries in config! Expecting integer.')
+            raise e
+
+        if entries < 1:
+            logging.error('Wrong value of dedup_max_entries in config! It has to be 1 or more.')
+            raise Exception('Wrong value of dedup_max_entries in config! It has to be 1 or more.')
+
+        return entries
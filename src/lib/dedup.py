@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deduplication of the payment sessions - only the latest version of every payment_session_id is processed,
+the latest is the last row of the id in the input (i.e. PARTIALLY_REFUNDED loaded after PAID).
+
+A first pass over the payment_session_id column finds the positions of the superseded rows, the run then skips
+them. The ids are kept in a hash index up to max_entries, over it the index is spilled to a sorted run on disk
+and the runs are merged at the end, so the memory is fixed whatever the size of the input.
+"""
+
+import csv
+import heapq
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+
+from lib import payment, tables
+
+# ids (and superseded positions) kept in memory before they are spilled to disk
+MAX_ENTRIES = 1000000
+
+
+def read_run(path):
+    """
+    (payment_session_id, position) rows of a sorted run
+    """
+    with open(path, mode='r', encoding='utf-8', newline='') as f:
+        for payment_session_id, position in csv.reader(f):
+            yield payment_session_id, int(position)
+
+
+def read_positions(path):
+    """
+    Positions of a sorted run of the superseded rows
+    """
+    with open(path, mode='r', encoding='utf-8') as f:
+        for line in f:
+            yield int(line)
+
+
+class Dedup():
+
+    def __init__(self, path, max_entries=MAX_ENTRIES, directory=None):
+        """
+        path            payment sessions table
+        max_entries     size of the hash index, over it the index is spilled to disk
+        directory       parent of the directory of the spilled runs, the system temp directory if not set
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.directory = tempfile.mkdtemp(prefix='payment-costs-dedup-', dir=directory)
+        self.runs = []  # sorted (payment_session_id, position) runs
+        self.dropped_runs = []  # sorted positions of the superseded rows
+        self.dropped = []  # positions of the superseded rows in memory
+        self.count = 0  # superseded rows
+
+    def index(self):
+        """
+        First pass - find the superseded rows
+        """
+        last = {}
+
+        for position, ps in enumerate(tables.read_table(self.path, ['payment_session_id'])):
+            previous = last.get(ps['payment_session_id'])
+            if previous is not None:
+                self.dropped.append(previous)
+            last[ps['payment_session_id']] = position
+
+            if len(last) + len(self.dropped) >= self.max_entries:
+                self.spill(last)
+                last = {}
+
+        # a spilled index - the ids of all runs are merged
+        if self.runs:
+            self.spill(last)
+            self.merge_runs()
+        else:
+            self.count = len(self.dropped)
+            self.dropped.sort()
+
+        logging.info('Deduplication: {} superseded versions of payment sessions, {} runs spilled to disk.' . format(
+            self.count, len(self.runs)))
+        return self
+
+    def get_run_path(self):
+        return os.path.join(self.directory, 'run-{}' . format(len(self.runs) + len(self.dropped_runs)))
+
+    def spill(self, last):
+        """
+        Write the index sorted by the id and the superseded positions to disk
+        """
+        path = self.get_run_path()
+        with open(path, mode='w', encoding='utf-8', newline='') as f:
+            csv.writer(f).writerows(sorted(last.items()))
+        self.runs.append(path)
+
+        self.spill_dropped()
+
+    def spill_dropped(self):
+        if not self.dropped:
+            return
+
+        path = self.get_run_path()
+        with open(path, mode='w', encoding='utf-8') as f:
+            f.writelines('{}\n' . format(position) for position in sorted(self.dropped))
+        self.dropped_runs.append(path)
+        self.count += len(self.dropped)
+        self.dropped = []
+
+    def merge_runs(self):
+        """
+        External merge of the runs - of the positions of an id in several runs only the last one is kept
+        """
+        merged = heapq.merge(*(read_run(path) for path in self.runs))
+
+        for _, group in itertools.groupby(merged, key=lambda r: r[0]):
+            positions = sorted(position for _, position in group)
+            self.dropped.extend(positions[:-1])
+
+            if len(self.dropped) >= self.max_entries:
+                self.spill_dropped()
+
+        self.spill_dropped()
+
+    def get_dropped(self):
+        """
+        Positions of the superseded rows in ascending order
+        """
+        if not self.dropped_runs:
+            return iter(self.dropped)
+
+        return heapq.merge(*(read_positions(path) for path in self.dropped_runs))
+
+    def select(self, payments, stats):
+        """
+        Second pass - the payment sessions of the table (in the same order as in the first pass) without
+        the superseded ones, they are counted as ignored
+        """
+        dropped = self.get_dropped()
+        next_dropped = next(dropped, None)
+
+        for position, ps in enumerate(payments):
+            if position == next_dropped:
+                next_dropped = next(dropped, None)
+                stats['ignored'] += 1
+                continue
+
+            yield ps
+
+    def write(self, path):
+        """
+        Write the payment sessions without the superseded ones to a csv table (input of the parallel run
+        and of the checkpoints), the superseded ones are counted by the run (count)
+        """
+        with open(path, mode='w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=payment.INPUT_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.select(tables.read_table(self.path, payment.INPUT_COLUMNS), {'ignored': 0}))
+
+        return path
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+Differential output - only payment cost rows inserted or changed since the last run are written.
+
+A digest of every output row by payment_session_id is kept in a key-value file (sqlite) between the runs.
+The rows of a run are compared with the digests of the last run and the new digests are written to a new file,
+which replaces the old one only when the run has finished - a failed run keeps the digests of the last
+successful one. Payments of the last run missing in this run are the deletions.
+"""
+
+import csv
+import hashlib
+import logging
+import os
+import sqlite3
+
+# rows looked up in the digest file at once
+BATCH_SIZE = 500
+
+
+def get_digest(line):
+    """
+    Digest of an output row - its csv line
+    """
+    return hashlib.blake2b(line.encode('utf-8'), digest_size=8).digest()
+
+
+def get_id(line):
+    """
+    payment_session_id of an output row - the first column of its csv line
+    """
+    if line.startswith('"'):
+        return next(csv.reader([line]))[0]
+
+    return line[0:line.index(',')]
+
+
+class DiffOutput():
+    """
+    Output file of the payment costs csv rows (without the header) - rows inserted or changed since the last run
+    are written to out, the others are skipped. Used in place of the output file by the csv writer and by the
+    parallel run.
+    """
+
+    def __init__(self, out, path):
+        """
+        out     output file
+        path    digest file of the last run, it does not have to exist
+        """
+        self.out = out
+        self.path = path
+        self.tmp = path + '.tmp'
+        self.pending = ''
+        self.lines = []
+        self.counts = {'inserted': 0, 'changed': 0, 'unchanged': 0}
+
+        # the digest file of an interrupted run
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(self.tmp, check_same_thread=False)  # the writer thread of the pipelined run
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE digests (id TEXT PRIMARY KEY, digest BLOB) WITHOUT ROWID')
+
+        self.has_old = os.path.exists(path)
+        if self.has_old:
+            self.db.execute('ATTACH DATABASE ? AS old', (path,))
+        else:
+            logging.info('Differential output: no digests of the last run, all rows are written.')
+
+    def write(self, data):
+        """
+        Write csv lines - a line split between the calls is completed by the next one
+        """
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        self.lines.extend(line + '\n' for line in lines)
+
+        if len(self.lines) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Compare the buffered lines with the last run, write the changed ones and store their digests
+        """
+        for start in range(0, len(self.lines), BATCH_SIZE):
+            lines = self.lines[start:start + BATCH_SIZE]
+            rows = [(get_id(line), get_digest(line)) for line in lines]
+
+            old = {}
+            if self.has_old:
+                old = dict(self.db.execute('SELECT id, digest FROM old.digests WHERE id IN ({})' . format(
+                    ','.join('?' * len(rows))), [row_id for row_id, _ in rows]))
+
+            for line, (row_id, digest) in zip(lines, rows):
+                old_digest = old.get(row_id)
+                if old_digest == digest:
+                    self.counts['unchanged'] += 1
+                    continue
+
+                self.counts['inserted' if old_digest is None else 'changed'] += 1
+                self.out.write(line)
+
+            self.db.executemany('INSERT OR REPLACE INTO digests VALUES (?, ?)', rows)
+
+        self.lines = []
+
+    def get_deleted(self):
+        """
+        payment_session_id of the rows of the last run missing in this run, after all rows are written
+        """
+        self.flush()
+        if not self.has_old:
+            return
+
+        for (row_id,) in self.db.execute('SELECT id FROM old.digests EXCEPT SELECT id FROM main.digests ORDER BY 1'):
+            yield row_id
+
+    def commit(self):
+        """
+        Replace the digests of the last run by the digests of this run
+        """
+        self.flush()
+        self.db.commit()
+        self.db.close()
+        os.replace(self.tmp, self.path)
+
+        logging.info('Differential output: {inserted} inserted, {changed} changed, {unchanged} unchanged rows.'
+                     . format(**self.counts))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import datetime
+import logging
+
+# columns of the payment_costs_rejected output
+REJECTED_FIELDS = ['payment_session_id', 'date_performed', 'error_code', 'error_message']
+
+# the error rate is checked after this number of payments, the rest is checked at the end of the run
+MIN_SAMPLE = 1000
+
+# format of date_performed of the rejected sessions
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class PaymentError(Exception):
+    """
+    Error of a single payment session - the session is rejected in the fault-tolerant mode
+    """
+    code = 'ERROR'
+
+
+class ParseError(PaymentError):
+    code = 'PARSE'
+
+
+class MissingFieldError(PaymentError):
+    code = 'MISSING_FIELD'
+
+
+class NoFeeError(PaymentError):
+    code = 'NO_FEE'
+
+
+class AmbiguousFeeError(PaymentError):
+    code = 'AMBIGUOUS_FEE'
+
+
+class MissingRateError(PaymentError):
+    code = 'MISSING_RATE'
+
+
+class CostAlgorithmError(PaymentError):
+    code = 'COST_ALGORITHM'
+
+
+def get_code(error):
+    """
+    Error code of the exception, 'ERROR' for unexpected errors
+    """
+    return error.code if isinstance(error, PaymentError) else PaymentError.code
+
+
+class Rejects():
+    """
+    Writer of the rejected payment sessions with the error rate cap
+    """
+
+    def __init__(self, out, max_error_rate=None):
+        """
+        out             file for the rejected sessions (csv without a header)
+        max_error_rate  max share of rejected sessions, None for no limit (i.e. in worker processes)
+        """
+        self.out = out
+        self.writer = csv.DictWriter(out, fieldnames=REJECTED_FIELDS)
+        self.max_error_rate = max_error_rate
+        self.date_min = None  # earliest date_performed of the rejected sessions, with a valid date
+
+    def writeheader(self):
+        self.writer.writeheader()
+        return self
+
+    def add(self, ps, error, stats):
+        """
+        Reject the payment session
+        """
+        date_performed = ps.get('date_performed') or ''
+        self.writer.writerow({'payment_session_id': ps.get('payment_session_id'), 'date_performed': date_performed,
+                              'error_code': get_code(error), 'error_message': str(error)})
+
+        try:
+            datetime.datetime.strptime(date_performed[0:19], DATE_FORMAT)
+        except ValueError:
+            pass
+        else:
+            if self.date_min is None or date_performed[0:19] < self.date_min:
+                self.date_min = date_performed[0:19]
+
+        stats['rejected'] += 1
+        self.check(stats)
+
+    def merge(self, data, date_min, stats):
+        """
+        Add rejected sessions of a chunk - stats have to be merged already
+        """
+        self.out.write(data)
+        if date_min is not None and (self.date_min is None or date_min < self.date_min):
+            self.date_min = date_min
+
+        self.check(stats)
+
+    def check(self, stats, final=False):
+        """
+        Fail the run when the share of rejected sessions is over the limit
+        """
+        if self.max_error_rate is None:
+            return
+
+        total = stats['processed'] + stats['rejected']
+        if (final or total >= MIN_SAMPLE) and total and stats['rejected'] / total > self.max_error_rate:
+            logging.error('Too many rejected payments: {} of {}' . format(stats['rejected'], total))
+            raise Exception('Error: too many rejected payments - {} of {}, max_error_rate is {}' . format(
+                stats['rejected'], total, self.max_error_rate))
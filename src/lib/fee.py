@@ -1,16 +1,98 @@
 # -*- coding: utf-8 -*-
 
-import logging, csv, datetime
+import logging
+import datetime
+import bisect
+import hashlib
+import json
 from decimal import *
 
+from lib import tables
+
 D = Decimal
 DECIMAL_PLACES = Decimal(10) ** -5 
 
+# known cost algorithms, DEPRECATED fails on use
+COST_ALGORITHMS = ('STD', 'STD-MAX', 'IFPP', 'IFPP_FIX_CP', 'DEPRECATED')
+
+
+def split_values(value):
+    """
+    'VISA, MAESTRO' -> ('VISA', 'MAESTRO'), None -> None
+    """
+    if value is None:
+        return None
+    return tuple(i.strip() for i in value.split(','))
+
+
+def get_rule_id(row):
+    """
+    Id of the fee rule - a hash of its values, the same for an unchanged row of a changed fee sheet wherever
+    it is in the sheet (validate_fees rejects the ties the order of the sheet would decide)
+    """
+    return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode('utf-8')).hexdigest()[0:16]
+
+
+class Fee(dict):
+    """
+    Compiled fee rule - the parsed fee row with pre-split card_type and area_of_event lists
+    """
+    __slots__ = ('card_types', 'areas_of_event', 'rule_id')
+
+    def __init__(self, row):
+        super().__init__(row)
+        self.card_types = split_values(row['card_type'])
+        self.areas_of_event = split_values(row['area_of_event'])
+        self.rule_id = get_rule_id(row)
+
+    def __reduce__(self):
+        return (Fee, (dict(self),))
+
+
+def overlaps(a, b):
+    """
+    Validity windows of the fees overlap
+    """
+    return ((a['valid_to'] is None or b['valid_from'] <= a['valid_to'])
+            and (b['valid_to'] is None or a['valid_from'] <= b['valid_to']))
+
+
+def is_ambiguous(a, b):
+    """
+    Fees with the same payment_channel and MID and overlapping validity, is there a payment they both
+    apply to and Payment.get_fee cannot choose between them?
+    """
+    # currency is not preferred - the currency specific and any currency fees both apply
+    if a['currency'] is not None and b['currency'] is not None and a['currency'] != b['currency']:
+        return False
+
+    # payments without a card - the highest MIN_amount is chosen, fees without MIN_amount for the lower amounts,
+    # of the fees with the same MIN_amount the first one would be chosen
+    if a.card_types is None or b.card_types is None:
+        return a['MIN_amount'] == b['MIN_amount']
+
+    # card payments - the card type has to match, the more specific card_is_business and card_service_type are preferred
+    if not set(a.card_types) & set(b.card_types):
+        return False
+    if a['card_is_business'] != b['card_is_business'] or a['card_service_type'] != b['card_service_type']:
+        return False
+
+    # the fee with exactly the area of event of the payment is preferred
+    if a.areas_of_event is None and b.areas_of_event is None:
+        return True
+    if a.areas_of_event is None or b.areas_of_event is None:
+        areas = set(a.areas_of_event or b.areas_of_event)
+    else:
+        areas = set(a.areas_of_event) & set(b.areas_of_event)
+
+    return any(a['area_of_event'] != area and b['area_of_event'] != area for area in areas)
+
 
 class Fees():
     
-    def __init__(self, fee_path):
+    def __init__(self, fee_path, scope=None):
         self.fee_path = fee_path
+        self.scope = scope  # lib/scope.py - only fees of the scope are kept, if set
     
     
     def load_fees(self):
@@ -19,9 +101,7 @@ class Fees():
         """
         try:
             # open file and load rows to list of dics
-            with open(self.fee_path, mode='rt', encoding='utf-8') as pf:
-                data = list(csv.DictReader(pf))
-            return data
+            return list(tables.read_table(self.fee_path, text=True))
 
         except Exception as e:
             logging.error('Cannot load the fees from the file.')
@@ -73,8 +153,160 @@ class Fees():
                 # add a parsed column       
                 row_prepared[k] = value
 
-            # add a parsed row
-            data_prepared.append(row_prepared)
+            # add a compiled rule
+            data_prepared.append(Fee(row_prepared))
+
+        # the whole fee sheet is validated, only fees of the scope are kept
+        self.validate_fees(data_prepared)
+        if self.scope is not None:
+            data_prepared = [f for f in data_prepared if self.scope.has_fee(f)]
 
         return data_prepared
-    
\ No newline at end of file
+
+    def validate_fees(self, fees):
+        """
+        Static check of the fee rules - invalid and ambiguous rules fail the run before any payment is processed,
+        gaps in the validity of a payment channel are reported as warnings
+        """
+        errors = []
+
+        for f in fees:
+            if f['valid_from'] is None:
+                errors.append('fee without valid_from: {}' . format(dict(f)))
+            elif f['valid_to'] is not None and f['valid_to'] < f['valid_from']:
+                errors.append('fee valid_to before valid_from: {}' . format(dict(f)))
+            if f['cost_algorithm'] not in COST_ALGORITHMS:
+                errors.append('fee with unknown cost_algorithm: {}' . format(dict(f)))
+            elif f['cost_algorithm'] != 'DEPRECATED' and f['fee'] is None:
+                errors.append('fee without fee percent: {}' . format(dict(f)))
+
+        if errors:
+            for e in errors:
+                logging.error(e)
+            raise Exception('Error: invalid fees: ' + '; '.join(errors))
+
+        # ambiguous rules - pairs of fees with the same payment_channel and MID and overlapping validity
+        groups = {}
+        for position, f in enumerate(fees):
+            groups.setdefault((f['payment_channel'], f['MID']), []).append((position, f))
+
+        for group in groups.values():
+            group.sort(key=lambda g: g[1]['valid_from'])
+            for i, (position_a, a) in enumerate(group):
+                for position_b, b in group[i + 1:]:
+                    if a['valid_to'] is not None and b['valid_from'] > a['valid_to']:
+                        break
+                    if overlaps(a, b) and is_ambiguous(a, b):
+                        errors.append('fees on rows {} and {} are both applicable for the same payments: {} | {}'
+                                      . format(min(position_a, position_b) + 2, max(position_a, position_b) + 2,
+                                               dict(a), dict(b)))
+
+        if errors:
+            for e in errors:
+                logging.error(e)
+            raise Exception('Error: {} ambiguous fees, the first: {}' . format(len(errors), errors[0]))
+
+        # coverage - gaps in the validity of the fees of a payment channel
+        channels = {}
+        for f in fees:
+            channels.setdefault(f['payment_channel'], []).append((f['valid_from'], f['valid_to']))
+
+        for channel, windows in channels.items():
+            windows.sort(key=lambda w: w[0])
+            covered_to = windows[0][1]
+            for valid_from, valid_to in windows[1:]:
+                if covered_to is None:
+                    break
+                if valid_from > covered_to + datetime.timedelta(days=1):
+                    logging.warning('No fee for payment channel {} from {} to {}' . format(
+                        channel, covered_to + datetime.timedelta(days=1), valid_from - datetime.timedelta(days=1)))
+                if valid_to is None or valid_to > covered_to:
+                    covered_to = valid_to
+
+        return self
+
+    def get_index(self):
+        """
+        Parse cost fees and build the lookup index over them.
+        """
+        return FeeIndex(self.get_fees())
+
+
+class FeeIndex():
+    """
+    Fees grouped by (payment_channel, currency, MID). Fees in a group are sorted by valid_from,
+    so a lookup only touches the groups relevant for the payment and cuts them by date.
+    """
+
+    def __init__(self, fees):
+        self.fees = [f if isinstance(f, Fee) else Fee(f) for f in fees]
+        self.groups = {}
+
+        for position, f in enumerate(self.fees):
+            if f['valid_from'] is None:
+                logging.error('Fee without valid_from: {}' . format(f))
+                raise Exception('Error: fee without valid_from: ' + str(f))
+
+            key = (f['payment_channel'], f['currency'], f['MID'])
+            self.groups.setdefault(key, []).append((f['valid_from'], position, f))
+
+        # group -> (sorted valid_from list, fees in the same order)
+        for key, group in self.groups.items():
+            group.sort(key=lambda g: (g[0], g[1]))
+            self.groups[key] = ([g[0] for g in group], [(g[1], g[2]) for g in group])
+
+    def find(self, payment_channel, currency, mid, date):
+        """
+        Return fees valid for the channel, currency (or any), MID (or any) and date
+        in the same order as they are in the fee file.
+        """
+        currencies = (None,) if currency is None else (currency, None)
+        mids = (None,) if mid is None else (mid, None)
+
+        result = []
+        for c in currencies:
+            for m in mids:
+                group = self.groups.get((payment_channel, c, m))
+                if group is None:
+                    continue
+
+                valid_from, fees = group
+                for position, f in fees[:bisect.bisect_right(valid_from, date)]:
+                    if f['valid_to'] is None or date <= f['valid_to']:
+                        result.append((position, f))
+
+        result.sort(key=lambda r: r[0])
+        return [f for position, f in result]
+
+    def __iter__(self):
+        return iter(self.fees)
+
+    def __len__(self):
+        return len(self.fees)
+
+
+class FeeScan():
+    """
+    Fees in the order of the fee file scanned one by one - the reference lookup for FeeIndex
+    (shadow verification, lib/shadow.py)
+    """
+
+    def __init__(self, fees):
+        self.fees = list(fees)
+
+    def find(self, payment_channel, currency, mid, date):
+        """
+        Return fees valid for the channel, currency (or any), MID (or any) and date
+        in the same order as they are in the fee file.
+        """
+        return [f for f in self.fees
+                if f['payment_channel'] == payment_channel
+                and (f['currency'] is None or f['currency'] == currency)
+                and (f['MID'] is None or f['MID'] == mid)
+                and f['valid_from'] <= date and (f['valid_to'] is None or date <= f['valid_to'])]
+
+    def __iter__(self):
+        return iter(self.fees)
+
+    def __len__(self):
+        return len(self.fees)
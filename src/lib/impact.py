@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fee change impact analysis - recompute only the payments a change of the fee sheet can affect.
+
+Every run of the incremental mode writes the fee rule matched by each payment (payment_costs_fee_rules table,
+loaded incrementally) and stores the compiled rules in the state. When only the fee sheet has changed since
+the last run, the old and new rules are compared and besides the new payments only these are recomputed:
+- payments that matched a removed or changed rule (by the payment_costs_fee_rules table, input-mapped back)
+- payments a new or changed rule could now capture (same payment channel, currency, MID and validity)
+The output of the run is an incremental update of just those payments.
+"""
+
+import logging
+import os
+
+from lib import tables
+
+# columns of the payment_costs_fee_rules output
+MATCH_FIELDS = ['payment_session_id', 'fee_rule']
+
+# values of a fee rule stored in the state - enough to find the payments the rule could capture
+RULE_FIELDS = ('payment_channel', 'currency', 'MID', 'valid_from', 'valid_to')
+
+
+def get_rules(fees):
+    """
+    Rules of the fee index for the state - rule id -> values of RULE_FIELDS as text
+    """
+    return {f.rule_id: {k: None if f[k] is None else str(f[k]) for k in RULE_FIELDS} for f in fees}
+
+
+class Impact():
+    """
+    Payments affected by a change of the fee rules
+    """
+
+    def __init__(self, old_rules, new_rules, matches_path):
+        """
+        old_rules       rules of the last run, from the state
+        new_rules       rules of this run, get_rules()
+        matches_path    payment_costs_fee_rules table of the last runs
+        """
+        removed = set(old_rules) - set(new_rules)
+
+        # new rules by payment channel
+        self.added = {}
+        for rule_id, rule in new_rules.items():
+            if rule_id not in old_rules:
+                self.added.setdefault(rule['payment_channel'], []).append(rule)
+
+        # payments of the removed rules
+        self.sessions = set()
+        if removed:
+            for row in tables.read_table(matches_path, MATCH_FIELDS):
+                if row['fee_rule'] in removed:
+                    self.sessions.add(row['payment_session_id'])
+
+        logging.info('Fee change impact: {} removed rules with {} payments, {} new rules.' . format(
+            len(removed), len(self.sessions), sum(len(r) for r in self.added.values())))
+
+    def is_affected(self, ps):
+        """
+        The payment session can have a different fee after the change
+        """
+        if ps['payment_session_id'] in self.sessions:
+            return True
+
+        rules = self.added.get(ps['payment_channel'])
+        if rules is None:
+            return False
+
+        day = ps['date_performed'][0:10]
+        for r in rules:
+            if ((r['currency'] is None or r['currency'] == ps['currency'])
+                    and (r['MID'] is None or r['MID'] == ps['mid'])
+                    and r['valid_from'] <= day and (r['valid_to'] is None or day <= r['valid_to'])):
+                return True
+
+        return False
+
+    def select(self, payments, since, stats):
+        """
+        Payment sessions performed after since and the affected older ones, the other ones are counted as ignored
+        """
+        for ps in payments:
+            if ps['date_performed'][0:19] > since or self.is_affected(ps):
+                yield ps
+            else:
+                stats['ignored'] += 1
+
+
+def get_impact(state, rates_fingerprint, new_rules, matches_path):
+    """
+    Impact of the fee change since the last run or None if the payments have to be recomputed fully -
+    rates or config have changed too, or the last run did not store its rules
+    """
+    if state.get('rates_fingerprint') != rates_fingerprint or 'fee_rules' not in state:
+        return None
+
+    if not os.path.exists(matches_path) and not os.path.exists(matches_path + '.gz'):
+        logging.warning('Fee change impact: missing input table {}, full recompute.' . format(matches_path))
+        return None
+
+    return Impact(state['fee_rules'], new_rules, tables.get_input_path(matches_path))
+
+
+class MatchWriter():
+    """
+    Writer of the payment output rows with the fee_rule column - the rows without it to the writer,
+    payment_session_id and fee_rule to the matches writer
+    """
+
+    def __init__(self, writer, matches, fields):
+        self.writer = writer
+        self.matches = matches
+        self.fields = fields
+
+    def writerow(self, row):
+        self.matches.writerow({'payment_session_id': row['payment_session_id'], 'fee_rule': row['fee_rule']})
+        self.writer.writerow({k: row[k] for k in self.fields})
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
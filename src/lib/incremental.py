@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import hashlib
+import json
+import logging
+
+from lib import tables
+
+# date_performed format of the watermark
+WATERMARK_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def read_rates(gopay_rates_path, eur_rates_path):
+    """
+    Rates of both tables for get_fingerprint - read and sorted once per run
+    Returns     list of (date, row as json) in a stable order for every table
+    """
+    rates = []
+    for path, date_column in ((gopay_rates_path, 'relevant_date'), (eur_rates_path, 'date')):
+        rows = ((r[date_column], json.dumps(r, sort_keys=True)) for r in tables.read_table(path, text=True))
+        rates.append(sorted(rows, key=lambda r: r[1]))
+
+    return rates
+
+
+def get_fingerprint(fee_path, rates, watermark, config):
+    """
+    Fingerprint of the inputs the computed costs depend on - the fee file, rates (read_rates()) valid on or before
+    the watermark (rates of later dates cannot change already computed payments) and the config.
+    fee_path None leaves the fees out - changes of the fees are then found by lib/impact.py.
+    Returns     hex digest
+    """
+    h = hashlib.sha256()
+
+    # fees - the order of the fees matters
+    if fee_path is not None:
+        with open(fee_path, mode='rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+
+    # rates - only dates up to the watermark
+    watermark_date = watermark[0:10]
+    for rows in rates:
+        for date, r in rows:
+            if date <= watermark_date:
+                h.update(r.encode('utf-8'))
+
+    # config
+    h.update(json.dumps(config, sort_keys=True, default=str).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def get_since(state, fingerprint, lookback_days):
+    """
+    Return date_performed after which the payments are processed or None for a full recompute
+    """
+    if not state.get('date_performed_max'):
+        logging.info('Incremental mode: no watermark in the state, full recompute.')
+        return None
+
+    if state.get('fingerprint') != fingerprint:
+        logging.info('Incremental mode: fees, rates or config have changed, full recompute.')
+        return None
+
+    return get_lookback(state, lookback_days)
+
+
+def get_lookback(state, lookback_days):
+    """
+    Return the watermark of the state moved back by lookback_days
+    """
+    since = (datetime.datetime.strptime(state['date_performed_max'], WATERMARK_FORMAT)
+             - datetime.timedelta(days=lookback_days))
+    logging.info('Incremental mode: processing payments performed after \'{}\'' . format(since))
+    return since.strftime(WATERMARK_FORMAT)
+
+
+def get_state(watermark, fingerprint, **extra):
+    """
+    Return the state to be stored after the run, with extra items (i.e. of the fee change impact analysis)
+    """
+    return dict({'date_performed_max': watermark, 'fingerprint': fingerprint}, **extra)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import time
+
+perf_counter = time.perf_counter
+
+# stages of the run
+STAGES = ('read', 'parse', 'fee', 'rate', 'cost', 'write')
+
+# upper bounds of the fee matching latency histogram buckets in microseconds
+LATENCY_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000, 10000, float('inf'))
+
+# columns of the metrics output
+FIELDS = ['metric', 'stage', 'cost_algorithm', 'payment_channel', 'bucket', 'value']
+
+
+class Metrics():
+    """
+    Timers and counters of the run - per stage, per cost_algorithm and payment_channel,
+    and a latency histogram of the fee matching
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.payments = {}  # (cost_algorithm, payment_channel) -> [payments, fee seconds, cost seconds]
+        self.latency = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, stage, seconds):
+        """
+        Add time to the stage
+        """
+        self.seconds[stage] += seconds
+
+    def add_payment(self, cost_algorithm, payment_channel, fee_seconds, cost_seconds):
+        """
+        Add a processed payment
+        """
+        key = (cost_algorithm, payment_channel)
+        if key not in self.payments:
+            self.payments[key] = [0, 0.0, 0.0]
+
+        group = self.payments[key]
+        group[0] += 1
+        group[1] += fee_seconds
+        group[2] += cost_seconds
+
+        us = fee_seconds * 1000000
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if us <= bound:
+                self.latency[i] += 1
+                break
+
+    def timed(self, iterable, stage):
+        """
+        Iterate over the iterable, the time of getting the items is added to the stage
+        """
+        iterator = iter(iterable)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.seconds[stage] += perf_counter() - start
+                return
+
+            self.seconds[stage] += perf_counter() - start
+            yield item
+
+    def process_payment(self, p):
+        """
+        Payment.process_payment with timers of the stages
+        """
+        start = perf_counter()
+        p.parse_payment()
+        parsed = perf_counter()
+        p.get_fee()
+        fee_found = perf_counter()
+        p.get_payment_rates()
+        rates_found = perf_counter()
+        p.compute_costs()
+        computed = perf_counter()
+
+        self.seconds['parse'] += parsed - start
+        self.seconds['fee'] += fee_found - parsed
+        self.seconds['rate'] += rates_found - fee_found
+        self.seconds['cost'] += computed - rates_found
+        self.add_payment(p.fee['cost_algorithm'], p.parsed['payment_channel'], fee_found - parsed,
+                         computed - rates_found)
+
+        return p
+
+    def merge(self, other):
+        """
+        Add metrics from other (i.e. of a chunk)
+        """
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] += seconds
+
+        for key, (payments, fee_seconds, cost_seconds) in other.payments.items():
+            group = self.payments.setdefault(key, [0, 0.0, 0.0])
+            group[0] += payments
+            group[1] += fee_seconds
+            group[2] += cost_seconds
+
+        for i, count in enumerate(other.latency):
+            self.latency[i] += count
+
+        return self
+
+    def get_rows(self, stats, total_seconds):
+        """
+        Rows of the metrics output
+        """
+        rows = [{'metric': 'seconds', 'stage': 'total', 'value': round(total_seconds, 6)}]
+        rows += [{'metric': 'seconds', 'stage': stage, 'value': round(seconds, 6)}
+                 for stage, seconds in self.seconds.items()]
+        rows += [{'metric': k, 'stage': 'total', 'value': v} for k, v in stats.items() if v is not None]
+
+        for key, (payments, fee_seconds, cost_seconds) in sorted(self.payments.items(), key=str):
+            cost_algorithm, payment_channel = key
+            group = {'cost_algorithm': cost_algorithm, 'payment_channel': payment_channel}
+            rows.append(dict(group, metric='payments', stage='cost', value=payments))
+            rows.append(dict(group, metric='seconds', stage='fee', value=round(fee_seconds, 6)))
+            rows.append(dict(group, metric='seconds', stage='cost', value=round(cost_seconds, 6)))
+
+        for bound, count in zip(LATENCY_BUCKETS, self.latency):
+            rows.append({'metric': 'fee_latency_payments', 'stage': 'fee', 'bucket': '<={}us'.format(bound),
+                         'value': count})
+
+        return rows
+
+    def write(self, path, stats, total_seconds):
+        """
+        Write the metrics table
+        """
+        with open(path, mode='w', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(self.get_rows(stats, total_seconds))
+
+
+class TimedWriter():
+    """
+    csv writer, the time of writing the rows is added to the write stage
+    """
+
+    def __init__(self, writer, metrics):
+        self.writer = writer
+        self.metrics = metrics
+
+    def writerow(self, row):
+        start = perf_counter()
+        self.writer.writerow(row)
+        self.metrics.seconds['write'] += perf_counter() - start
+
+    def writerows(self, rows):
+        start = perf_counter()
+        self.writer.writerows(rows)
+        self.metrics.seconds['write'] += perf_counter() - start
@@ -3,12 +3,114 @@
 import logging, datetime
 from decimal import *
 
+from lib.errors import AmbiguousFeeError, CostAlgorithmError, NoFeeError, ParseError
+
+# costs are computed on Decimal - with the C decimal module, parsing and formatting scaled integers
+# in Python is slower than Decimal(text) and str(Decimal)
 D = Decimal
 DECIMAL_PLACES = Decimal(10) ** -5 
 
+# columns of the payment_costs output
+OUTPUT_FIELDS = ['payment_session_id', 'amount', 'amount_czk',
+                 'amount_refunded', 'amount_refunded_czk', 'cost_algorithm',
+                 'interchange_fee', 'interchange_fee_czk', 'association_fee',
+                 'association_fee_czk', 'provider_transaction_fee', 'provider_transaction_fee_czk',
+                 'provider_percent_fee', 'provider_percent_fee_czk', 'total_fee', 'total_fee_czk']
+
+# session states of the successful payments - only they are processed
+SUCCESSFUL_STATES = ('PAID', 'PARTIALLY_REFUNDED', 'REFUNDED')
+
+# per-day cache of parsed dates
+DAYS = {}
+
+
+def parse_day(value):
+    """
+    'YYYY-MM-DD' -> date, cached per day
+    """
+    day = DAYS.get(value)
+    if day is None:
+        day = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        DAYS[value] = day
+
+    return day
+
+
+def parse_timestamp(value):
+    """
+    'YYYY-MM-DD HH:MM:SS...' -> datetime. Only this format is accepted (as by strptime before), fromisoformat
+    alone would accept a date only or a 'T' separated value too.
+    """
+    if (len(value) < 19 or value[4] != '-' or value[7] != '-' or value[10] != ' ' or value[13] != ':'
+            or value[16] != ':'):
+        raise ValueError('Wrong timestamp: ' + value)
+
+    return datetime.datetime.fromisoformat(value[0:19])
+
+
+def parse_number(value):
+    """
+    number -> Decimal, Decimal values of the columnar input are kept
+    """
+    if value.__class__ is D:
+        return value
+
+    return D(value.replace('%', '').replace(' ', '').replace(',', '.').replace('\xa0', ''))
+
+
+def parse_is_business(value):
+    """
+    card_is_business -> bool
+    """
+    return False if value == 'FALSE' else True
+
+
+# columns of the payment session used by the cost calculation -> converters, None keeps the text
+SESSION_COLUMNS = {
+    'payment_session_id': None,
+    'date_performed': parse_timestamp,
+    'payment_channel': None,
+    'currency': None,
+    'mid': None,
+    'partnership_id': None,
+    'amount': parse_number,
+    'amount_refunded': parse_number,
+    'interchange_fee': parse_number,
+    'association_fee': parse_number,
+    'card_type': None,
+    'card_is_business': parse_is_business,
+    'card_service_type': None,
+    'card_aoe': None,
+}
+CONVERTERS = tuple(SESSION_COLUMNS.items())
+
+# columns of the payment session input read by the run
+INPUT_COLUMNS = list(SESSION_COLUMNS) + ['session_state']
+
+
+class Session():
+    """
+    Parsed payment session - the columns used by the cost calculation and the computed costs.
+    Columns are accessible as items, i.e. session['amount'].
+    """
+    __slots__ = tuple(SESSION_COLUMNS) + tuple(k for k in OUTPUT_FIELDS if k not in SESSION_COLUMNS) + ('fee_rule',)
+
+    __getitem__ = object.__getattribute__
+    __setitem__ = object.__setattr__
+
+    def __repr__(self):
+        return str({k: getattr(self, k) for k in self.__slots__ if hasattr(self, k)})
+
+
 class Payment():
     
-    def __init__(self, payment, fees, rates, exceptions ):
+    def __init__(self, payment, fees, rates, exceptions):
+        """
+        payment     raw payment session row
+        fees        fee.FeeIndex with the cost fees
+        rates       rate.Rates with loaded currency rates
+        exceptions  cost exceptions from the config
+        """
         self.raw = payment
         self.rates = rates
         self.fees = fees
@@ -16,48 +118,30 @@ class Payment():
         
         self.parsed = None
         self.fee = None
+        self.multiplier = None
+        self.payment_rates = None
     
     def parse_payment(self):
         """
-        Parse the payment
+        Parse the payment - only the columns used by the cost calculation
         """
 
-        # dict for the result
-        parsed_payment = {}
-
-        #iterate over payment columns
-        for k,v in self.raw.items():
-
-            # column value
-            value = v
+        # record for the result
+        parsed_payment = Session()
 
-            try:  
-                # empty strings replacement
-                value = None if value == '' else v
+        # iterate over converters of the columns
+        for k, convert in CONVERTERS:
 
-                # dates -> date data type
-                if k in ('date_created', 'date_performed'):
+            # column value, empty strings replacement
+            v = self.raw[k]
+            if v == '':
+                parsed_payment[k] = None
+                continue
 
-                    if value is not None:
-                        value =  datetime.datetime.strptime(value[0:19], '%Y-%m-%d %H:%M:%S')
-
-                # numbers -> Decimal data type
-                if k in ('amount_refunded', 'amount', 'interchange_fee', 'association_fee'):
-                    if value is not None:
-                        value = value.replace('%', '')
-                        value = value.replace(' ', '')
-                        value = value.replace(',', '.')
-                        value = value.replace('\xa0', '')
-                        value = D(value) # Decimal
-
-                # is_business
-                if k in ('card_is_business'):
-                    if value is not None:
-                        value = False if value == 'FALSE' else True
+            try:
+                parsed_payment[k] = v if convert is None else convert(v)
             except:
-                raise Exception('Error: parse column: '+ k + ', value: ' + v )
-
-            parsed_payment[k] = value
+                raise ParseError('Error: parse column: ' + k + ', value: ' + v)
 
         self.parsed = parsed_payment
         return self
@@ -73,24 +157,10 @@ class Payment():
             get relevant fees - for all payment channels excl. cards
             """ 
 
-            # 1. only fees w/ relevant payment_channel
-            possible_fees = [f for f in self.fees if 
-                             self.parsed['payment_channel'] == f['payment_channel']]
-
-            # 2. only fees w/ relevant currency
-            possible_fees = [f for f in possible_fees if 
-                             f['currency'] is None or f['currency'] == self.parsed['currency']]
-            
-            # 3. only fees w/ relevant dates from/to
-            possible_fees = [f for f in possible_fees if 
-                             self.parsed['date_performed'].date() >= f['valid_from'] and 
-                             (f['valid_to'] is None or self.parsed['date_performed'].date() <= f['valid_to'])]
-
-            # 4. only fees w/ relevant mid
-            possible_fees = [f for f in possible_fees if 
-                             f['MID'] is None or f['MID'] == self.parsed['mid']]
+            # 1.-4. only fees w/ relevant payment_channel, currency, dates from/to and mid
+            possible_fees = self.fees.find(self.parsed['payment_channel'], self.parsed['currency'],
+                                           self.parsed['mid'], self.parsed['date_performed'].date())
 
-            
             # 5. only fees w/ relevant MIN amount
             possible_fees = [f for f in possible_fees 
                              if f['MIN_amount'] is None or f['MIN_amount'] <= self.parsed['amount']]
@@ -107,8 +177,7 @@ class Payment():
             possible_fees = find_fee_other()
             
             # card_type
-            possible_fees = [f for f in possible_fees if 
-                             self.parsed['card_type'] in [i.strip() for i in f['card_type'].split(',')]]
+            possible_fees = [f for f in possible_fees if self.parsed['card_type'] in f.card_types]
 
             # MID is the king if there is a match of MIDs!!! - more important than is_business, card_service_type, aoe
             possible_fees = mid(possible_fees)
@@ -126,7 +195,7 @@ class Payment():
             # area of event
             possible_fees = [f for f in possible_fees if 
                              f['area_of_event'] is None or
-                             self.parsed['card_aoe'] in [i.strip() for i in f['area_of_event'].split(',')]]
+                             self.parsed['card_aoe'] in f.areas_of_event]
             
             if len(possible_fees)>1:
                 possible_fees = card_is_byz(possible_fees)
@@ -221,22 +290,26 @@ class Payment():
 
             # fee needs to be defined
             elif len(result_fees) == 0:
-                raise Exception("Error: no fee details specified for payment: \n"+str(self.parsed))
+                raise NoFeeError("Error: no fee details specified for payment: \n"+str(self.parsed))
 
             # more than 1 fee applicable
             else:
-                raise Exception("Error: there are "+ str(len(result_fees))+" fees applicable for the payment: \n\n"+str(self.parsed)+"\n\nDostupné fees:\n"+str(result_fees))
+                raise AmbiguousFeeError("Error: there are " + str(len(result_fees))
+                                        + " fees applicable for the payment: \n\n" + str(self.parsed)
+                                        + "\n\nDostupné fees:\n" + str(result_fees))
         
         # get_fee_detail() flow
         if self.parsed['card_type'] is None:
             f = find_fee_other()
             self.fee = return_final_fee(min_amount(mid(f)))
-            return self
 
         else:
             f = find_fee_card()
             self.fee = return_final_fee(f)
-            return self
+
+        # matched rule - fee change impact analysis (lib/impact.py)
+        self.parsed['fee_rule'] = self.fee.rule_id
+        return self
         
     def get_exception_multiplier(self):
 
@@ -253,26 +326,49 @@ class Payment():
             # when there is no exception for the payment
             return D(1).quantize(DECIMAL_PLACES)
 
+    def get_payment_rates(self):
+        """
+        get the schema cost multiplier and rates of the payment
+        """
 
+        # schema cost multiplier - i.e. scheme costs of skylink payments are being divided between TP and GP
+        self.multiplier = self.get_exception_multiplier()
 
-    def process_payment(self):
+        # rates - payment currency -> CZK, transaction fee currency -> CZK, transaction fee currency -> payment currency
+        fee_cur = self.fee['transaction_fee_currency']
+        if fee_cur is None:
+            fee_cur = self.parsed['currency']
+        self.payment_rates = self.rates.get_payment_rates(self.parsed['currency'], fee_cur,
+                                                          self.parsed['date_performed'].date())
+
+        return self
+
+    def prepare_payment(self):
         """
-        Process payment - calculate the fees
+        Prepare the payment for the cost calculation - parse it, find the fee scheme, the multiplier and rates
         """
 
         self.parse_payment() # parse the raw payment data
         self.get_fee() # find the fee scheme
-        schema_cost_multiplier = self.get_exception_multiplier() # schema cost multiplier - i.e. scheme costs of skylink payments are being divided between TP and GP
+        self.get_payment_rates()
 
-        #rate - payment currency -> CZK
-        czk_rate = self.rates.get_rate(self.parsed['currency'], 'CZK', self.parsed['date_performed'].date())
-        
-        #rate - transaction fee currency  -> CZK
-        fee_cur = self.parsed['currency'] if self.fee['transaction_fee_currency'] is None else self.fee['transaction_fee_currency']
-        czk_rate_fee = self.rates.get_rate(fee_cur, 'CZK', self.parsed['date_performed'].date())
-        
-        #rate - transaction fee currency  -> payment currency
-        rate_fee = self.rates.get_rate(fee_cur, self.parsed['currency'], self.parsed['date_performed'].date())
+        return self
+
+    def process_payment(self):
+        """
+        Process payment - calculate the fees
+        """
+
+        self.prepare_payment()
+        return self.compute_costs()
+
+    def compute_costs(self):
+        """
+        Calculate the fees of the prepared payment
+        """
+
+        schema_cost_multiplier = self.multiplier
+        czk_rate, czk_rate_fee, rate_fee = self.payment_rates
 
         #amounts
         self.parsed['amount'] = D(0).quantize(DECIMAL_PLACES) if self.parsed['amount'] is None else self.parsed['amount'].quantize(DECIMAL_PLACES)
@@ -346,7 +442,111 @@ class Payment():
             return self
         
         elif self.fee['cost_algorithm'] == 'DEPRECATED':
-            raise Exception('Error: Deprecated fee')
+            raise CostAlgorithmError('Error: Deprecated fee')
+
+        else:
+            raise CostAlgorithmError('Error: cost algorithm not recognized')
+
+
+def select_sessions(payments, date_from, stats, since=None, rejects=None):
+    """
+    Select payment sessions to process - successful payments performed on or after date_from
+    (and after since, if set). Counters are added to stats. Sessions with a wrong date_performed
+    are rejected to rejects (errors.Rejects), if set.
+    """
+
+    # loop over payment sessions
+    for ps in payments:
+
+        # ignore ps before a date_performed_from set in config
+        try:
+            ps_date_performed = parse_day(ps['date_performed'][0:10])
+            if date_from > ps_date_performed:
+                stats['ignored'] += 1
+                continue
+
+        except Exception as e:
+            if rejects is not None:
+                rejects.add(ps, ParseError('Error: parse column: date_performed, value: ' + str(ps['date_performed'])),
+                            stats)
+                continue
+
+            logging.error('Cannot parse date_performed for payment: {}' . format(ps))
+            raise e
+
+        # ignore ps processed in a previous run - incremental mode
+        if since is not None and ps['date_performed'][0:19] <= since:
+            stats['ignored'] += 1
+            continue
+
+        # only successful payments
+        if ps['session_state'] in SUCCESSFUL_STATES:
+
+            # high-water mark of processed payments
+            if stats['date_performed_max'] is None or ps['date_performed'][0:19] > stats['date_performed_max']:
+                stats['date_performed_max'] = ps['date_performed'][0:19]
+
+            yield ps
+
+
+def process_sessions(payments, fees, rates, date_from, exceptions, stats, since=None, engine='decimal', metrics=None,
+                     rejects=None, fields=OUTPUT_FIELDS):
+    """
+    Process payment sessions - yield the final payment output for every successful payment
+    performed on or after date_from (and after since, if set). Counters are added to stats.
+    engine is 'decimal' or 'batch'. Stage timers are added to metrics (lib/metrics.py), if set.
+    Failing payments are rejected to rejects (errors.Rejects), if set, otherwise the error is raised.
+    fields are the columns of the output, parsed columns of the payment can be added to OUTPUT_FIELDS.
+    """
+
+    if metrics is not None:
+        payments = metrics.timed(payments, 'read')
+
+    # batch engine
+    if engine == 'batch':
+        from lib import batch
+        yield from batch.process_batches(payments, fees, rates, date_from, exceptions, stats, since, metrics=metrics,
+                                         rejects=rejects, fields=fields)
+        return
+
+    for ps in select_sessions(payments, date_from, stats, since, rejects):
+
+        # prepare payment details
+        p = Payment(ps, fees, rates, exceptions)
+        try:
+            if metrics is None:
+                p.process_payment()
+            else:
+                metrics.process_payment(p)
+
+        except Exception as e:
+            if rejects is None:
+                raise e
+            rejects.add(ps, e, stats)
+            continue
+
+        # final payment output
+        yield {k: p.parsed[k] for k in fields}
+
+        stats['processed'] += 1
 
+
+def get_stats():
+    """
+    Return empty run stats
+    """
+    return {'processed': 0, 'ignored': 0, 'rejected': 0, 'date_performed_max': None}
+
+
+def merge_stats(stats, other):
+    """
+    Add run stats from other (i.e. of a chunk) to stats
+    """
+    for k, v in other.items():
+        if k == 'date_performed_max':
+            if v is not None and (stats[k] is None or v > stats[k]):
+                stats[k] = v
         else:
-            raise Exception('Error: cost algorithm not recognized')
\ No newline at end of file
+            stats[k] += v
+
+    return stats
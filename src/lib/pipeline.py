@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pipelined run - a reader thread, the compute stage and a writer thread connected by bounded queues.
+
+The reader thread reads and decodes the input rows, the calling thread computes the costs and the writer
+thread writes the output rows, all in batches. The queues are bounded, so a slow stage blocks the faster ones
+(backpressure) and the memory is limited by the queue size * batch size rows. There is only one compute stage,
+so the output is in the input order.
+"""
+
+import itertools
+import queue
+import threading
+
+# max batches waiting in a queue
+QUEUE_SIZE = 8
+
+# rows in a batch
+BATCH_SIZE = 1000
+
+# how often a blocked stage checks the pipeline was stopped, in seconds
+POLL_INTERVAL = 0.1
+
+
+class Pipeline():
+
+    def __init__(self, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.in_queue = queue.Queue(queue_size)
+        self.out_queue = queue.Queue(queue_size)
+        self.stopped = threading.Event()
+        self.errors = []
+
+    def put(self, q, item):
+        """
+        Put the item to the queue, wait while it is full. Returns False if the pipeline was stopped.
+        """
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def get(self, q):
+        """
+        Get an item from the queue, wait while it is empty. Returns None if the pipeline was stopped.
+        """
+        while not self.stopped.is_set():
+            try:
+                return q.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+        return None
+
+    def read(self, rows):
+        """
+        Reader thread - batches of the input rows to the input queue, None at the end
+        """
+        try:
+            iterator = iter(rows)
+            while True:
+                batch = list(itertools.islice(iterator, self.batch_size))
+                if not batch or not self.put(self.in_queue, batch):
+                    break
+
+        except BaseException as e:
+            self.errors.append(e)
+
+        finally:
+            self.put(self.in_queue, None)
+
+    def write(self, write_rows):
+        """
+        Writer thread - batches of the output rows from the output queue to write_rows
+        """
+        try:
+            while True:
+                batch = self.get(self.out_queue)
+                if batch is None:
+                    break
+                write_rows(batch)
+
+        except BaseException as e:
+            self.errors.append(e)
+            self.stopped.set()
+
+    def input_rows(self):
+        """
+        Input rows for the compute stage
+        """
+        while True:
+            batch = self.get(self.in_queue)
+            if batch is None:
+                return
+            yield from batch
+
+    def run(self, rows, process, write_rows):
+        """
+        rows        iterable of the input rows, iterated in the reader thread
+        process     function - iterable of the input rows -> iterable of the output rows, run in the calling thread
+        write_rows  function - writes a list of the output rows, run in the writer thread
+        """
+        reader = threading.Thread(target=self.read, args=(rows,), name='pipeline-reader', daemon=True)
+        writer = threading.Thread(target=self.write, args=(write_rows,), name='pipeline-writer', daemon=True)
+        reader.start()
+        writer.start()
+
+        try:
+            batch = []
+            for row in process(self.input_rows()):
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    if not self.put(self.out_queue, batch):
+                        break
+                    batch = []
+
+            if batch:
+                self.put(self.out_queue, batch)
+            self.put(self.out_queue, None)
+
+        except BaseException:
+            self.stopped.set()
+            raise
+
+        finally:
+            writer.join()
+            self.stopped.set()
+            reader.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+
+def run(rows, process, write_rows, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE):
+    """
+    Run the pipeline, see Pipeline.run
+    """
+    Pipeline(queue_size, batch_size).run(rows, process, write_rows)
@@ -1,16 +1,22 @@
 # -*- coding: utf-8 -*-
 
-import csv, datetime, logging
+import datetime
 from decimal import *
 
+from lib import tables
+from lib.errors import MissingRateError
+
 D = Decimal
 DECIMAL_PLACES = Decimal(10) ** -5 
 
 
 class Rates():
     
-    def __init__(self, gopay_rates_path, eur_rates_path):
+    def __init__(self, gopay_rates_path, eur_rates_path, scope=None):
+        self.scope = scope  # lib/scope.py - only rates of the scope are loaded, if set
         self.rates = None
+        self.tables = None
+        self.cache = {}
         self.gopay_rates_path = gopay_rates_path
         self.eur_rates_path = eur_rates_path
     
@@ -21,62 +27,95 @@ class Rates():
         rates = {}
         
         # CNB data - gopay data
-        with open(self.gopay_rates_path, mode='rt', encoding='utf-8') as czk_data:
-            czk_data = csv.DictReader(czk_data)
-            
-            for d in czk_data:
-
-                date =  datetime.datetime.strptime(d['relevant_date'], '%Y-%m-%d').date()
-
-                # from other currencies to CZK
-                if d['target_currency'] in rates:
-                    if 'CZK' in rates[d['target_currency']]:
-                        rates[d['target_currency']]['CZK'][date] = D(d['price'])/D(d['target_currency_amount'])
-                    else:
-                        rates[d['target_currency']]['CZK'] = {}
-                        rates[d['target_currency']]['CZK'][date] = D(d['price'])/D(d['target_currency_amount'])
+        czk_data = tables.read_table(self.gopay_rates_path, text=True)
+        if self.scope is not None:
+            czk_data = self.scope.prune_rates(czk_data, 'relevant_date', 'target_currency')
+
+        for d in czk_data:
+
+            date = datetime.datetime.strptime(d['relevant_date'], '%Y-%m-%d').date()
+
+            # from other currencies to CZK
+            if d['target_currency'] in rates:
+                if 'CZK' in rates[d['target_currency']]:
+                    rates[d['target_currency']]['CZK'][date] = D(d['price'])/D(d['target_currency_amount'])
                 else:
-                    rates[d['target_currency']] = {}
                     rates[d['target_currency']]['CZK'] = {}
                     rates[d['target_currency']]['CZK'][date] = D(d['price'])/D(d['target_currency_amount'])
+            else:
+                rates[d['target_currency']] = {}
+                rates[d['target_currency']]['CZK'] = {}
+                rates[d['target_currency']]['CZK'][date] = D(d['price'])/D(d['target_currency_amount'])
 
-                # from CZK to other currencies
-                if 'CZK' in rates:
-                    if d['target_currency'] in rates['CZK']:
-                        rates['CZK'][d['target_currency']][date] = D(1) / (D(d['price'])/D(d['target_currency_amount']))
-                    else:
-                        rates['CZK'][d['target_currency']] = {}
-                        rates['CZK'][d['target_currency']][date] = D(1) / (D(d['price'])/D(d['target_currency_amount']))          
+            # from CZK to other currencies
+            if 'CZK' in rates:
+                if d['target_currency'] in rates['CZK']:
+                    rates['CZK'][d['target_currency']][date] = D(1) / (D(d['price'])/D(d['target_currency_amount']))
                 else:
-                    rates['CZK'] = {}
                     rates['CZK'][d['target_currency']] = {}
                     rates['CZK'][d['target_currency']][date] = D(1) / (D(d['price'])/D(d['target_currency_amount']))
+            else:
+                rates['CZK'] = {}
+                rates['CZK'][d['target_currency']] = {}
+                rates['CZK'][d['target_currency']][date] = D(1) / (D(d['price'])/D(d['target_currency_amount']))
 
         
         # ECB data - keboola data
-        with open(self.eur_rates_path, mode='rt', encoding='utf-8') as eur_data:
-            eur_data = csv.DictReader(eur_data)
-                            
-            for d in eur_data:
-                date =  datetime.datetime.strptime(d['date'], '%Y-%m-%d').date()
-
-                # ignore there rows 
-                if d['toCurrency'] == 'CZK' or d['rate'] == '':
-                    continue
-
-                if 'EUR' in rates:
-                    if d['toCurrency'] in rates['EUR']:
-                        rates['EUR'][d['toCurrency']][date] = D(d['rate'])
-                    else:
-                        rates['EUR'][d['toCurrency']] = {}
-                        rates['EUR'][d['toCurrency']][date] = D(d['rate'])
+        eur_data = tables.read_table(self.eur_rates_path, text=True)
+        if self.scope is not None:
+            # rows ignored below are not kept as the latest rate before the scope
+            eur_data = self.scope.prune_rates((d for d in eur_data if d['toCurrency'] != 'CZK' and d['rate'] != ''),
+                                              'date', 'toCurrency')
+
+        for d in eur_data:
+            date = datetime.datetime.strptime(d['date'], '%Y-%m-%d').date()
 
+            # ignore there rows
+            if d['toCurrency'] == 'CZK' or d['rate'] == '':
+                continue
+
+            if 'EUR' in rates:
+                if d['toCurrency'] in rates['EUR']:
+                    rates['EUR'][d['toCurrency']][date] = D(d['rate'])
                 else:
-                    rates['EUR'] = {}
                     rates['EUR'][d['toCurrency']] = {}
                     rates['EUR'][d['toCurrency']][date] = D(d['rate'])
+
+            else:
+                rates['EUR'] = {}
+                rates['EUR'][d['toCurrency']] = {}
+                rates['EUR'][d['toCurrency']][date] = D(d['rate'])
         
         self.rates = rates
+        self.set_tables()
+        return self
+
+    def set_tables(self):
+        """
+        Build forward-filled day tables from the loaded rates.
+        (from_currency, to_currency) -> (ordinal of the first date, list with a rate for every day)
+        """
+        tables = {}
+
+        for from_currency, to_rates in self.rates.items():
+            for to_currency, dated_rates in to_rates.items():
+
+                dates = sorted(dated_rates.keys())
+                first = dates[0].toordinal()
+                days = [None] * (dates[-1].toordinal() - first + 1)
+
+                for d in dates:
+                    days[d.toordinal() - first] = dated_rates[d]
+
+                # forward fill the days w/o a rate
+                for i in range(1, len(days)):
+                    if days[i] is None:
+                        days[i] = days[i - 1]
+
+                tables[(from_currency, to_currency)] = (first, days)
+
+        self.tables = tables
+        self.cache = {}
         return self
     
 
@@ -101,9 +140,13 @@ class Rates():
             if from_currency in self.rates:
                 
                 if to_currency in self.rates[from_currency]:
-                    # get closest date for the date 
-                    closest_date = max(d for d in self.rates[from_currency][to_currency].keys() if d <= date)
-                    return self.rates[from_currency][to_currency][closest_date] 
+                    # rate for the closest date on or before the date
+                    first, days = self.tables[(from_currency, to_currency)]
+                    i = date.toordinal() - first
+                    if i < 0:
+                        raise Exception('Error: no rates available before: ' + str(date))
+
+                    return days[i] if i < len(days) else days[-1]
                 
                 else:
                     raise Exception('Error: no rates available for to_currency: ' + to_currency)
@@ -112,4 +155,53 @@ class Rates():
                 raise Exception('Error: no rates available for from_currency: ' + from_currency)    
 
         except:
-            raise Exception('Error: finding rate from:' + from_currency + ' to: ' + to_currency +  ' for date: ' + str(date))
+            raise MissingRateError('Error: finding rate from:' + from_currency + ' to: ' + to_currency
+                                   + ' for date: ' + str(date))
+
+    def get_payment_rates(self, currency, fee_currency, date):
+        """
+        Return rates for a payment - (currency -> CZK, fee_currency -> CZK, fee_currency -> currency)
+        The rates are cached per currency, fee currency and day.
+        """
+        key = (currency, fee_currency, date)
+
+        if key not in self.cache:
+            self.cache[key] = (self.get_rate(currency, 'CZK', date),
+                               self.get_rate(fee_currency, 'CZK', date),
+                               self.get_rate(fee_currency, currency, date))
+
+        return self.cache[key]
+
+
+class RateScan():
+    """
+    Rates looked up by a scan of the dated rates - the rate of the latest date on or before the date, w/o the day
+    tables and the cache of Rates (the reference lookup of the shadow verification, lib/shadow.py)
+    """
+
+    def __init__(self, rates):
+        """
+        rates   rate.Rates with loaded currency rates
+        """
+        self.rates = rates.rates
+
+    def get_rate(self, from_currency, to_currency, date):
+        """
+        Return currency rate
+        """
+        if from_currency == to_currency:
+            return D(1)
+
+        try:
+            return self.rates[from_currency][to_currency][max(d for d in self.rates[from_currency][to_currency].keys()
+                                                              if d <= date)]
+        except Exception:
+            raise MissingRateError('Error: finding rate from:' + from_currency + ' to: ' + to_currency
+                                   + ' for date: ' + str(date))
+
+    def get_payment_rates(self, currency, fee_currency, date):
+        """
+        Return rates for a payment - (currency -> CZK, fee_currency -> CZK, fee_currency -> currency)
+        """
+        return (self.get_rate(currency, 'CZK', date), self.get_rate(fee_currency, 'CZK', date),
+                self.get_rate(fee_currency, currency, date))
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+
+"""
+File run - the payment sessions of the input tables of the data directory are processed to its output tables
+by the options of the config (lib/config.py). The component (component.py) is an adapter on top of it, it maps
+the config to the options and writes the state and the manifests of the run.
+
+    costs_run = run.Run(data_dir, params, date_from, exceptions, workers=4, incremental=True)
+    stats = costs_run.run(state)
+    costs_run.state         state for the next run, None if not written
+    costs_run.manifests     (table, definition) of the output tables with a manifest
+"""
+
+import contextlib
+import csv
+import datetime
+import logging
+import os
+import time
+
+from lib import aggregate, api, checkpoint, columnar, dedup, diff, errors, impact, incremental, metrics, payment
+from lib import pipeline, scope, shadow, shard, tables
+
+# config parameters in the fingerprint of the incremental state
+FINGERPRINT_PARAMS = ('date_performed_from', 'partnership_cost_exceptions')
+
+# config parameters in the fingerprint of the checkpoints
+CHECKPOINT_PARAMS = FINGERPRINT_PARAMS + ('fault_tolerant',)
+
+
+class Run():
+
+    def __init__(self, data_dir, params, date_from=datetime.date.min, exceptions=None, workers=1, incremental=False,
+                 lookback_days=0, engine='decimal', metrics=False, fault_tolerant=False, max_error_rate=0.01,
+                 checkpoint=False, pipeline=False, pipeline_queue_size=8, output_slices=1, output_gzip=False,
+                 format='csv', cache_dir=None, prune_inputs=False, output_mode='rows', fee_impact=False,
+                 diff_store=None, diff_deletions=False, shadow_rate=None, dedup=False, dedup_max_entries=1000000):
+        """
+        data_dir    data directory of the run - in/tables, out/tables and out/files
+        params      parameters of the config (Config.params) - those of the fingerprints
+        date_from   Config.get_date_from(), exceptions Config.get_cost_exceptions(), the rest are the values
+                    of the other Config getters
+        """
+        self.data_dir = data_dir
+        self.params = params
+        self.date_from = date_from
+        self.exceptions = {} if exceptions is None else exceptions
+        self.workers = workers
+        self.incremental = incremental
+        self.lookback_days = lookback_days
+        self.engine = engine
+        self.metrics = metrics
+        self.fault_tolerant = fault_tolerant
+        self.max_error_rate = max_error_rate
+        self.checkpoint = checkpoint
+        self.pipeline = pipeline
+        self.pipeline_queue_size = pipeline_queue_size
+        self.output_slices = output_slices
+        self.output_gzip = output_gzip
+        self.format = format
+        self.cache_dir = cache_dir
+        self.prune_inputs = prune_inputs
+        self.output_mode = output_mode
+        self.fee_impact = fee_impact
+        self.diff_store = diff_store
+        self.diff_deletions = diff_deletions
+        self.shadow_rate = shadow_rate
+        self.dedup = dedup
+        self.dedup_max_entries = dedup_max_entries
+
+        # sliced output - a directory of slices without a header, written by parallel writers
+        self.sliced = output_slices > 1 or output_gzip
+
+        # aggregated output - sums by day, partnership, channel, currency and cost algorithm in place of or with
+        # the rows
+        self.with_rows = output_mode != 'aggregates'
+
+        # input files
+        tables_in_path = os.path.join(data_dir, 'in', 'tables')
+        self.tables_out_path = os.path.join(data_dir, 'out', 'tables')
+        self.fee_path = os.path.join(tables_in_path, 'payment_fees.csv')
+        self.gopay_rates_path = os.path.join(tables_in_path, 'gopay_rates.csv')  # gopay rates loaded from CNB
+        self.eur_rates_path = os.path.join(tables_in_path, 'eur_rates.csv')  # EUR from Keboola
+        self.sessions_path = os.path.join(tables_in_path, 'payments-sessions-stage.csv')  # csv, csv.gz or sliced
+        self.costs_path = os.path.join(self.tables_out_path, 'payment_costs.csv')
+        # fee rules matched in the last runs
+        self.fee_rules_in_path = os.path.join(tables_in_path, 'payment_costs_fee_rules.csv')
+        self.fee_rules_path = os.path.join(self.tables_out_path, 'payment_costs_fee_rules.csv')
+
+        # incremental mode - fingerprints of the state, set by run()
+        self.fingerprint_config = None
+        self.fee_rules = None
+        self.rates_history = None
+
+        # result of the run
+        self.state = None
+        self.manifests = []
+
+    def check(self):
+        """
+        Check the combination of the options
+        """
+        if self.output_mode != 'rows' and (self.checkpoint or self.incremental):
+            logging.error('The aggregated output cannot be combined with checkpoints or the incremental mode.')
+            raise Exception('The aggregated output cannot be combined with checkpoints or the incremental mode.')
+
+        if self.fee_impact and (not self.incremental or self.checkpoint):
+            logging.error('The fee change impact analysis needs the incremental mode and cannot be combined with '
+                          'checkpoints.')
+            raise Exception('The fee change impact analysis needs the incremental mode and cannot be combined with '
+                            'checkpoints.')
+
+        # differential output - only rows changed since the last run, compared with the digests of its output
+        if self.diff_store is not None and (self.checkpoint or self.incremental or self.sliced
+                                            or self.format == 'parquet' or not self.with_rows):
+            logging.error('The differential output needs the csv rows output and cannot be combined with checkpoints, '
+                          'the incremental mode or a sliced output.')
+            raise Exception('The differential output needs the csv rows output and cannot be combined with '
+                            'checkpoints, the incremental mode or a sliced output.')
+
+        if self.diff_deletions and self.diff_store is None:
+            logging.error('The deletions of the differential output need diff_store.')
+            raise Exception('The deletions of the differential output need diff_store.')
+
+        # parquet format - Parquet / Arrow input files, the output is a parquet file (tables are csv only)
+        if self.format == 'parquet':
+            columnar.check_pyarrow()
+            if self.checkpoint or self.incremental or self.sliced:
+                logging.error('The parquet format cannot be combined with checkpoints, the incremental mode or '
+                              'a sliced output.')
+                raise Exception('The parquet format cannot be combined with checkpoints, the incremental mode or '
+                                'a sliced output.')
+
+    def set_inputs(self):
+        """
+        Paths of the input files of the format
+        """
+        if self.format == 'parquet':
+            self.fee_path, self.gopay_rates_path, self.eur_rates_path, self.sessions_path = (
+                columnar.get_input_path(p) for p in (self.fee_path, self.gopay_rates_path, self.eur_rates_path,
+                                                     self.sessions_path))
+            self.costs_path = os.path.join(self.data_dir, 'out', 'files', 'payment_costs.parquet')
+        else:
+            self.sessions_path = tables.get_input_path(self.sessions_path)
+
+        if self.checkpoint and (self.sliced or not tables.is_plain(self.sessions_path)):
+            logging.error('Checkpoints need an uncompressed and not sliced input and output.')
+            raise Exception('Checkpoints need an uncompressed and not sliced input and output.')
+
+    def get_since(self, state):
+        """
+        Incremental mode - payments performed after the watermark from the last run are processed
+        Returns     since (None for all payments), fee change impact (lib/impact.py) of the changed fee sheet or None
+        """
+        if not state.get('date_performed_max'):
+            return None, None
+
+        fee_impact = None
+        fingerprint = incremental.get_fingerprint(self.fee_path, self.rates_history, state['date_performed_max'],
+                                                  self.fingerprint_config)
+
+        # fee change impact - only the fee sheet has changed, the payments it can affect are recomputed
+        if self.fee_impact and state.get('fingerprint') != fingerprint:
+            rates_fingerprint = incremental.get_fingerprint(None, self.rates_history, state['date_performed_max'],
+                                                            self.fingerprint_config)
+            fee_impact = impact.get_impact(state, rates_fingerprint, self.fee_rules, self.fee_rules_in_path)
+
+        if fee_impact is None:
+            return incremental.get_since(state, fingerprint, self.lookback_days), None
+
+        return incremental.get_lookback(state, self.lookback_days), fee_impact
+
+    def get_state(self, state, since, stats, rejects):
+        """
+        Incremental mode - state with the new watermark
+        Returns     state, None if no payment was processed
+        """
+        watermark = stats['date_performed_max']
+        if since is not None and (watermark is None or state['date_performed_max'] > watermark):
+            watermark = state['date_performed_max']
+
+        # rejected payments are processed again in the next run
+        if rejects is not None and rejects.date_min is not None:
+            before_rejected = (datetime.datetime.strptime(rejects.date_min, incremental.WATERMARK_FORMAT)
+                               - datetime.timedelta(seconds=1))
+            watermark = min(watermark, before_rejected.strftime(incremental.WATERMARK_FORMAT))
+
+        if watermark is None:
+            return None
+
+        fingerprint = incremental.get_fingerprint(self.fee_path, self.rates_history, watermark,
+                                                  self.fingerprint_config)
+
+        # fee change impact - rates and config without the fees, and the fee rules of this run
+        extra = {}
+        if self.fee_impact:
+            extra['rates_fingerprint'] = incremental.get_fingerprint(None, self.rates_history, watermark,
+                                                                     self.fingerprint_config)
+            extra['fee_rules'] = self.fee_rules
+
+        return incremental.get_state(watermark, fingerprint, **extra)
+
+    def run(self, state=None):
+        """
+        Process the payment sessions - the state of the last run is used in the incremental mode
+        Returns     run stats
+        """
+        self.check()
+        self.set_inputs()
+        state = {} if state is None else state
+
+        # deduplication - only the latest version of every payment session is processed
+        run_dedup = None
+        dedup_copy = False
+        if self.dedup:
+            run_dedup = dedup.Dedup(self.sessions_path, self.dedup_max_entries).index()
+
+            # the parallel run and the checkpoints read the input by byte ranges - a deduplicated copy of the input
+            dedup_copy = self.workers > 1 or self.checkpoint
+            if dedup_copy:
+                self.sessions_path = run_dedup.write(os.path.join(run_dedup.directory, 'payments-sessions-stage.csv'))
+
+        # stage timers of the run
+        run_start = time.perf_counter()
+        run_metrics = metrics.Metrics() if self.metrics else None
+        run_aggregates = None if self.output_mode == 'rows' else aggregate.Aggregates()
+
+        # incremental mode - process only payments performed after the watermark from the last run
+        since = None
+        fee_impact = None
+        if self.incremental:
+            self.fingerprint_config = {k: self.params[k] for k in FINGERPRINT_PARAMS}
+            self.fee_rules = (impact.get_rules(api.load_fees(self.fee_path, self.cache_dir)) if self.fee_impact
+                              else None)
+            # rates of the fingerprints - read once for the run
+            self.rates_history = incremental.read_rates(self.gopay_rates_path, self.eur_rates_path)
+            since, fee_impact = self.get_since(state)
+
+        # payments after since are selected by fee_impact, the affected older ones too
+        process_since = since if fee_impact is None else None
+
+        # pruned inputs - only fees and rates for the currencies and dates of the payment sessions
+        run_scope = scope.get_scope(self.sessions_path, self.date_from, process_since) if self.prune_inputs else None
+
+        # counter
+        stats = payment.get_stats()
+
+        # checkpoints - a restarted run with the same inputs continues from the last checkpoint
+        cp = None
+        resume = None
+        if self.checkpoint:
+            checkpoint_config = {k: self.params[k] for k in CHECKPOINT_PARAMS}
+            checkpoint_config['since'] = since
+            cp = checkpoint.Checkpoint(os.path.join(self.data_dir, 'out', 'payment_costs_checkpoint.json'),
+                                       checkpoint.get_fingerprint(self.sessions_path, self.fee_path,
+                                                                  self.gopay_rates_path, self.eur_rates_path,
+                                                                  checkpoint_config))
+            resume = cp.load()
+            if resume is not None:
+                stats.update(resume['stats'])
+
+        # superseded versions left out of the deduplicated copy
+        if dedup_copy and resume is None:
+            stats['ignored'] += run_dedup.count
+
+        # shadow verification - out file for the discrepancies of the sampled payments with the reference path
+        run_shadow = None
+        shadow_file = None
+        if self.shadow_rate is not None:
+            shadow_file = open(os.path.join(self.tables_out_path, 'payment_costs_shadow.csv'), mode='w',
+                               encoding='utf-8')
+            shadow_writer = csv.DictWriter(shadow_file, fieldnames=shadow.SHADOW_FIELDS)
+            shadow_writer.writeheader()
+
+        # fault-tolerant mode - out file for rejected payments
+        rejects = None
+        rejected_file = None
+        if self.fault_tolerant:
+            rejected_file = checkpoint.open_output(os.path.join(self.tables_out_path, 'payment_costs_rejected.csv'),
+                                                   None if resume is None else resume['rejected_size'])
+            rejects = errors.Rejects(rejected_file, self.max_error_rate)
+            if resume is None:
+                rejects.writeheader()
+            else:
+                rejects.date_min = resume['rejected_date_min']
+
+        # out file for payment costs
+        if not self.with_rows:
+            out = contextlib.nullcontext()
+        elif self.format == 'parquet':
+            os.makedirs(os.path.dirname(self.costs_path), exist_ok=True)
+            out = columnar.ParquetWriter(self.costs_path, payment.OUTPUT_FIELDS,
+                                         ('payment_session_id', 'cost_algorithm'))
+        elif self.sliced:
+            out = tables.SlicedWriter(self.costs_path, payment.OUTPUT_FIELDS, self.output_slices, self.output_gzip)
+        else:
+            out = checkpoint.open_output(self.costs_path, None if resume is None else resume['out_size'])
+
+        # fee change impact - out file for the fee rules matched by the payments
+        fee_rules_file = None
+        if self.fee_impact:
+            fee_rules_file = open(self.fee_rules_path, mode='w', encoding='utf-8')
+            fee_rules_writer = csv.DictWriter(fee_rules_file, fieldnames=impact.MATCH_FIELDS)
+            fee_rules_writer.writeheader()
+
+        # columns of the payment output
+        if run_aggregates is not None:
+            output_fields = aggregate.INPUT_FIELDS
+        elif fee_rules_file is not None:
+            output_fields = payment.OUTPUT_FIELDS + ['fee_rule']
+        else:
+            output_fields = payment.OUTPUT_FIELDS
+
+        diff_out = None
+        with out as pc:
+
+            if not self.with_rows:
+                writer = run_aggregates
+            elif self.sliced or self.format == 'parquet':
+                writer = pc
+            else:
+                writer = csv.DictWriter(pc, fieldnames=payment.OUTPUT_FIELDS)
+                if resume is None:
+                    writer.writeheader()
+
+                # differential output - the rows are written through the comparison with the last run
+                if self.diff_store is not None:
+                    diff_out = diff.DiffOutput(pc, self.diff_store)
+                    writer = csv.DictWriter(diff_out, fieldnames=payment.OUTPUT_FIELDS)
+            if self.with_rows and run_aggregates is not None:
+                writer = aggregate.RowWriter(writer, run_aggregates)
+            if fee_rules_file is not None:
+                writer = impact.MatchWriter(writer, fee_rules_writer, payment.OUTPUT_FIELDS)
+            if run_metrics is not None:
+                writer = metrics.TimedWriter(writer, run_metrics)
+
+            # checkpoint after every processed chunk of payment sessions
+            offset = None if resume is None else resume['offset']
+
+            def save_checkpoint(end):
+                cp.save(end, pc, rejected_file, stats, None if rejects is None else rejects.date_min)
+
+            # parallel run - fees and rates are loaded in every worker
+            if self.workers > 1:
+                if shadow_file is not None:
+                    run_shadow = shadow.Shadow(self.shadow_rate, None, None, None, shadow_writer)
+
+                shard.process_parallel(self.sessions_path, pc if diff_out is None else diff_out, self.workers,
+                                       self.fee_path, self.gopay_rates_path, self.eur_rates_path, self.date_from,
+                                       self.exceptions, stats, since, self.engine, run_metrics, rejects, offset,
+                                       None if cp is None else save_checkpoint, self.cache_dir, run_scope,
+                                       run_aggregates, fee_rules_file, fee_impact, run_shadow)
+
+            else:
+                # loading cost fee definitions
+                fees = api.load_fees(self.fee_path, self.cache_dir, run_scope)
+
+                # loading currency rates
+                rates_scope = None if run_scope is None else run_scope.with_fee_currencies(fees)
+                rates = api.load_rates(self.gopay_rates_path, self.eur_rates_path, self.cache_dir, rates_scope)
+
+                if shadow_file is not None:
+                    run_shadow = shadow.Shadow(self.shadow_rate, fees, rates, self.exceptions, shadow_writer)
+
+                def process(payments):
+                    if fee_impact is not None:
+                        payments = fee_impact.select(payments, since, stats)
+
+                    return api.calculate_costs(payments, fees, rates, self.exceptions, self.date_from, process_since,
+                                               self.engine, stats, run_metrics, rejects, output_fields, run_shadow)
+
+                def write_costs(payments):
+                    # pipelined run - reading, computing and writing in separate threads
+                    if self.pipeline:
+                        pipeline.run(payments, process, writer.writerows, self.pipeline_queue_size)
+                        return
+
+                    # loop over payment sessions in in-file
+                    for p_final in process(payments):
+
+                        # writer row to file
+                        writer.writerow(p_final)
+
+                # chunks of payment sessions - a checkpoint after every chunk
+                if cp is not None:
+                    header, chunks = shard.get_chunks(self.sessions_path, checkpoint.CHUNK_SIZE, offset)
+                    for start, end in chunks:
+                        write_costs(shard.read_chunk(self.sessions_path, header, start, end))
+                        save_checkpoint(end)
+
+                # in file for payment sessions, without the superseded versions
+                else:
+                    # reader of payment sessions
+                    payments = tables.read_table(self.sessions_path, payment.INPUT_COLUMNS)
+                    dedup_stats = {'ignored': 0}
+                    if run_dedup is not None and not dedup_copy:
+                        # the selection runs in the reader thread of the pipeline - counted apart from the stats
+                        # of the compute stage and merged when the run is done
+                        payments = run_dedup.select(payments, dedup_stats)
+                    write_costs(payments)
+                    stats['ignored'] += dedup_stats['ignored']
+
+            # differential output - the rest of the rows and the payments missing since the last run
+            if diff_out is not None:
+                diff_out.flush()
+                if self.diff_deletions:
+                    deleted_path = os.path.join(self.tables_out_path, 'payment_costs_deleted.csv')
+                    with open(deleted_path, mode='w', encoding='utf-8') as f:
+                        deleted_writer = csv.writer(f)
+                        deleted_writer.writerow(['payment_session_id'])
+                        deleted_writer.writerows([row_id] for row_id in diff_out.get_deleted())
+
+        if fee_rules_file is not None:
+            fee_rules_file.close()
+
+        if shadow_file is not None:
+            shadow_file.close()
+            run_shadow.log()
+
+        # fault-tolerant mode - the error rate of the whole run
+        if rejects is not None:
+            rejected_file.close()
+            rejects.check(stats, final=True)
+
+        # incremental mode - store the new watermark, the output is loaded incrementally
+        if self.incremental:
+            self.state = self.get_state(state, since, stats, rejects)
+
+        # aggregated output table
+        if run_aggregates is not None:
+            run_aggregates.write(os.path.join(self.tables_out_path, 'payment_costs_aggregated.csv'))
+
+        # manifest - the output is loaded incrementally (the differential output too), slices have no header
+        upsert = self.incremental or diff_out is not None
+        if self.with_rows and (upsert or self.sliced):
+            self.manifests.append(('payment_costs.csv', {
+                'is_sliced': self.sliced, 'columns': payment.OUTPUT_FIELDS if self.sliced else None,
+                'incremental': True if upsert else None, 'primary_key': ['payment_session_id'] if upsert else None}))
+
+        # fee rules matched by the payments, loaded incrementally
+        if fee_rules_file is not None:
+            self.manifests.append(('payment_costs_fee_rules.csv', {'incremental': True,
+                                                                   'primary_key': ['payment_session_id']}))
+
+        # run metrics table
+        if run_metrics is not None:
+            run_metrics.write(os.path.join(self.tables_out_path, 'payment_costs_metrics.csv'), stats,
+                              time.perf_counter() - run_start)
+
+        # finished - the next run starts from the beginning
+        if cp is not None:
+            cp.remove()
+
+        if run_dedup is not None:
+            run_dedup.remove()
+
+        # finished - the next run is compared with the output of this one
+        if diff_out is not None:
+            diff_out.commit()
+
+        logging.info('Finished! Run stats: {}'. format(str(stats)))
+        return stats
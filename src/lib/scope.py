@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+Scope of the run - currencies and the date range of the payment sessions to process, found by a pre-pass over
+the sessions. Fees and rates outside of the scope are not loaded, so the load time and memory depend on the run
+window and not on the whole history of the fee and rate files.
+"""
+
+import logging
+
+from lib import payment, tables
+
+# columns of the payment sessions read by the pre-pass
+SCOPE_COLUMNS = ['date_performed', 'currency', 'session_state']
+
+
+class Scope():
+
+    def __init__(self, currencies, date_from, date_to):
+        """
+        currencies  payment currencies and transaction fee currencies, CZK is always included
+        date_from   first and last day of the payments, datetime.date
+        date_to
+        """
+        self.currencies = frozenset(currencies) | {'CZK'}
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def with_fee_currencies(self, fees):
+        """
+        The scope with the transaction fee currencies of the fees added - rates from them are needed too
+        """
+        currencies = {f['transaction_fee_currency'] for f in fees if f['transaction_fee_currency'] is not None}
+        return Scope(self.currencies | currencies, self.date_from, self.date_to)
+
+    def has_fee(self, f):
+        """
+        The fee can apply to a payment of the scope
+        """
+        return ((f['valid_to'] is None or f['valid_to'] >= self.date_from) and f['valid_from'] <= self.date_to
+                and (f['currency'] is None or f['currency'] in self.currencies))
+
+    def prune_rates(self, rows, date_column, currency_column):
+        """
+        Rate rows of the scope currencies and dates. Of the rows before the scope only the latest one per currency
+        is kept, the first days of the scope are looked up as of it.
+        """
+        date_from = self.date_from.isoformat()
+        date_to = self.date_to.isoformat()
+        prior = {}
+
+        for d in rows:
+            currency = d[currency_column]
+            if currency not in self.currencies or d[date_column] > date_to:
+                continue
+
+            if d[date_column] < date_from:
+                if currency not in prior or d[date_column] > prior[currency][date_column]:
+                    prior[currency] = d
+                continue
+
+            yield d
+
+        yield from prior.values()
+
+    def __repr__(self):
+        return 'Scope({}, {}, {})' . format(sorted(self.currencies), self.date_from, self.date_to)
+
+
+def get_scope(sessions_path, date_from, since=None):
+    """
+    Pre-pass over the payment sessions - the scope of the successful payments performed on or after date_from
+    (and after since, if set). Sessions with a wrong date_performed are skipped, they are rejected by the run.
+    Returns     Scope
+    """
+    first = date_from.isoformat()
+    currencies = set()
+    date_min = None
+    date_max = None
+
+    for ps in tables.read_table(sessions_path, SCOPE_COLUMNS):
+        day = ps['date_performed'][0:10]
+        if day < first or ps['session_state'] not in payment.SUCCESSFUL_STATES:
+            continue
+        if since is not None and ps['date_performed'][0:19] <= since:
+            continue
+
+        try:
+            payment.parse_day(day)
+        except ValueError:
+            continue
+
+        currencies.add(ps['currency'])
+        if date_min is None or day < date_min:
+            date_min = day
+        if date_max is None or day > date_max:
+            date_max = day
+
+    scope = Scope(currencies, payment.parse_day(date_min or first), payment.parse_day(date_max or first))
+    logging.info('Scope of the run: {}' . format(scope))
+    return scope
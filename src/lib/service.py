@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cost calculation service - fees and rates stay loaded in memory and cost quotes of single payments or batches
+are answered over a local HTTP (TCP) or Unix socket endpoint, with the same semantics as Payment.process_payment.
+
+    POST /costs     a payment session (json object with the columns of the payment sessions table, at least
+                    REQUIRED_COLUMNS) or a list of them -> the payment output (OUTPUT_FIELDS) or a list of them,
+                    a failing payment -> {payment_session_id, error_code, error_message}
+    GET /health     loaded fees and the time of the last load
+
+The fee and rate files are watched - a changed file is loaded in a background thread and the loaded fees and
+rates replace the old ones at once, the requests are answered by the old ones until then. A fee sheet that fails
+to load (i.e. invalid fees) is reported and the old fees and rates are kept.
+"""
+
+import datetime
+import http.server
+import json
+import logging
+import os
+import socketserver
+import threading
+from decimal import Decimal
+
+from lib import api, errors, payment
+
+# how often the fee and rate files are checked for a change, in seconds
+RELOAD_INTERVAL = 5
+
+# max size of a request body in bytes
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+# columns a payment session of a request must have, the other columns of the cost calculation are empty if missing
+# (as the empty values of the payment sessions table)
+REQUIRED_COLUMNS = ('payment_session_id', 'date_performed', 'payment_channel', 'currency', 'amount')
+
+
+def get_signature(paths):
+    """
+    Modification times and sizes of the files - a changed signature means a changed file
+    """
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((stat.st_mtime_ns, stat.st_size))
+
+    return tuple(signature)
+
+
+def to_text(value):
+    """
+    json value -> the text of the payment sessions table, numbers are parsed as Decimal
+    """
+    if value is None:
+        return ''
+    if value is True:
+        return 'TRUE'
+    if value is False:
+        return 'FALSE'
+    if isinstance(value, Decimal):
+        return value
+
+    return str(value)
+
+
+class Model():
+    """
+    Fees and rates of one load, replaced as a whole
+    """
+
+    def __init__(self, fees, rates, signature):
+        self.fees = fees
+        self.rates = rates
+        self.signature = signature
+        self.loaded = datetime.datetime.now().isoformat(timespec='seconds')
+
+
+class CostService():
+
+    def __init__(self, fee_path, gopay_rates_path, eur_rates_path, exceptions, cache_dir=None):
+        """
+        fee_path, gopay_rates_path, eur_rates_path  input files, as in the run
+        exceptions      cost exceptions of the config (Config.get_cost_exceptions(unbounded=True) - an open
+                        exception is not cut at the start day of the service)
+        cache_dir       cache of the compiled fees and rates (lib/cache.py), if set
+        """
+        self.paths = (fee_path, gopay_rates_path, eur_rates_path)
+        self.exceptions = exceptions
+        self.cache_dir = cache_dir
+        self.model = self.load()
+
+    def load(self):
+        """
+        Load the fees and rates
+        """
+        fee_path, gopay_rates_path, eur_rates_path = self.paths
+        signature = get_signature(self.paths)
+        fees = api.load_fees(fee_path, self.cache_dir)
+        rates = api.load_rates(gopay_rates_path, eur_rates_path, self.cache_dir)
+
+        logging.info('Service: loaded {} fees.' . format(len(fees)))
+        return Model(fees, rates, signature)
+
+    def reload(self):
+        """
+        Load the fees and rates if a file has changed. Returns True if they were replaced.
+        """
+        try:
+            if get_signature(self.paths) == self.model.signature:
+                return False
+            model = self.load()
+
+        except Exception as e:
+            logging.error('Service: cannot reload the fees and rates, the old ones are kept: {}' . format(e))
+            return False
+
+        # a single assignment - a request uses either the old or the new model
+        self.model = model
+        return True
+
+    def watch(self, stopped, interval=RELOAD_INTERVAL):
+        """
+        Reload the changed files until stopped (threading.Event) is set
+        """
+        while not stopped.wait(interval):
+            self.reload()
+
+    def quote(self, ps, model=None):
+        """
+        Costs of a payment session - the payment output, a failing payment raises the error
+        """
+        model = self.model if model is None else model
+        missing = [k for k in REQUIRED_COLUMNS if k not in ps]
+        if missing:
+            raise errors.MissingFieldError('Error: missing fields: ' + ', '.join(missing))
+
+        session = dict.fromkeys(payment.SESSION_COLUMNS, '')
+        session.update((k, to_text(v)) for k, v in ps.items())
+
+        p = payment.Payment(session, model.fees, model.rates, self.exceptions)
+        p.process_payment()
+        return {k: p.parsed[k] for k in payment.OUTPUT_FIELDS}
+
+    def quote_many(self, sessions):
+        """
+        Costs of a list of payment sessions, all by the same fees and rates - errors are returned per payment
+        """
+        model = self.model
+        result = []
+        for ps in sessions:
+            try:
+                result.append(self.quote(ps, model))
+            except Exception as e:
+                result.append(get_error(ps, e))
+
+        return result
+
+    def get_health(self):
+        model = self.model
+        return {'status': 'ok', 'fees': len(model.fees), 'loaded': model.loaded}
+
+
+def get_error(ps, error):
+    """
+    Error response of a payment
+    """
+    return {'payment_session_id': ps.get('payment_session_id') if isinstance(ps, dict) else None,
+            'error_code': errors.get_code(error), 'error_message': str(error)}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Requests of the service - the server has the service attribute
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are sent separately, no delayed ack wait between them
+
+    def send_json(self, status, data):
+        body = json.dumps(data, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error_message': 'not found'})
+            return
+
+        self.send_json(200, self.server.service.get_health())
+
+    def do_POST(self):
+        if self.path != '/costs':
+            self.send_json(404, {'error_message': 'not found'})
+            return
+
+        try:
+            size = int(self.headers.get('Content-Length', 0))
+            if size > MAX_BODY_SIZE:
+                self.send_json(413, {'error_message': 'request over {} bytes' . format(MAX_BODY_SIZE)})
+                return
+            data = json.loads(self.rfile.read(size), parse_float=Decimal, parse_int=str)
+        except Exception as e:
+            self.send_json(400, {'error_message': 'wrong request: {}' . format(e)})
+            return
+
+        service = self.server.service
+        if isinstance(data, list):
+            self.send_json(200, service.quote_many(data))
+            return
+
+        try:
+            self.send_json(200, service.quote(data))
+        except Exception as e:
+            self.send_json(422, get_error(data, e))
+
+    def address_string(self):
+        # a Unix socket has no client address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        logging.debug('Service: ' + format % args)
+
+
+class HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # the socket of a previous service
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+
+def make_server(service, host='127.0.0.1', port=None, socket_path=None):
+    """
+    HTTP server of the service on the TCP port or on the Unix socket
+    """
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, Handler)
+    else:
+        server = HTTPServer((host, port), Handler)
+
+    server.service = service
+    return server
+
+
+def serve(service, host='127.0.0.1', port=None, socket_path=None, reload_interval=RELOAD_INTERVAL):
+    """
+    Run the service until interrupted, the files are watched in a background thread
+    """
+    server = make_server(service, host, port, socket_path)
+    stopped = threading.Event()
+    watcher = threading.Thread(target=service.watch, args=(stopped, reload_interval), name='service-watcher',
+                               daemon=True)
+    watcher.start()
+
+    logging.info('Service: listening on {}' . format(socket_path or '{}:{}' . format(host, server.server_address[1])))
+    try:
+        server.serve_forever()
+    finally:
+        stopped.set()
+        server.server_close()
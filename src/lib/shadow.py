@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shadow verification - a sample of the payment sessions is computed again by the reference path (Decimal
+arithmetic of Payment.process_payment, the columns parsed one by one as by the original parser, fees looked up
+by a scan of the fee list and rates by a scan of the dated rates) and every output column is compared exactly
+with the output of the run. Differences are written to a discrepancy report.
+
+Sessions are sampled by a hash of payment_session_id, so the same sessions are verified in every run
+and by any number of workers. The overhead is about the sample rate times the cost of the reference path.
+"""
+
+import collections
+import datetime
+import logging
+import zlib
+
+from lib import fee, payment
+from lib.rate import RateScan
+from lib.errors import ParseError
+
+# columns of the discrepancy report
+SHADOW_FIELDS = ['payment_session_id', 'column', 'value', 'reference_value', 'fee_rule', 'reference_fee_rule']
+
+# columns compared with the reference
+COMPARED_FIELDS = payment.OUTPUT_FIELDS + ['fee_rule']
+
+
+class Report(list):
+    """
+    Discrepancy rows kept in memory - the report of a chunk of the parallel run
+    """
+    writerow = list.append
+
+
+class Reference(payment.Payment):
+    """
+    Payment of the reference path - all columns of the session are parsed to a dict by the original parser,
+    independent of the converters of the optimized parser
+    """
+
+    def parse_payment(self):
+        """
+        Parse the payment
+        """
+        parsed_payment = {}
+
+        for k, v in self.raw.items():
+
+            # empty strings replacement
+            value = None if v == '' else v
+
+            try:
+                # dates -> date data type
+                if k in ('date_created', 'date_performed') and value is not None:
+                    value = datetime.datetime.strptime(value[0:19], '%Y-%m-%d %H:%M:%S')
+
+                # numbers -> Decimal data type, Decimal values of the columnar input are kept
+                if k in ('amount_refunded', 'amount', 'interchange_fee', 'association_fee') and isinstance(value, str):
+                    value = payment.D(value.replace('%', '').replace(' ', '').replace(',', '.').replace('\xa0', ''))
+
+                # is_business
+                if k == 'card_is_business' and value is not None:
+                    value = False if value == 'FALSE' else True
+            except Exception:
+                raise ParseError('Error: parse column: ' + k + ', value: ' + str(v))
+
+            parsed_payment[k] = value
+
+        self.parsed = parsed_payment
+        return self
+
+
+class Shadow():
+
+    def __init__(self, rate, fees, rates, exceptions, report):
+        """
+        rate        sampled fraction of the sessions, 0 - 1
+        fees        fee index of the run, None for the main process of the parallel run (chunks are merged)
+        rates       rates of the run, None for the main process of the parallel run
+        exceptions  cost exceptions of the run
+        report      writer of the discrepancy rows (csv.DictWriter with SHADOW_FIELDS)
+        """
+        self.rate = rate
+        self.threshold = int(rate * 2 ** 32)
+        self.fees = None if fees is None else fee.FeeScan(fees)
+        self.rates = None if rates is None else RateScan(rates)
+        self.exceptions = exceptions
+        self.report = report
+        self.pending = collections.deque()
+        self.counts = {'checked': 0, 'discrepant': 0}
+
+    def is_sampled(self, payment_session_id):
+        return zlib.crc32(payment_session_id.encode('utf-8')) < self.threshold
+
+    def sample(self, payments):
+        """
+        Pass the payment sessions through, the sampled ones are kept until their output
+        """
+        for ps in payments:
+            if self.is_sampled(ps['payment_session_id']):
+                self.pending.append(ps)
+            yield ps
+
+    def verify(self, rows, fields):
+        """
+        Pass the output rows (with the fee_rule column) through with the fields columns, the rows of the sampled
+        sessions are compared with the reference. The output is in the order of the sessions, so the sampled
+        sessions before the row have no output (ignored or rejected) and are dropped.
+        """
+        strip = 'fee_rule' not in fields
+        for row in rows:
+            payment_session_id = row['payment_session_id']
+            if self.is_sampled(payment_session_id):
+                ps = self.pending.popleft()
+                while ps['payment_session_id'] != payment_session_id:
+                    ps = self.pending.popleft()
+                self.check(ps, row)
+
+            yield {k: row[k] for k in fields} if strip else row
+
+    def check(self, ps, row):
+        """
+        Compare the output row with the reference output of the payment session
+        """
+        self.counts['checked'] += 1
+        reference = Reference(ps, self.fees, self.rates, self.exceptions)
+        try:
+            reference.process_payment()
+            reference_values = reference.parsed
+            differences = [k for k in COMPARED_FIELDS if str(row[k]) != str(reference_values[k])]
+
+        except Exception as e:
+            reference_values = {'fee_rule': None if reference.fee is None else reference.fee.rule_id}
+            differences = ['error']
+            row = dict(row, error='')
+            reference_values['error'] = str(e)
+
+        if not differences:
+            return
+
+        self.counts['discrepant'] += 1
+        for k in differences:
+            self.report.writerow({'payment_session_id': ps['payment_session_id'], 'column': k, 'value': row[k],
+                                  'reference_value': reference_values[k], 'fee_rule': row['fee_rule'],
+                                  'reference_fee_rule': reference_values['fee_rule']})
+
+    def merge(self, report, counts):
+        """
+        Add the discrepancy rows and counts of a chunk
+        """
+        self.report.writerows(report)
+        for k in self.counts:
+            self.counts[k] += counts[k]
+
+    def log(self):
+        if self.counts['discrepant']:
+            logging.error('Shadow verification: {discrepant} of {checked} checked payments differ from the reference, '
+                          'see the discrepancy report.' . format(**self.counts))
+        else:
+            logging.info('Shadow verification: {checked} checked payments, no discrepancy.' . format(**self.counts))
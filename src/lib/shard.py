@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import csv
+import io
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from lib import aggregate, api, checkpoint, errors, impact, metrics, payment, shadow, tables
+
+# chunk size limits in bytes
+MIN_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# chunks submitted to the pool ahead of the written one, per worker - bounds the results held in memory
+CHUNKS_AHEAD = 2
+
+# per worker process data, set by init_worker()
+worker = {}
+
+
+def get_chunks(path, chunk_size, offset=None):
+    """
+    Split the file (from the offset on a line boundary, if set) into byte ranges on line boundaries.
+    Returns     header line, list of (start, end) byte offsets
+    """
+    size = os.path.getsize(path)
+    chunks = []
+
+    with open(path, mode='rb') as f:
+        header = f.readline()
+        start = f.tell() if offset is None else max(offset, f.tell())
+
+        while start < size:
+            f.seek(min(start + chunk_size, size) - 1)
+            f.readline()  # move to the end of the line
+            end = min(f.tell(), size)
+            chunks.append((start, end))
+            start = end
+
+    return header, chunks
+
+
+def read_chunk(path, header, start, end):
+    """
+    Read the byte range of a csv file - returns csv.DictReader over its rows.
+    start None reads the whole file (a gzip-compressed file or a slice), header are then its columns or None.
+    """
+    if start is None:
+        return tables.read_slice(path, header, payment.INPUT_COLUMNS)
+
+    with open(path, mode='rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    text = io.TextIOWrapper(io.BytesIO(header + data), encoding='utf-8')
+    return csv.DictReader(text)
+
+
+def init_worker(fee_path, gopay_rates_path, eur_rates_path, date_from, exceptions, since, engine, with_metrics=False,
+                fault_tolerant=False, cache_dir=None, run_scope=None, with_rows=True, with_aggregates=False,
+                with_matches=False, fee_impact=None, shadow_rate=None):
+    """
+    Load fees and rates once per worker process
+    """
+    worker['fees'] = api.load_fees(fee_path, cache_dir, run_scope)
+    rates_scope = None if run_scope is None else run_scope.with_fee_currencies(worker['fees'])
+    worker['rates'] = api.load_rates(gopay_rates_path, eur_rates_path, cache_dir, rates_scope)
+    worker['date_from'] = date_from
+    worker['exceptions'] = exceptions
+    worker['since'] = since
+    worker['engine'] = engine
+    worker['metrics'] = with_metrics
+    worker['fault_tolerant'] = fault_tolerant
+    worker['rows'] = with_rows
+    worker['aggregates'] = with_aggregates
+    worker['matches'] = with_matches
+    worker['impact'] = fee_impact
+    worker['shadow_rate'] = shadow_rate
+
+
+def process_chunk(args):
+    """
+    Process one chunk of payment sessions in a worker process
+    Returns     csv output of the chunk (empty without the rows), stats, metrics (None if not measured),
+                csv of the rejected sessions and their earliest date_performed (None if not fault-tolerant),
+                aggregates (None if not aggregated), csv of the matched fee rules (None if not written),
+                discrepancy rows and counts of the shadow verification (None if not verified)
+    """
+    path, header, start, end = args
+
+    stats = payment.get_stats()
+    chunk_metrics = metrics.Metrics() if worker['metrics'] else None
+    chunk_aggregates = aggregate.Aggregates() if worker['aggregates'] else None
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=payment.OUTPUT_FIELDS)
+    if chunk_aggregates is not None:
+        writer = aggregate.RowWriter(writer, chunk_aggregates) if worker['rows'] else chunk_aggregates
+    matches = io.StringIO() if worker['matches'] else None
+    if matches is not None:
+        writer = impact.MatchWriter(writer, csv.DictWriter(matches, fieldnames=impact.MATCH_FIELDS),
+                                    payment.OUTPUT_FIELDS)
+    if chunk_metrics is not None:
+        writer = metrics.TimedWriter(writer, chunk_metrics)
+
+    # the error rate is checked by the main process
+    rejects = errors.Rejects(io.StringIO()) if worker['fault_tolerant'] else None
+
+    # fee change impact - the payments after since and the affected older ones
+    payments = read_chunk(path, header, start, end)
+    since = worker['since']
+    if worker['impact'] is not None:
+        payments = worker['impact'].select(payments, since, stats)
+        since = None
+
+    if chunk_aggregates is not None:
+        fields = aggregate.INPUT_FIELDS
+    elif matches is not None:
+        fields = payment.OUTPUT_FIELDS + ['fee_rule']
+    else:
+        fields = payment.OUTPUT_FIELDS
+
+    chunk_shadow = None
+    if worker['shadow_rate'] is not None:
+        chunk_shadow = shadow.Shadow(worker['shadow_rate'], worker['fees'], worker['rates'], worker['exceptions'],
+                                     shadow.Report())
+
+    for p_final in api.calculate_costs(payments, worker['fees'], worker['rates'], worker['exceptions'],
+                                       worker['date_from'], since, worker['engine'], stats, chunk_metrics, rejects,
+                                       fields, chunk_shadow):
+        writer.writerow(p_final)
+
+    matched = None if matches is None else matches.getvalue()
+    shadowed = None if chunk_shadow is None else (list(chunk_shadow.report), chunk_shadow.counts)
+    if rejects is None:
+        return out.getvalue(), stats, chunk_metrics, None, None, chunk_aggregates, matched, shadowed
+
+    return (out.getvalue(), stats, chunk_metrics, rejects.out.getvalue(), rejects.date_min, chunk_aggregates, matched,
+            shadowed)
+
+
+def process_parallel(path, out, workers, fee_path, gopay_rates_path, eur_rates_path, date_from, exceptions, stats,
+                     since=None, engine='decimal', run_metrics=None, rejects=None, offset=None, on_chunk=None,
+                     cache_dir=None, run_scope=None, aggregates=None, matches=None, fee_impact=None, run_shadow=None):
+    """
+    Process payment sessions from the path (from the offset, if set) in a pool of worker processes.
+    The output of the chunks is written to out in the input order, at most CHUNKS_AHEAD chunks per worker
+    are submitted ahead of the written one. Counters are added to stats,
+    stage timers of the workers to run_metrics, if set, failing sessions to rejects, if set.
+    on_chunk(end) is called after the output of every chunk is written, if set.
+    Fees and rates are loaded from the cache_dir, if set, only those of the run_scope (lib/scope.py), if set.
+    Payment costs are summed to aggregates (lib/aggregate.py), if set, out None writes no rows.
+    Matched fee rules are written to matches, if set, only payments affected by fee_impact (lib/impact.py)
+    and those after since are processed, if set. A sample of the payments is verified by the reference path
+    and added to run_shadow (lib/shadow.py), if set.
+    """
+    # sliced or compressed input - a chunk is a whole file
+    if not tables.is_plain(path):
+        header = tables.get_columns(path)
+        chunks = [(s, None, None) for s in tables.get_slices(path)]
+
+    else:
+        size = os.path.getsize(path)
+        chunk_size = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, size // (workers * 4) + 1))
+        if on_chunk is not None:
+            chunk_size = min(chunk_size, checkpoint.CHUNK_SIZE)
+        header, byte_ranges = get_chunks(path, chunk_size, offset)
+        chunks = [(path, start, end) for start, end in byte_ranges]
+
+    logging.info('Processing {} chunks of payment sessions in {} workers' . format(len(chunks), workers))
+
+    def write_chunk(future, end):
+        """
+        Write the output of the chunk ending at end, when it is done
+        """
+        data, chunk_stats, chunk_metrics, rejected, rejected_date_min, chunk_aggregates, matched, shadowed = \
+            future.result()
+        if out is not None:
+            out.write(data)
+        if matches is not None:
+            matches.write(matched)
+        if aggregates is not None:
+            aggregates.merge(chunk_aggregates)
+        if run_shadow is not None:
+            run_shadow.merge(*shadowed)
+        payment.merge_stats(stats, chunk_stats)
+        if run_metrics is not None:
+            run_metrics.merge(chunk_metrics)
+        if rejects is not None:
+            rejects.merge(rejected, rejected_date_min, stats)
+        if on_chunk is not None:
+            on_chunk(end)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(fee_path, gopay_rates_path, eur_rates_path, date_from, exceptions, since,
+                                       engine, run_metrics is not None, rejects is not None, cache_dir,
+                                       run_scope, out is not None, aggregates is not None, matches is not None,
+                                       fee_impact, None if run_shadow is None else run_shadow.rate)) as pool:
+
+        try:
+            pending = collections.deque()
+            for chunk_path, start, end in chunks:
+                pending.append((pool.submit(process_chunk, (chunk_path, header, start, end)), end))
+                if len(pending) >= workers * CHUNKS_AHEAD:
+                    write_chunk(*pending.popleft())
+            while pending:
+                write_chunk(*pending.popleft())
+
+        # fail fast - the remaining chunks are not processed
+        except Exception as e:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise e
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""
+Input and output tables - plain csv files, gzip-compressed csv files and sliced tables.
+Parquet and Arrow input files are read by lib/columnar.py.
+
+A sliced table is a directory of csv slices (optionally gzip-compressed) without a header, the columns are listed
+in the manifest of the table. All tables are read and written as streams, so the memory does not depend on the size
+of the table.
+"""
+
+import csv
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+
+from lib import columnar
+
+# rows in a batch passed to a slice writer
+BATCH_SIZE = 1000
+
+# max batches waiting for a slice writer
+QUEUE_SIZE = 8
+
+
+def open_text(path, mode='rt'):
+    """
+    Open a csv file, gzip-compressed if the name ends with .gz
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode=mode, encoding='utf-8')
+
+    return open(path, mode=mode, encoding='utf-8')
+
+
+def get_input_path(path):
+    """
+    Path of the input table - the csv file, the gzip-compressed file (path + '.gz') or the directory of slices
+    """
+    for p in (path, path + '.gz'):
+        if os.path.exists(p):
+            return p
+
+    logging.error('Missing input table: {}' . format(path))
+    raise Exception('Error: missing input table: ' + path)
+
+
+def is_plain(path):
+    """
+    The table is an uncompressed csv file - it can be split by byte offsets
+    """
+    return os.path.isfile(path) and not path.endswith('.gz') and not columnar.is_columnar(path)
+
+
+def get_slices(path):
+    """
+    Files of the table - the slices of a sliced table in the name order, or the file itself
+    """
+    if not os.path.isdir(path):
+        return [path]
+
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if not name.startswith('.') and not name.endswith('.manifest'))
+
+
+def get_columns(path):
+    """
+    Columns of a sliced table from its manifest, None for a file with a header
+    """
+    if not os.path.isdir(path):
+        return None
+
+    try:
+        with open(path + '.manifest', mode='rt', encoding='utf-8') as f:
+            return json.load(f)['columns']
+
+    except Exception as e:
+        logging.error('Cannot read columns of the sliced table {} from its manifest.' . format(path))
+        raise e
+
+
+def read_slice(path, columns=None, select=None, text=False):
+    """
+    Rows of a slice (or a file) as dicts - columns of a slice without a header, None if it has one.
+    Parquet and Arrow files - only the select columns, if set, decimal values as text if text is set.
+    """
+    if columnar.is_columnar(path):
+        yield from columnar.read_table(path, select, text)
+        return
+
+    with open_text(path) as f:
+        yield from csv.DictReader(f, fieldnames=columns)
+
+
+def read_table(path, select=None, text=False):
+    """
+    Rows of the table as dicts, see read_slice
+    """
+    columns = get_columns(path)
+    for s in get_slices(path):
+        yield from read_slice(s, columns, select, text)
+
+
+class SlicedWriter():
+    """
+    Sliced output table - batches of rows are distributed over the slices, every slice is written
+    (and compressed) in its own thread. Slices have no header, the columns belong to the manifest.
+    """
+
+    def __init__(self, path, fieldnames, slices, compress=False):
+        """
+        path        directory of the slices
+        fieldnames  columns of the table
+        slices      number of slices
+        compress    gzip-compress the slices
+        """
+        self.fieldnames = fieldnames
+        self.batch = []
+        self.next_slice = 0
+        self.errors = []
+
+        # an output of a previous run
+        if os.path.isfile(path):
+            os.remove(path)
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+
+        suffix = '.csv.gz' if compress else '.csv'
+        self.queues = [queue.Queue(QUEUE_SIZE) for _ in range(slices)]
+        self.threads = [threading.Thread(target=self.write_slice,
+                                         args=(os.path.join(path, 'part{:04d}{}'.format(i, suffix)), q),
+                                         name='slice-writer-{}'.format(i), daemon=True)
+                        for i, q in enumerate(self.queues)]
+
+        for t in self.threads:
+            t.start()
+
+    def write_slice(self, path, q):
+        """
+        Slice writer thread - a batch is a list of rows or a csv text
+        """
+        done = False
+        try:
+            with open_text(path, mode='wt') as f:
+                writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+                while True:
+                    batch = q.get()
+                    if batch is None:
+                        done = True
+                        break
+
+                    if isinstance(batch, str):
+                        f.write(batch)
+                    else:
+                        writer.writerows(batch)
+
+        except BaseException as e:
+            self.errors.append(e)
+
+            # unblock the main thread
+            while not done and q.get() is not None:
+                pass
+
+    def send(self, batch):
+        """
+        Send the batch to the next slice
+        """
+        if self.errors:
+            raise self.errors[0]
+
+        self.queues[self.next_slice].put(batch)
+        self.next_slice = (self.next_slice + 1) % len(self.queues)
+
+    def writerow(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= BATCH_SIZE:
+            self.send(self.batch)
+            self.batch = []
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def write(self, data):
+        """
+        Write a csv text (without a header) - i.e. an output of a chunk in the parallel run
+        """
+        if data:
+            self.send(data)
+
+    def close(self):
+        """
+        Write the rest of the rows and wait for the slice writers
+        """
+        try:
+            if self.batch:
+                self.send(self.batch)
+                self.batch = []
+
+        finally:
+            for q in self.queues:
+                q.put(None)
+            for t in self.threads:
+                t.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # an error of the run is not hidden by an error of the writers
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except Exception:
+                pass
@@ -0,0 +1,49 @@
+"""
+Cost calculation service - answers cost queries of payment sessions over a local HTTP or Unix socket endpoint
+with the fees and rates of the data folder kept in memory (lib/service.py).
+
+    python service.py --port 8080
+    python service.py --socket /tmp/payment-costs.sock
+"""
+import argparse
+import logging
+import os
+import sys
+
+from lib import config, service
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Payment cost calculation service')
+    parser.add_argument('--data', default='../data', help='data folder with config.json and in/tables')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--socket', default=None, help='Unix socket path in place of the TCP port')
+    parser.add_argument('--reload-interval', type=float, default=service.RELOAD_INTERVAL,
+                        help='seconds between the checks of the fee and rate files')
+    args = parser.parse_args()
+
+    # logging setup
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, datefmt='%Y-%m-%d %H:%M:%S%z',
+                        format='%(asctime)s | %(module)s | %(levelname)s | %(message)s')
+
+    # config parameters - the exceptions without date_to apply to the payments of the following days too
+    cfg = config.Config(args.data).set_parameters()
+    tables_dir = os.path.join(args.data, 'in', 'tables')
+
+    cost_service = service.CostService(os.path.join(tables_dir, 'payment_fees.csv'),
+                                       os.path.join(tables_dir, 'gopay_rates.csv'),
+                                       os.path.join(tables_dir, 'eur_rates.csv'),
+                                       cfg.get_cost_exceptions(unbounded=True), cfg.get_cache_dir())
+
+    service.serve(cost_service, args.host, args.port, args.socket, args.reload_interval)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as exc:
+        logging.exception(exc)
+        exit(2)
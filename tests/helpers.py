@@ -0,0 +1,57 @@
+"""
+Fixtures shared by the tests - the fee and rate tables and payment sessions
+"""
+import datetime
+import os
+
+FEES = """payment_channel,currency,valid_from,valid_to,MID,MIN_amount,card_type,card_is_business,card_service_type,area_of_event,cost_algorithm,transaction_fee,transaction_fee_currency,fee
+GOPAY,,2019-01-01,,,,,,,,STD,,,"1,5 %"
+GOPAY,CZK,2019-01-01,2019-03-31,M1,,,,,,STD,,,"1 %"
+CARD,,2019-01-01,,,,VISA,,,,IFPP,,,"1 %"
+"""
+GOPAY_RATES = """relevant_date,target_currency,target_currency_amount,price
+2019-01-01,EUR,1,25.5
+"""
+EUR_RATES = """date,toCurrency,rate
+2019-01-01,USD,1.1
+"""
+
+# columns of a card payment of the CARD fee
+CARD = {'payment_channel': 'CARD', 'card_type': 'VISA'}
+
+
+def write_inputs(directory, fees=FEES, gopay_rates=GOPAY_RATES, eur_rates=EUR_RATES):
+    """
+    Write the fee and rate tables to the directory
+    Returns     paths of payment_fees.csv, gopay_rates.csv and eur_rates.csv
+    """
+    paths = []
+    for name, text in (('payment_fees', fees), ('gopay_rates', gopay_rates), ('eur_rates', eur_rates)):
+        paths.append(os.path.join(directory, name + '.csv'))
+        with open(paths[-1], mode='w', encoding='utf-8') as f:
+            f.write(text)
+
+    return paths
+
+
+def make_session(payment_session_id='1', **kwargs):
+    """
+    Payment session with the text columns of the payment sessions table - a paid GOPAY payment of 1000 CZK
+    on 2019-07-01, the columns of kwargs are replaced
+    """
+    ps = {'payment_session_id': payment_session_id, 'date_performed': '2019-07-01 10:00:00.000',
+          'session_state': 'PAID', 'payment_channel': 'GOPAY', 'currency': 'CZK', 'mid': '', 'amount': '1000',
+          'amount_refunded': '', 'card_type': '', 'card_is_business': 'FALSE', 'card_service_type': '',
+          'card_aoe': '', 'partnership_id': '1', 'interchange_fee': '', 'association_fee': ''}
+    ps.update(kwargs)
+    return ps
+
+
+def make_sessions(count):
+    """
+    Payment sessions of the merchants M1 and M2 from January to June 2019, every seventh is canceled
+    """
+    return [make_session(str(i), date_performed='{} 10:00:00.000' . format(datetime.date(2019, 1 + i % 6, 1 + i % 28)),
+                         session_state='CANCELED' if i % 7 == 0 else 'PAID', mid='M1' if i % 2 else 'M2',
+                         amount=str(100 + i))
+            for i in range(count)]
@@ -0,0 +1,66 @@
+import unittest
+import csv
+import datetime
+import os
+import tempfile
+from decimal import Decimal
+
+from lib import aggregate, payment
+
+
+def make_row(partnership_id, value, day=1):
+    row = {k: value for k in aggregate.SUM_FIELDS}
+    row.update({'payment_session_id': partnership_id + str(day), 'cost_algorithm': 'STD', 'payment_channel': 'GOPAY',
+                'currency': 'CZK', 'partnership_id': partnership_id,
+                'date_performed': datetime.datetime(2019, 1, day, 10, 30)})
+    return row
+
+
+class TestAggregates(unittest.TestCase):
+
+    def test_sums(self):
+        a = aggregate.Aggregates()
+        a.writerows([make_row('1', Decimal('0.10000')), make_row('1', '0.20000'), make_row('2', '1.00001', day=2)])
+
+        rows = list(a.get_rows())
+        self.assertEqual(len(rows), 2)
+        self.assertEqual((rows[0]['date'], rows[0]['partnership_id'], rows[0]['count']), ('2019-01-01', '1', 2))
+        self.assertEqual(rows[0]['total_fee_czk'], Decimal('0.30000'))
+        self.assertEqual(rows[1]['amount'], Decimal('1.00001'))
+
+    def test_merge_exact(self):
+        a = aggregate.Aggregates()
+        b = aggregate.Aggregates()
+        big = '9' * 25 + '.99999'
+        a.writerow(make_row('1', big))
+        b.writerow(make_row('1', '0.00001'))
+        b.writerow(make_row('3', '1'))
+
+        a.merge(b)
+        rows = list(a.get_rows())
+        self.assertEqual(rows[0]['count'], 2)
+        self.assertEqual(str(rows[0]['amount']), '1' + '0' * 25 + '.00000')
+        self.assertEqual(len(rows), 2)
+
+    def test_both_outputs(self):
+        a = aggregate.Aggregates()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.csv')
+            with open(path, mode='w', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=payment.OUTPUT_FIELDS)
+                aggregate.RowWriter(writer, a).writerows([make_row('1', '2.50000'), make_row('1', '0.50000')])
+
+            with open(path, mode='r', encoding='utf-8') as f:
+                self.assertEqual([r['total_fee'] for r in csv.DictReader(f, fieldnames=payment.OUTPUT_FIELDS)],
+                                 ['2.50000', '0.50000'])
+
+            a.write(path)
+            with open(path, mode='r', encoding='utf-8') as f:
+                rows = list(csv.DictReader(f))
+
+        self.assertEqual(list(rows[0]), aggregate.AGGREGATE_FIELDS)
+        self.assertEqual((rows[0]['count'], rows[0]['total_fee']), ('2', '3.00000'))
+
+
+if __name__ == '__main__':
+    unittest.main()
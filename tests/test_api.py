@@ -0,0 +1,48 @@
+import unittest
+import datetime
+import shutil
+import tempfile
+from decimal import Decimal
+
+from lib import api, payment
+from tests.helpers import make_session, write_inputs
+
+
+class TestApi(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        paths = write_inputs(self.tmp)
+        self.fees = api.load_fees(paths[0])
+        self.rates = api.load_rates(paths[1], paths[2])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_lazy(self):
+        def sessions():
+            yield make_session()
+            raise AssertionError('read ahead')
+
+        costs = api.calculate_costs(sessions(), self.fees, self.rates, {})
+        cost = next(costs)
+        self.assertEqual(list(cost), payment.OUTPUT_FIELDS)
+        self.assertEqual(cost['total_fee'], Decimal('15'))
+
+    def test_batch(self):
+        sessions = [make_session(), make_session(payment_session_id='2', session_state='CANCELED'),
+                    make_session(payment_session_id='3', date_performed='2019-01-01 00:00:00', amount=Decimal('2000'))]
+        stats = payment.get_stats()
+
+        costs = api.calculate_costs_batch(sessions, self.fees, self.rates, {}, date_from=datetime.date(2019, 2, 1),
+                                          engine='batch', stats=stats)
+        self.assertEqual([c['payment_session_id'] for c in costs], ['1'])
+        self.assertEqual(str(costs[0]['total_fee']), '15.00000')
+        self.assertEqual((stats['processed'], stats['ignored']), (1, 1))
+
+        costs = api.calculate_costs_batch(sessions, self.fees, self.rates, {}, engine='batch')
+        self.assertEqual([str(c['total_fee']) for c in costs], ['15.00000', '30.00000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import csv
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from lib import api, backfill, payment
+from tests.helpers import make_session, write_inputs
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp, 'data')
+        self.plan_dir = os.path.join(self.tmp, 'plan')
+        tables_dir = os.path.join(self.data_dir, 'in', 'tables')
+        os.makedirs(tables_dir)
+
+        with open(os.path.join(self.data_dir, 'config.json'), mode='w', encoding='utf-8') as f:
+            json.dump({'parameters': {'date_performed_from': '2019-01-15', 'partnership_cost_exceptions': {}}}, f)
+
+        write_inputs(tables_dir)
+
+        # sessions from before the processed period to April, a refund in a later month than its payment
+        self.sessions = []
+        day = datetime.date(2019, 1, 1)
+        for i in range(60):
+            self.sessions.append(make_session(
+                str(i), date_performed='{} 10:00:00.000' . format(day + datetime.timedelta(days=2 * i)),
+                session_state='CANCELED' if i % 7 == 0 else 'PAID', mid='M1' if i % 2 else 'M2', amount=str(100 * (i + 1))))
+        self.sessions.append(dict(self.sessions[3], date_performed='2019-04-02 10:00:00.000', session_state='REFUNDED'))
+
+        with open(os.path.join(tables_dir, 'payments-sessions-stage.csv'), mode='w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=payment.INPUT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.sessions)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def get_reference(self):
+        stats = payment.get_stats()
+        fees = api.load_fees(os.path.join(self.data_dir, 'in', 'tables', 'payment_fees.csv'))
+        rates = api.load_rates(os.path.join(self.data_dir, 'in', 'tables', 'gopay_rates.csv'),
+                               os.path.join(self.data_dir, 'in', 'tables', 'eur_rates.csv'))
+        out = io.StringIO(newline='')
+        writer = csv.DictWriter(out, fieldnames=payment.OUTPUT_FIELDS)
+        writer.writeheader()
+        writer.writerows(api.calculate_costs(self.sessions, fees, rates, {}, datetime.date(2019, 1, 15), stats=stats))
+
+        rows = list(csv.reader(io.StringIO(out.getvalue(), newline='')))
+        return rows[0:1] + sorted(rows[1:]), stats
+
+    def read_costs(self, path):
+        with open(path, mode='r', encoding='utf-8', newline='') as f:
+            rows = list(csv.reader(f))
+        return rows[0:1] + sorted(rows[1:])
+
+    def test_windows(self):
+        self.assertEqual(backfill.get_windows(datetime.date(2019, 1, 15), datetime.date(2019, 3, 1)), [
+            (datetime.date(2019, 1, 15), datetime.date(2019, 1, 31)), (datetime.date(2019, 2, 1), datetime.date(2019, 2, 28)),
+            (datetime.date(2019, 3, 1), datetime.date(2019, 3, 31))])
+        self.assertEqual(backfill.get_windows(datetime.date(2019, 1, 1), datetime.date(2019, 1, 20), 10), [
+            (datetime.date(2019, 1, 1), datetime.date(2019, 1, 10)), (datetime.date(2019, 1, 11), datetime.date(2019, 1, 20))])
+
+    def test_backfill(self):
+        reference, reference_stats = self.get_reference()
+
+        for window in ('month', 10):
+            plan_dir = os.path.join(self.plan_dir, str(window))
+            partitions = backfill.plan(self.data_dir, plan_dir, window)['partitions']
+            self.assertEqual(len(partitions), 4 if window == 'month' else 11)
+
+            backfill.run_local(plan_dir, 2)
+            costs_path = os.path.join(self.tmp, 'payment_costs.csv')
+            stats = backfill.merge(plan_dir, costs_path)
+
+            self.assertEqual(self.read_costs(costs_path), reference)
+            self.assertEqual(stats, reference_stats)
+
+    def test_merge_unfinished(self):
+        partitions = backfill.plan(self.data_dir, self.plan_dir)['partitions']
+        for name in partitions[1:]:
+            backfill.run_job(os.path.join(self.plan_dir, name, backfill.JOB_FILE))
+
+        with self.assertRaises(Exception):
+            backfill.merge(self.plan_dir, os.path.join(self.tmp, 'payment_costs.csv'))
+
+        # a job rerun from a changed spec
+        backfill.run_job(os.path.join(self.plan_dir, partitions[0], backfill.JOB_FILE))
+        with open(os.path.join(self.plan_dir, partitions[1], backfill.JOB_FILE), mode='a', encoding='utf-8') as f:
+            f.write('\n')
+        with self.assertRaises(Exception):
+            backfill.merge(self.plan_dir, os.path.join(self.tmp, 'payment_costs.csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
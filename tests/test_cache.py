@@ -0,0 +1,75 @@
+import unittest
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from lib import cache, fee, rate, scope
+from tests.helpers import write_inputs
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        self.paths = dict(zip(('fees', 'gopay', 'eur'), write_inputs(self.tmp)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_fees_cached(self):
+        built = cache.get_fees(self.paths['fees'], self.cache_dir)
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, 'fees.pickle')))
+
+        cached = cache.get_fees(self.paths['fees'], self.cache_dir)
+        self.assertEqual(list(cached), list(built))
+        self.assertEqual(cached.fees[0].card_types, None)
+
+    def test_rates_rebuilt_on_change(self):
+        rates = cache.get_rates(self.paths['gopay'], self.paths['eur'], self.cache_dir)
+        self.assertEqual(rates.get_rate('EUR', 'CZK', '2019-01-02'), 25.5)
+
+        with open(self.paths['gopay'], mode='a', encoding='utf-8') as f:
+            f.write('2019-01-02,EUR,1,26\n')
+
+        rates = cache.get_rates(self.paths['gopay'], self.paths['eur'], self.cache_dir)
+        self.assertEqual(rates.get_rate('EUR', 'CZK', '2019-01-02'), 26)
+        self.assertEqual(cache.get_rates(self.paths['gopay'], self.paths['eur'], self.cache_dir).tables, rates.tables)
+
+    def test_scopes_cached(self):
+        scopes = [None, scope.Scope(['EUR'], datetime.date(2019, 1, 1), datetime.date(2019, 1, 31)),
+                  scope.Scope(['USD'], datetime.date(2019, 2, 1), datetime.date(2019, 2, 28))]
+
+        with mock.patch.object(fee.Fees, 'get_index', autospec=True, side_effect=fee.Fees.get_index) as fees_built, \
+                mock.patch.object(rate.Rates, 'set_rates', autospec=True, side_effect=rate.Rates.set_rates) as rates_built:
+            for _ in range(3):
+                for s in scopes:
+                    cache.get_fees(self.paths['fees'], self.cache_dir, s)
+                    cache.get_rates(self.paths['gopay'], self.paths['eur'], self.cache_dir, s)
+
+        # the alternating scopes do not replace each other's cache
+        self.assertEqual((fees_built.call_count, rates_built.call_count), (3, 3))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 6)
+
+    def test_evict(self):
+        with mock.patch.object(cache, 'MAX_ENTRIES', 2):
+            for month in range(1, 5):
+                s = scope.Scope([], datetime.date(2019, month, 1), datetime.date(2019, month, 28))
+                cache.get_fees(self.paths['fees'], self.cache_dir, s)
+
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         sorted(os.path.basename(cache.Cache(self.cache_dir).get_path('fees', scope.Scope(
+                             [], datetime.date(2019, month, 1), datetime.date(2019, month, 28)))) for month in (3, 4)))
+
+    def test_broken_cache(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, 'fees.pickle'), mode='wb') as f:
+            f.write(b'broken')
+
+        self.assertEqual(len(cache.get_fees(self.paths['fees'], self.cache_dir)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import os
+import tempfile
+
+from lib import checkpoint, payment
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'checkpoint.json')
+        self.out_path = os.path.join(self.tmp.name, 'out.csv')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_save_and_load(self):
+        stats = payment.get_stats()
+        stats['processed'] = 2
+
+        with checkpoint.open_output(self.out_path) as out:
+            out.write('header\nrow1\nrow2\n')
+            checkpoint.Checkpoint(self.path, 'abc').save(100, out, None, stats)
+            out.write('row3 - not checkpointed\n')
+
+        self.assertIsNone(checkpoint.Checkpoint(self.path, 'other').load())
+
+        data = checkpoint.Checkpoint(self.path, 'abc').load()
+        self.assertEqual((data['offset'], data['rows'], data['stats']), (100, 2, stats))
+
+        # the partial output is truncated to the checkpoint
+        with checkpoint.open_output(self.out_path, data['out_size']) as out:
+            out.write('row3\n')
+        with open(self.out_path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'header\nrow1\nrow2\nrow3\n')
+
+        checkpoint.Checkpoint(self.path, 'abc').remove()
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import datetime
+import os
+import tempfile
+from decimal import Decimal
+
+from lib import api, columnar, payment, tables
+from tests.helpers import CARD, make_session, write_inputs
+
+
+@unittest.skipIf(columnar.pa is None, 'pyarrow is not installed')
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_values(self):
+        pa = columnar.pa
+        path = os.path.join(self.tmp.name, 'sessions.parquet')
+        table = pa.table({'payment_session_id': ['1', '2'],
+                          'date_performed': pa.array([1547703934000, None], type=pa.timestamp('ms')),
+                          'amount': pa.array([Decimal('1672.79'), None], type=pa.decimal128(38, 5)),
+                          'card_is_business': [True, False],
+                          'extra': ['x', 'y']})
+        columnar.pq.write_table(table, path)
+
+        rows = list(tables.read_table(path, ['payment_session_id', 'date_performed', 'amount', 'card_is_business']))
+        self.assertEqual(rows[0], {'payment_session_id': '1', 'date_performed': '2019-01-17 05:45:34.000',
+                                   'amount': Decimal('1672.79000'), 'card_is_business': 'TRUE'})
+        self.assertEqual(rows[1]['date_performed'], '')
+        self.assertEqual(rows[1]['amount'], '')
+        self.assertEqual(payment.parse_number(rows[0]['amount']), Decimal('1672.79'))
+
+        rows = list(tables.read_table(path, ['amount'], text=True))
+        self.assertEqual(rows[0], {'amount': '1672.79000'})
+
+    def test_write_roundtrip(self):
+        path = os.path.join(self.tmp.name, 'costs.parquet')
+        with columnar.ParquetWriter(path, ['id', 'fee'], ('id',)) as writer:
+            writer.writerow({'id': 'a', 'fee': Decimal('1.23457')})
+            writer.writerow({'id': 'b', 'fee': None})
+            writer.write('c,0.50000\r\n')
+
+        rows = list(tables.read_table(path, text=True))
+        self.assertEqual(rows, [{'id': 'a', 'fee': '1.23457'}, {'id': 'b', 'fee': ''}, {'id': 'c', 'fee': '0.50000'}])
+        self.assertEqual(columnar.pq.read_schema(path).field('fee').type, columnar.pa.decimal128(38, 5))
+
+    def test_write_scheme_fees(self):
+        # scheme fees times a cost multiplier have 10 decimal places
+        paths = write_inputs(self.tmp.name)
+        session = make_session(date_performed='2019-06-01 10:00:00.000', mid='M1', interchange_fee='2.34567',
+                               association_fee='1.11111', **CARD)
+        exceptions = {'1': [{'date_from': datetime.date(2019, 1, 1), 'date_to': datetime.date(2019, 12, 31),
+                             'gopay_percent': 0.333}]}
+        costs = api.calculate_costs_batch([session], api.load_fees(paths[0]), api.load_rates(paths[1], paths[2]),
+                                          exceptions)
+        self.assertEqual(costs[0]['interchange_fee'], Decimal('0.7811081100'))
+
+        path = os.path.join(self.tmp.name, 'costs.parquet')
+        with columnar.ParquetWriter(path, payment.OUTPUT_FIELDS, ('payment_session_id', 'cost_algorithm')) as writer:
+            writer.writerows(costs)
+            # the parallel run writes the csv text
+            values = {'payment_session_id': '2', 'cost_algorithm': 'IFPP', 'interchange_fee': '0.3333333333',
+                      'association_fee': '0.3333333333'}
+            writer.write(','.join(values.get(k, '0.33333') for k in payment.OUTPUT_FIELDS) + '\r\n')
+
+        rows = list(tables.read_table(path))
+        for k in payment.OUTPUT_FIELDS:
+            if k not in ('payment_session_id', 'cost_algorithm'):
+                self.assertEqual(rows[0][k], costs[0][k])
+        self.assertEqual((rows[1]['interchange_fee'], rows[1]['association_fee']), (Decimal('0.3333333333'),) * 2)
+
+    def test_input_path(self):
+        path = os.path.join(self.tmp.name, 'rates.csv')
+        with open(os.path.join(self.tmp.name, 'rates.feather'), mode='wb'):
+            pass
+
+        self.assertEqual(columnar.get_input_path(path), os.path.join(self.tmp.name, 'rates.feather'))
+        self.assertFalse(tables.is_plain(os.path.join(self.tmp.name, 'rates.feather')))
+        with self.assertRaises(Exception):
+            columnar.get_input_path(os.path.join(self.tmp.name, 'missing.csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,10 +5,16 @@ Created on 12. 11. 2018
 '''
 import unittest
 import mock
+import csv
+import json
 import os
+import shutil
+import tempfile
 from freezegun import freeze_time
 
 from component import Component
+from lib import payment
+from tests.helpers import FEES, make_sessions, write_inputs
 
 
 class TestComponent(unittest.TestCase):
@@ -23,6 +29,129 @@ class TestComponent(unittest.TestCase):
             comp.run()
 
 
+class TestComponentRun(unittest.TestCase):
+    """
+    Runs of the component on a data directory
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp, 'data')
+        for name in ('in/tables', 'out/tables', 'out/files'):
+            os.makedirs(os.path.join(self.data, name))
+        self.write_inputs(FEES, make_sessions(50))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_inputs(self, fees, sessions):
+        write_inputs(os.path.join(self.data, 'in', 'tables'), fees)
+
+        with open(os.path.join(self.data, 'in', 'tables', 'payments-sessions-stage.csv'), mode='w', encoding='utf-8',
+                  newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=payment.INPUT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(sessions)
+
+    def run_component(self, **parameters):
+        """
+        Run the component with the parameters, the state and the fee rules of the last run are the inputs
+        """
+        for name in ('state.json', 'tables/payment_costs_fee_rules.csv'):
+            if os.path.exists(os.path.join(self.data, 'out', name)):
+                shutil.move(os.path.join(self.data, 'out', name), os.path.join(self.data, 'in', name))
+
+        with open(os.path.join(self.data, 'config.json'), mode='w', encoding='utf-8') as f:
+            json.dump({'parameters': dict({'date_performed_from': '2019-01-01', 'partnership_cost_exceptions': {}},
+                                          **parameters)}, f)
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': self.data}):
+            Component().run()
+
+    def read_output(self, name='payment_costs.csv'):
+        with open(os.path.join(self.data, 'out', 'tables', name), mode='r', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+
+    def read_json(self, name):
+        with open(os.path.join(self.data, 'out', name), mode='r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_incremental_rejects(self):
+        sessions = make_sessions(50)
+        sessions[9]['amount'] = 'x'  # 2019-04-10
+        self.write_inputs(FEES, sessions)
+        self.run_component(incremental=True, fault_tolerant=True, max_error_rate=0.1)
+
+        self.assertEqual([row['payment_session_id'] for row in self.read_output('payment_costs_rejected.csv')], ['9'])
+        self.assertEqual(len(self.read_output()), 41)
+
+        # the rejected payment is processed again in the next run
+        state = self.read_json('state.json')
+        self.assertEqual(state['date_performed_max'], '2019-04-10 09:59:59')
+        manifest = self.read_json('tables/payment_costs.csv.manifest')
+        self.assertEqual((manifest['incremental'], manifest['primary_key']), (True, ['payment_session_id']))
+
+        sessions[9]['amount'] = '109'
+        self.write_inputs(FEES, sessions)
+        self.run_component(incremental=True, fault_tolerant=True, max_error_rate=0.1)
+
+        self.assertEqual(self.read_output('payment_costs_rejected.csv'), [])
+        self.assertEqual(sorted(int(row['payment_session_id']) for row in self.read_output()),
+                         [i for i in range(50) if i % 7 and (i % 6, i % 28) >= (3, 9)])
+        self.assertEqual(self.read_json('state.json')['date_performed_max'], '2019-06-24 10:00:00')
+
+    def test_fee_impact(self):
+        self.run_component(incremental=True, fee_impact=True)
+        self.assertEqual(len(self.read_output()), 42)
+        self.assertEqual(len(self.read_output('payment_costs_fee_rules.csv')), 42)
+
+        # a changed fee - only the payments of the changed rule are computed again
+        self.write_inputs(FEES.replace('"1 %"', '"2 %"'), make_sessions(50))
+        self.run_component(incremental=True, fee_impact=True)
+
+        costs = self.read_output()
+        self.assertEqual(sorted(int(row['payment_session_id']) for row in costs),
+                         [i for i in range(50) if i % 7 and i % 2 and i % 6 < 3])
+        self.assertEqual({row['provider_percent_fee'] for row in costs if row['payment_session_id'] == '1'},
+                         {'2.02000'})
+        manifest = self.read_json('tables/payment_costs_fee_rules.csv.manifest')
+        self.assertEqual((manifest['incremental'], manifest['primary_key']), (True, ['payment_session_id']))
+
+    def test_diff(self):
+        store = os.path.join(self.tmp, 'diff.store')
+        self.run_component(diff_store=store, diff_deletions=True)
+        self.assertEqual(len(self.read_output()), 42)
+
+        # one payment changed, one deleted
+        sessions = [ps for ps in make_sessions(50) if ps['payment_session_id'] != '2']
+        sessions[1]['amount'] = '1000'
+        self.write_inputs(FEES, sessions)
+        self.run_component(diff_store=store, diff_deletions=True)
+
+        self.assertEqual([row['payment_session_id'] for row in self.read_output()], ['1'])
+        self.assertEqual(self.read_output('payment_costs_deleted.csv'), [{'payment_session_id': '2'}])
+        manifest = self.read_json('tables/payment_costs.csv.manifest')
+        self.assertEqual((manifest['incremental'], manifest['primary_key']), (True, ['payment_session_id']))
+
+    def test_dedup_pipeline(self):
+        # every fifth payment has an older version before it
+        sessions = []
+        for i, ps in enumerate(make_sessions(50)):
+            if i % 5 == 0:
+                sessions.append(dict(ps, amount='1'))
+            sessions.append(ps)
+        self.write_inputs(FEES, sessions)
+        self.run_component(dedup=True, pipeline=True, metrics=True)
+
+        costs = self.read_output()
+        self.assertEqual(len(costs), 42)
+        self.assertEqual({row['amount'] for row in costs if row['payment_session_id'] == '5'}, {'105.00000'})
+        stats = {row['metric']: row['value'] for row in self.read_output('payment_costs_metrics.csv')
+                 if row['stage'] == 'total' and row['metric'] != 'seconds'}
+        self.assertEqual((stats['processed'], stats['ignored']), ('42', '10'))
+        self.assertFalse(os.path.exists(os.path.join(self.data, 'out', 'tables', 'payment_costs.csv.manifest')))
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import json
+import os
+
+from lib import config
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'component_config', 'configSchema.json')
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        with open(SCHEMA_PATH, mode='r', encoding='utf-8') as f:
+            self.schema = json.load(f)
+        self.cfg = config.Config(None).set_parameters({'date_performed_from': '', 'partnership_cost_exceptions': {}})
+
+    def test_schema_defaults(self):
+        # every parameter of the config is in the schema, with the default of the config
+        properties = self.schema['properties']
+        self.assertEqual(set(self.schema['required']), {'date_performed_from', 'partnership_cost_exceptions'})
+        for k, default in self.cfg.params.items():
+            if k not in self.schema['required']:
+                self.assertEqual(properties[k]['default'], default, k)
+
+    def test_schema_enums(self):
+        # the values of the schema are accepted by the config, the others are not
+        for k, getter in (('engine', self.cfg.get_engine), ('format', self.cfg.get_format),
+                          ('output_mode', self.cfg.get_output_mode)):
+            for value in self.schema['properties'][k]['enum']:
+                self.cfg.params[k] = value
+                self.assertEqual(getter(), value)
+
+            self.cfg.params[k] = 'other'
+            with self.assertRaises(Exception):
+                getter()
+
+
+if __name__ == '__main__':
+    unittest.main()
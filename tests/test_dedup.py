@@ -0,0 +1,56 @@
+import unittest
+import csv
+import os
+import shutil
+import tempfile
+
+from lib import dedup, payment, tables
+
+SESSIONS = [('1', 'PAID'), ('2', 'PAID'), ('3', 'PAID'), ('1', 'PARTIALLY_REFUNDED'), ('4', 'PAID'), ('2', 'REFUNDED'),
+            ('5', 'PAID'), ('1', 'REFUNDED'), ('6', 'PAID')]
+
+LATEST = [('3', 'PAID'), ('4', 'PAID'), ('2', 'REFUNDED'), ('5', 'PAID'), ('1', 'REFUNDED'), ('6', 'PAID')]
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'payments-sessions-stage.csv')
+        with open(self.path, mode='w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['payment_session_id', 'session_state', 'extra'])
+            writer.writerows((payment_session_id, state, 'x') for payment_session_id, state in SESSIONS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def get_latest(self, max_entries):
+        d = dedup.Dedup(self.path, max_entries, self.tmp).index()
+        stats = payment.get_stats()
+        latest = [(ps['payment_session_id'], ps['session_state']) for ps in d.select(tables.read_table(self.path), stats)]
+        d.remove()
+        return d, latest, stats
+
+    def test_in_memory(self):
+        d, latest, stats = self.get_latest(dedup.MAX_ENTRIES)
+        self.assertEqual(latest, LATEST)
+        self.assertEqual((d.count, stats['ignored'], d.runs), (3, 3, []))
+
+    def test_spilled(self):
+        for max_entries in (1, 2, 3):
+            d, latest, stats = self.get_latest(max_entries)
+            self.assertEqual(latest, LATEST)
+            self.assertEqual((d.count, stats['ignored']), (3, 3))
+            self.assertTrue(d.runs)
+            self.assertFalse(os.path.exists(d.directory))
+
+    def test_write(self):
+        d = dedup.Dedup(self.path, 2, self.tmp).index()
+        path = d.write(os.path.join(d.directory, 'payments-sessions-stage.csv'))
+        self.assertEqual([(ps['payment_session_id'], ps['session_state']) for ps in tables.read_table(path)], LATEST)
+        d.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+
+from lib import diff
+
+
+class TestDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'digests', 'payment_costs.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_diff(self, *chunks):
+        out = io.StringIO()
+        diff_out = diff.DiffOutput(out, self.path)
+        for chunk in chunks:
+            diff_out.write(chunk)
+        deleted = list(diff_out.get_deleted())
+        diff_out.commit()
+        return out.getvalue(), deleted, diff_out.counts
+
+    def test_changed_rows(self):
+        written, deleted, _ = self.run_diff('1,10.00000,STD\r\n2,5.00000,STD\r\n', '3,1.00000,IFPP\r\n')
+        self.assertEqual(written, '1,10.00000,STD\r\n2,5.00000,STD\r\n3,1.00000,IFPP\r\n')
+        self.assertEqual(deleted, [])
+
+        # a line split between the writes, a changed row, a new row and a missing row
+        written, deleted, counts = self.run_diff('1,10.000', '00,STD\r\n2,6.00000,STD\r\n"4",2.00000,STD\r\n')
+        self.assertEqual(written, '2,6.00000,STD\r\n"4",2.00000,STD\r\n')
+        self.assertEqual(deleted, ['3'])
+        self.assertEqual(counts, {'inserted': 1, 'changed': 1, 'unchanged': 1})
+
+    def test_failed_run(self):
+        self.run_diff('1,10.00000,STD\r\n')
+
+        # a run without commit keeps the digests of the last run
+        diff.DiffOutput(io.StringIO(), self.path).write('1,11.00000,STD\r\n')
+        written, _, _ = self.run_diff('1,10.00000,STD\r\n')
+        self.assertEqual(written, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import datetime
+from decimal import Decimal
+
+from lib import fee
+
+
+def make_fee(**kwargs):
+    f = {'payment_channel': 'GOPAY', 'currency': None, 'valid_from': datetime.date(2019, 1, 1), 'valid_to': None,
+         'MID': None, 'MIN_amount': None, 'card_type': None, 'card_is_business': None, 'card_service_type': None,
+         'area_of_event': None, 'cost_algorithm': 'STD', 'transaction_fee': None, 'transaction_fee_currency': None,
+         'fee': Decimal('1.2')}
+    f.update(kwargs)
+    return f
+
+
+class TestFeeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.fees = [
+            make_fee(valid_to=datetime.date(2019, 6, 30)),
+            make_fee(currency='EUR', valid_from=datetime.date(2019, 7, 1)),
+            make_fee(MID='M1'),
+            make_fee(payment_channel='PAYPAL'),
+            make_fee(valid_from=datetime.date(2019, 7, 1)),
+        ]
+        self.index = fee.FeeIndex(self.fees)
+
+    def linear(self, channel, currency, mid, date):
+        return [f for f in self.fees if f['payment_channel'] == channel
+                and (f['currency'] is None or f['currency'] == currency)
+                and date >= f['valid_from'] and (f['valid_to'] is None or date <= f['valid_to'])
+                and (f['MID'] is None or f['MID'] == mid)]
+
+    def test_find_matches_linear_scan(self):
+        for currency in ('EUR', 'CZK', None):
+            for mid in ('M1', 'M2', None):
+                for date in (datetime.date(2018, 12, 31), datetime.date(2019, 6, 30), datetime.date(2019, 7, 1)):
+                    self.assertEqual(self.index.find('GOPAY', currency, mid, date),
+                                     self.linear('GOPAY', currency, mid, date))
+
+    def test_fee_without_valid_from_fails(self):
+        with self.assertRaises(Exception):
+            fee.FeeIndex([make_fee(valid_from=None)])
+
+
+class TestFeeValidation(unittest.TestCase):
+
+    def validate(self, *fees):
+        return fee.Fees(None).validate_fees([fee.Fee(f) for f in fees])
+
+    def test_compiled_rule(self):
+        f = fee.Fee(make_fee(card_type='VISA, VISA ELECTRON', area_of_event='EEA'))
+        self.assertEqual(f.card_types, ('VISA', 'VISA ELECTRON'))
+        self.assertEqual(f.areas_of_event, ('EEA',))
+        self.assertIsNone(fee.Fee(make_fee()).card_types)
+
+    def test_separable_fees(self):
+        self.validate(make_fee(valid_to=datetime.date(2019, 6, 30)), make_fee(valid_from=datetime.date(2019, 7, 1)),
+                      make_fee(currency='EUR', MIN_amount=1), make_fee(MID='M1'),
+                      make_fee(payment_channel='CARD', card_type='VISA'),
+                      make_fee(payment_channel='CARD', card_type='VISA', card_is_business=True),
+                      make_fee(payment_channel='CARD', card_type='VISA', card_service_type='PREMIUM'),
+                      make_fee(payment_channel='CARD', card_type='VISA', area_of_event='NON_EEA'),
+                      make_fee(payment_channel='CARD', card_type='MAESTRO'))
+
+    def test_ambiguous_fees(self):
+        for other in (make_fee(), make_fee(currency='EUR'), make_fee(valid_from=datetime.date(2019, 12, 1))):
+            with self.assertRaises(Exception):
+                self.validate(make_fee(), other)
+
+        # the same MIN_amount
+        with self.assertRaises(Exception):
+            self.validate(make_fee(MIN_amount=Decimal('1000')), make_fee(currency='EUR', MIN_amount=Decimal('1000.0')))
+        self.validate(make_fee(MIN_amount=Decimal('1000')), make_fee(MIN_amount=Decimal('2000')))
+
+        with self.assertRaises(Exception):
+            self.validate(make_fee(payment_channel='CARD', card_type='VISA, MAESTRO'),
+                          make_fee(payment_channel='CARD', card_type='MAESTRO', area_of_event='EEA, DOMESTIC'))
+
+    def test_invalid_fees(self):
+        for f in (make_fee(cost_algorithm='XXX'), make_fee(fee=None, cost_algorithm='STD'),
+                  make_fee(valid_to=datetime.date(2018, 1, 1))):
+            with self.assertRaises(Exception):
+                self.validate(f)
+
+
+if __name__ == "__main__":
+    unittest.main()
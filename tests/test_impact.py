@@ -0,0 +1,101 @@
+import unittest
+import datetime
+import functools
+import os
+import pickle
+import shutil
+import tempfile
+from decimal import Decimal
+
+from lib import fee, impact
+from tests import helpers
+
+
+def make_fee(**values):
+    row = {'payment_channel': 'GOPAY', 'currency': None, 'valid_from': datetime.date(2019, 1, 1), 'valid_to': None,
+           'MID': None, 'MIN_amount': None, 'card_type': None, 'card_is_business': None, 'card_service_type': None,
+           'area_of_event': None, 'cost_algorithm': 'STD', 'transaction_fee': None, 'transaction_fee_currency': None,
+           'fee': Decimal('1.2')}
+    row.update(values)
+    return fee.Fee(row)
+
+
+# GOPAY payments of the merchant M1 in June
+make_session = functools.partial(helpers.make_session, mid='M1', date_performed='2019-06-01 10:00:00.000')
+
+
+class TestImpact(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.matches_path = os.path.join(self.tmp, 'payment_costs_fee_rules.csv')
+
+        self.kept = make_fee()
+        self.changed = make_fee(currency='EUR')
+        self.old_rules = impact.get_rules([self.kept, self.changed])
+
+        with open(self.matches_path, mode='w', encoding='utf-8') as f:
+            f.write('payment_session_id,fee_rule\n1,{}\n2,{}\n'.format(self.kept.rule_id, self.changed.rule_id))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_rule_id(self):
+        self.assertEqual(make_fee().rule_id, self.kept.rule_id)
+        self.assertNotEqual(make_fee(fee=Decimal('1.3')).rule_id, self.kept.rule_id)
+
+    def test_inserted_fee(self):
+        fee_path = os.path.join(self.tmp, 'fees.csv')
+        header = ('payment_channel,currency,valid_from,valid_to,MID,MIN_amount,card_type,card_is_business,'
+                  'card_service_type,area_of_event,cost_algorithm,transaction_fee,transaction_fee_currency,fee\n')
+        rows = ['GOPAY,,2019-01-01,,,,,,,,STD,,,"1 %"\n', 'PAYPAL,,2019-01-01,,,,,,,,STD,,,"2 %"\n']
+
+        rules = []
+        for inserted in ([], ['NEW_CHANNEL,,2019-01-01,,,,,,,,STD,,,"3 %"\n']):
+            with open(fee_path, mode='w', encoding='utf-8') as f:
+                f.write(header + ''.join(inserted + rows))
+            rules.append(impact.get_rules(fee.Fees(fee_path).get_fees()))
+
+        # an unrelated row inserted at the top keeps the ids of the other rows
+        self.assertEqual(len(rules[1]), 3)
+        self.assertEqual({k: v for k, v in rules[1].items() if k in rules[0]}, rules[0])
+
+        # only the payments of the new rule are affected
+        with open(self.matches_path, mode='w', encoding='utf-8') as f:
+            f.write('payment_session_id,fee_rule\n' + ''.join('{},{}\n'.format(i, rule_id) for i, rule_id in
+                                                              enumerate(rules[0])))
+        i = impact.Impact(rules[0], rules[1], self.matches_path)
+        self.assertFalse(i.is_affected(make_session('0')))
+        self.assertFalse(i.is_affected(make_session('1', payment_channel='PAYPAL')))
+        self.assertTrue(i.is_affected(make_session('2', payment_channel='NEW_CHANNEL')))
+
+        # the cached fee index keeps the ids
+        self.assertEqual(impact.get_rules(pickle.loads(pickle.dumps(fee.Fees(fee_path).get_fees()))), rules[1])
+
+    def test_affected(self):
+        new_rules = impact.get_rules([self.kept, make_fee(currency='EUR', fee=Decimal('0.5')),
+                                      make_fee(payment_channel='PAYPAL', MID='M2', valid_to=datetime.date(2019, 6, 30))])
+        i = impact.Impact(self.old_rules, new_rules, self.matches_path)
+
+        self.assertFalse(i.is_affected(make_session('1')))
+        self.assertTrue(i.is_affected(make_session('2')))
+        self.assertTrue(i.is_affected(make_session('3', currency='EUR')))
+        self.assertTrue(i.is_affected(make_session('4', payment_channel='PAYPAL', mid='M2')))
+        self.assertFalse(i.is_affected(make_session('5', payment_channel='PAYPAL', mid='M1')))
+        self.assertFalse(i.is_affected(make_session('6', payment_channel='PAYPAL', mid='M2', date_performed='2019-07-01 10:00:00.000')))
+
+        stats = {'ignored': 0}
+        sessions = [make_session('1'), make_session('2'), make_session('7', date_performed='2019-08-01 10:00:00.000')]
+        self.assertEqual([ps['payment_session_id'] for ps in i.select(sessions, '2019-07-01 00:00:00', stats)], ['2', '7'])
+        self.assertEqual(stats['ignored'], 1)
+
+    def test_full_recompute(self):
+        state = {'rates_fingerprint': 'a', 'fee_rules': self.old_rules}
+        self.assertIsNone(impact.get_impact(state, 'b', self.old_rules, self.matches_path))
+        self.assertIsNone(impact.get_impact({'rates_fingerprint': 'a'}, 'a', self.old_rules, self.matches_path))
+        self.assertIsNone(impact.get_impact(state, 'a', self.old_rules, os.path.join(self.tmp, 'missing.csv')))
+        self.assertIsNotNone(impact.get_impact(state, 'a', self.old_rules, self.matches_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import datetime
+import os
+import shutil
+import tempfile
+
+from lib import impact, incremental, payment
+from tests import helpers
+from tests.helpers import EUR_RATES, FEES, make_session
+
+# a rate after the watermark of the tests
+GOPAY_RATES = helpers.GOPAY_RATES + '2019-07-01,EUR,1,25.7\n'
+CONFIG = {'date_performed_from': '2019-01-01', 'partnership_cost_exceptions': {}}
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fee_path, self.gopay_path, self.eur_path = self.write(FEES, GOPAY_RATES, EUR_RATES)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, fees, gopay_rates, eur_rates):
+        return helpers.write_inputs(self.tmp, fees, gopay_rates, eur_rates)
+
+    def get_fingerprints(self, watermark, config=CONFIG):
+        rates = incremental.read_rates(self.gopay_path, self.eur_path)
+        return (incremental.get_fingerprint(self.fee_path, rates, watermark, config),
+                incremental.get_fingerprint(None, rates, watermark, config))
+
+    def test_fingerprint(self):
+        fingerprint, rates_fingerprint = self.get_fingerprints('2019-06-30 23:59:59')
+
+        self.assertEqual(self.get_fingerprints('2019-06-30 23:59:59'), (fingerprint, rates_fingerprint))
+        self.assertNotEqual(self.get_fingerprints('2019-07-01 10:00:00')[0], fingerprint)
+        self.assertNotEqual(self.get_fingerprints('2019-06-30 23:59:59', dict(CONFIG, date_performed_from='2019-02-01'))[0],
+                            fingerprint)
+
+        # rates after the watermark and the order of the rates do not matter
+        self.write(FEES, GOPAY_RATES.replace('25.7', '30.0'), EUR_RATES)
+        self.assertEqual(self.get_fingerprints('2019-06-30 23:59:59'), (fingerprint, rates_fingerprint))
+        self.write(FEES, 'relevant_date,target_currency,target_currency_amount,price\n2019-07-01,EUR,1,25.7\n'
+                   '2019-01-01,EUR,1,25.5\n', EUR_RATES)
+        self.assertEqual(self.get_fingerprints('2019-06-30 23:59:59'), (fingerprint, rates_fingerprint))
+
+        # a rate before the watermark
+        self.write(FEES, GOPAY_RATES, EUR_RATES + '2019-03-01,USD,1.2\n')
+        self.assertNotEqual(self.get_fingerprints('2019-06-30 23:59:59')[1], rates_fingerprint)
+
+    def test_rates_fingerprint_fallback(self):
+        fingerprint, rates_fingerprint = self.get_fingerprints('2019-06-30 23:59:59')
+        matches_path = os.path.join(self.tmp, 'payment_costs_fee_rules.csv')
+        with open(matches_path, mode='w', encoding='utf-8') as f:
+            f.write('payment_session_id,fee_rule\n')
+        state = incremental.get_state('2019-06-30 23:59:59', fingerprint, rates_fingerprint=rates_fingerprint, fee_rules={})
+
+        # only the fees have changed - the impact analysis, the rates too - a full recompute
+        self.write(FEES + 'GOPAY,EUR,2019-01-01,,,,,,,,STD,,,"1 %"\n', GOPAY_RATES, EUR_RATES)
+        fingerprint, rates_fingerprint = self.get_fingerprints(state['date_performed_max'])
+        self.assertNotEqual(fingerprint, state['fingerprint'])
+        self.assertIsNotNone(impact.get_impact(state, rates_fingerprint, {}, matches_path))
+
+        self.write(FEES, GOPAY_RATES, EUR_RATES + '2019-03-01,USD,1.2\n')
+        fingerprint, rates_fingerprint = self.get_fingerprints(state['date_performed_max'])
+        self.assertIsNone(impact.get_impact(state, rates_fingerprint, {}, matches_path))
+
+    def test_since(self):
+        state = incremental.get_state('2019-06-30 12:00:00', 'a')
+
+        self.assertIsNone(incremental.get_since({}, 'a', 30))
+        self.assertIsNone(incremental.get_since(state, 'b', 30))
+        self.assertEqual(incremental.get_since(state, 'a', 30), '2019-05-31 12:00:00')
+        self.assertEqual(incremental.get_since(state, 'a', 0), '2019-06-30 12:00:00')
+
+    def test_lookback_filter(self):
+        sessions = [make_session('1', date_performed='2019-05-31 12:00:00.000'),
+                    make_session('2', date_performed='2019-05-31 12:00:01.000'),
+                    make_session('3', date_performed='2019-06-30 12:00:00.000'),
+                    make_session('4', date_performed='2019-07-02 08:00:00.000', session_state='CANCELED'),
+                    make_session('5', date_performed='2019-07-01 08:00:00.000')]
+        stats = payment.get_stats()
+        since = incremental.get_lookback(incremental.get_state('2019-06-30 12:00:00', 'a'), 30)
+
+        # payments up to since are ignored, the watermark is the last successful payment
+        selected = payment.select_sessions(sessions, datetime.date(2019, 1, 1), stats, since)
+        self.assertEqual([ps['payment_session_id'] for ps in selected], ['2', '3', '5'])
+        self.assertEqual((stats['ignored'], stats['date_performed_max']), (1, '2019-07-01 08:00:00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from lib import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_add_payment(self):
+        m = metrics.Metrics()
+        m.add_payment('STD', 'GOPAY', 0.000003, 0.001)
+        m.add_payment('STD', 'GOPAY', 0.00004, 0.002)
+        m.add_payment('IFPP', 'PAYMENT_CARD', 1.0, 0.0)
+
+        self.assertEqual(m.payments[('STD', 'GOPAY')][0], 2)
+        self.assertAlmostEqual(m.payments[('STD', 'GOPAY')][2], 0.003)
+        self.assertEqual(m.latency, [1, 0, 0, 1, 0, 0, 0, 0, 0, 1])
+
+    def test_merge(self):
+        a = metrics.Metrics()
+        a.add('read', 1.5)
+        a.add_payment('STD', 'GOPAY', 0.000003, 0.001)
+        b = metrics.Metrics()
+        b.add('read', 0.5)
+        b.add_payment('STD', 'GOPAY', 0.000003, 0.001)
+        b.add_payment('STD-MAX', 'GOPAY', 0.000003, 0.001)
+
+        a.merge(b)
+        self.assertEqual(a.seconds['read'], 2.0)
+        self.assertEqual(a.payments[('STD', 'GOPAY')][0], 2)
+        self.assertEqual(a.payments[('STD-MAX', 'GOPAY')][0], 1)
+        self.assertEqual(a.latency[0], 3)
+
+    def test_timed(self):
+        m = metrics.Metrics()
+        self.assertEqual(list(m.timed(range(3), 'read')), [0, 1, 2])
+        self.assertGreater(m.seconds['read'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
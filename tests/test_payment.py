@@ -0,0 +1,148 @@
+import unittest
+import csv
+import datetime
+import functools
+import io
+from decimal import Decimal
+
+from lib import batch, errors, fee, payment
+from tests import helpers
+
+
+class FakeRates():
+
+    def __init__(self, rates):
+        self.rates = rates
+
+    def get_payment_rates(self, currency, fee_currency, date):
+        return self.rates
+
+
+# card payments in EUR of the partnership with a cost exception
+make_session = functools.partial(helpers.make_session, date_created='2019-07-01 10:00:00', payment_channel='PAYMENT_CARD',
+                                 currency='EUR', amount='1234.56', card_type='VISA', card_aoe='EEA',
+                                 partnership_id='33198173', interchange_fee='0.123456', association_fee='0')
+
+
+def make_fee(**kwargs):
+    f = {'payment_channel': 'PAYMENT_CARD', 'currency': None, 'valid_from': datetime.date(2019, 1, 1), 'valid_to': None,
+         'MID': None, 'MIN_amount': None, 'card_type': 'VISA', 'card_is_business': None, 'card_service_type': None,
+         'area_of_event': None, 'cost_algorithm': 'IFPP', 'transaction_fee': Decimal('2.5'),
+         'transaction_fee_currency': 'CZK', 'fee': Decimal('1.2')}
+    f.update(kwargs)
+    return f
+
+
+class TestParse(unittest.TestCase):
+
+    def parse(self, **kwargs):
+        return payment.Payment(make_session(**kwargs), None, None, {}).parse_payment().parsed
+
+    def test_columns(self):
+        parsed = self.parse(amount='1 234,5', interchange_fee='0.5 %', amount_refunded='', card_is_business='TRUE',
+                            date_created='not parsed')
+
+        self.assertEqual((parsed['amount'], parsed['interchange_fee'], parsed['amount_refunded']),
+                         (Decimal('1234.5'), Decimal('0.5'), None))
+        self.assertIs(parsed['card_is_business'], True)
+        self.assertIsNone(parsed['mid'])
+        self.assertEqual(parsed['currency'], 'EUR')
+        self.assertFalse(hasattr(parsed, 'date_created'))
+
+    def test_parse_errors(self):
+        for column, value in (('amount', 'x'), ('association_fee', '1.2.3'), ('date_performed', '2019-07-01 25:00:00')):
+            with self.assertRaises(errors.ParseError) as e:
+                self.parse(**{column: value})
+            self.assertIn('column: ' + column, str(e.exception))
+
+    def test_timestamps(self):
+        for value in ('2019-07-01 10:00:00', '2019-07-01 10:00:00.123', '2019-07-01 10:00:00.123456+01:00'):
+            self.assertEqual(self.parse(date_performed=value)['date_performed'], datetime.datetime(2019, 7, 1, 10, 0, 0))
+
+        # only the format of the sessions table, the same as strptime('%Y-%m-%d %H:%M:%S')
+        for value in ('2019-07-01', '2019-07-01T10:00:00', '2019-W27-1 10:00:00', '20190701 10:00:00', '2019-07-01 10:00'):
+            with self.assertRaises(errors.ParseError):
+                self.parse(date_performed=value)
+
+
+RATES = FakeRates((Decimal('25.7'), Decimal(1), Decimal(1) / Decimal('25.7')))
+EXCEPTIONS = {'33198173': [{'date_from': datetime.date(2019, 5, 1), 'date_to': datetime.date(2030, 1, 1), 'gopay_percent': 0.3}]}
+
+
+class TestBatchEngine(unittest.TestCase):
+
+    def assertSameCosts(self, sessions, fees, batch_size=batch.BATCH_SIZE):
+        fees = fee.FeeIndex(fees)
+        expected = list(payment.process_sessions(sessions, fees, RATES, datetime.date(2019, 1, 1), EXCEPTIONS,
+                                                 payment.get_stats()))
+        actual = list(batch.process_batches(sessions, fees, RATES, datetime.date(2019, 1, 1), EXCEPTIONS,
+                                            payment.get_stats(), batch_size=batch_size))
+
+        self.assertEqual([{k: str(v) for k, v in r.items()} for r in expected],
+                         [{k: str(v) for k, v in r.items()} for r in actual])
+
+    def test_algorithms(self):
+        for algorithm in ('STD', 'STD-MAX', 'IFPP', 'IFPP_FIX_CP'):
+            for transaction_fee in (Decimal('2.5'), None, Decimal('50000')):
+                sessions = [make_session(payment_session_id=str(i), amount=amount, amount_refunded='0.005')
+                            for i, amount in enumerate(('1234.56', '0.01', '0', '99999999.999999', '1E+3'))]
+                self.assertSameCosts(sessions, [make_fee(cost_algorithm=algorithm, transaction_fee=transaction_fee)])
+
+    def test_scheme_fees(self):
+        sessions = [make_session(payment_session_id=str(i), interchange_fee=v, association_fee=v)
+                    for i, v in enumerate(('0', '0.000001', '123.4567891', ''))]
+        self.assertSameCosts(sessions, [make_fee(cost_algorithm='IFPP_FIX_CP', fee=Decimal('0.0001'))])
+
+    def test_negative_values(self):
+        self.assertSameCosts([make_session(amount='-0.000001')], [make_fee(cost_algorithm='STD')])
+        self.assertSameCosts([make_session(interchange_fee='-0')], [make_fee(cost_algorithm='IFPP')])
+        self.assertSameCosts([make_session()], [make_fee(cost_algorithm='IFPP_FIX_CP', fee=Decimal('-1.2'))])
+
+    def test_same_as_decimal(self):
+        sessions = [make_session(payment_session_id=str(i), card_type=card_type, amount=amount, interchange_fee=interchange_fee)
+                    for i, (card_type, amount, interchange_fee) in enumerate(
+                        [('VISA', '10.5', '0.1'), ('MAESTRO', '2000', '-0'), ('MASTERCARD', '0.01', ''),
+                         ('VISA', '-3', '0.2'), ('MAESTRO', '17.333333', '1.123456'), ('VISA', '10.5', '0.1')])]
+        self.assertSameCosts(sessions, [make_fee(card_type='VISA', cost_algorithm='IFPP'),
+                                        make_fee(card_type='MAESTRO', cost_algorithm='IFPP_FIX_CP', transaction_fee=None),
+                                        make_fee(card_type='MASTERCARD', cost_algorithm='STD-MAX')], batch_size=4)
+
+
+class TestFaultTolerant(unittest.TestCase):
+
+    def setUp(self):
+        self.fees = fee.FeeIndex([make_fee(card_type='VISA'), make_fee(card_type='MAESTRO', cost_algorithm='DEPRECATED')])
+        self.sessions = [make_session(payment_session_id='1'), make_session(payment_session_id='2', amount='x'),
+                         make_session(payment_session_id='3', card_type='MASTERCARD'),
+                         make_session(payment_session_id='4', card_type='MAESTRO'),
+                         make_session(payment_session_id='5', date_performed='2019-07-02 10:00:00.000'),
+                         make_session(payment_session_id='6', amount='Infinity')]
+
+    def test_rejected_sessions(self):
+        for engine in ('decimal', 'batch'):
+            stats = payment.get_stats()
+            rejects = errors.Rejects(io.StringIO())
+            result = list(payment.process_sessions(self.sessions, self.fees, RATES, datetime.date(2019, 1, 1),
+                                                   EXCEPTIONS, stats, engine=engine, rejects=rejects))
+
+            self.assertEqual([r['payment_session_id'] for r in result], ['1', '5'])
+            self.assertEqual((stats['processed'], stats['rejected']), (2, 4))
+            rejected = csv.DictReader(io.StringIO(rejects.out.getvalue()), fieldnames=errors.REJECTED_FIELDS)
+            self.assertEqual([(r['payment_session_id'], r['error_code']) for r in rejected],
+                             [('2', 'PARSE'), ('3', 'NO_FEE'), ('4', 'COST_ALGORITHM'), ('6', errors.PaymentError.code)])
+            self.assertEqual(rejects.date_min, '2019-07-01 10:00:00')
+
+    def test_error_without_rejects(self):
+        with self.assertRaises(errors.NoFeeError):
+            list(payment.process_sessions(self.sessions[2:3], self.fees, RATES, datetime.date(2019, 1, 1),
+                                          EXCEPTIONS, payment.get_stats()))
+
+    def test_error_rate(self):
+        rejects = errors.Rejects(io.StringIO(), max_error_rate=0.5)
+        rejects.check({'processed': 1, 'rejected': 1})
+        with self.assertRaises(Exception):
+            rejects.check({'processed': 1, 'rejected': 2}, final=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from lib import pipeline
+
+
+def fail(message):
+    raise RuntimeError(message)
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_order(self):
+        written = []
+        pipeline.run(range(10000), lambda rows: (r * 2 for r in rows if r % 3), written.extend, queue_size=1, batch_size=7)
+        self.assertEqual(written, [r * 2 for r in range(10000) if r % 3])
+
+    def test_compute_error(self):
+        def process(rows):
+            for r in rows:
+                if r == 5000:
+                    fail('compute')
+                yield r
+
+        with self.assertRaisesRegex(RuntimeError, 'compute'):
+            pipeline.run(range(100000), process, lambda batch: None, queue_size=1, batch_size=10)
+
+    def test_reader_error(self):
+        def rows():
+            yield from range(100)
+            fail('reader')
+
+        with self.assertRaisesRegex(RuntimeError, 'reader'):
+            pipeline.run(rows(), lambda rows: rows, lambda batch: None, batch_size=10)
+
+    def test_writer_error(self):
+        with self.assertRaisesRegex(RuntimeError, 'writer'):
+            pipeline.run(range(100000), lambda rows: rows, lambda batch: fail('writer'), queue_size=1, batch_size=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import datetime
+import os
+import tempfile
+from decimal import Decimal
+
+from lib import rate
+
+
+class TestRates(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        gopay = os.path.join(self.tmp.name, 'gopay_rates.csv')
+        eur = os.path.join(self.tmp.name, 'eur_rates.csv')
+
+        with open(gopay, mode='w', encoding='utf-8') as f:
+            f.write('relevant_date,target_currency,price,target_currency_amount\n'
+                    '2019-01-04,EUR,25.5,1\n'
+                    '2019-01-07,EUR,25.7,1\n'
+                    '2019-01-04,HUF,8,100\n')
+
+        with open(eur, mode='w', encoding='utf-8') as f:
+            f.write('date,toCurrency,rate\n'
+                    '2019-01-04,USD,1.14\n'
+                    '2019-01-07,USD,\n'
+                    '2019-01-07,CZK,25.6\n')
+
+        self.rates = rate.Rates(gopay, eur).set_rates()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_rate_as_of(self):
+        self.assertEqual(self.rates.get_rate('EUR', 'CZK', datetime.date(2019, 1, 4)), Decimal('25.5'))
+        self.assertEqual(self.rates.get_rate('EUR', 'CZK', datetime.date(2019, 1, 6)), Decimal('25.5'))
+        self.assertEqual(self.rates.get_rate('EUR', 'CZK', datetime.date(2019, 1, 7)), Decimal('25.7'))
+        self.assertEqual(self.rates.get_rate('EUR', 'CZK', datetime.date(2020, 1, 1)), Decimal('25.7'))
+        self.assertEqual(self.rates.get_rate('HUF', 'CZK', '2019-01-05'), Decimal('0.08'))
+        self.assertEqual(self.rates.get_rate('EUR', 'USD', datetime.date(2019, 1, 8)), Decimal('1.14'))
+
+    def test_get_rate_missing(self):
+        with self.assertRaises(Exception):
+            self.rates.get_rate('EUR', 'CZK', datetime.date(2019, 1, 3))
+        with self.assertRaises(Exception):
+            self.rates.get_rate('USD', 'CZK', datetime.date(2019, 1, 7))
+
+    def test_get_payment_rates(self):
+        self.assertEqual(self.rates.get_payment_rates('CZK', 'EUR', datetime.date(2019, 1, 7)),
+                         (Decimal(1), Decimal('25.7'), Decimal('25.7')))
+
+
+if __name__ == "__main__":
+    unittest.main()
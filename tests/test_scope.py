@@ -0,0 +1,79 @@
+import unittest
+import datetime
+import os
+import shutil
+import tempfile
+
+from lib import rate, scope
+
+SESSIONS = """payment_session_id,date_performed,session_state,currency
+1,2019-01-10 10:00:00.000,PAID,PLN
+2,2019-01-20 10:00:00.000,REFUNDED,EUR
+3,2019-02-20 10:00:00.000,CREATED,USD
+4,2018-12-20 10:00:00.000,PAID,HUF
+5,wrong,PAID,GBP
+"""
+GOPAY_RATES = """relevant_date,target_currency,target_currency_amount,price
+2018-12-28,EUR,1,25.7
+2019-01-04,EUR,1,25.6
+2019-01-04,PLN,1,5.9
+2019-01-15,EUR,1,25.5
+2019-01-25,EUR,1,25.4
+2019-01-04,USD,1,22.5
+"""
+EUR_RATES = """date,toCurrency,rate
+2019-01-04,PLN,4.3
+2019-01-07,PLN,
+2019-01-15,USD,1.14
+"""
+
+
+class TestScope(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.paths = {}
+        for name, text in (('sessions', SESSIONS), ('gopay', GOPAY_RATES), ('eur', EUR_RATES)):
+            self.paths[name] = os.path.join(self.tmp, name + '.csv')
+            with open(self.paths[name], mode='w', encoding='utf-8') as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_get_scope(self):
+        s = scope.get_scope(self.paths['sessions'], datetime.date(2019, 1, 1))
+        self.assertEqual(s.currencies, {'CZK', 'PLN', 'EUR'})
+        self.assertEqual((s.date_from, s.date_to), (datetime.date(2019, 1, 10), datetime.date(2019, 1, 20)))
+
+        s = scope.get_scope(self.paths['sessions'], datetime.date(2019, 1, 1), since='2019-01-15 00:00:00')
+        self.assertEqual(s.currencies, {'CZK', 'EUR'})
+
+    def test_pruned_rates(self):
+        s = scope.get_scope(self.paths['sessions'], datetime.date(2019, 1, 1))
+        full = rate.Rates(self.paths['gopay'], self.paths['eur']).set_rates()
+        pruned = rate.Rates(self.paths['gopay'], self.paths['eur'], s).set_rates()
+
+        # the latest rate before the scope is kept, rates after it and of other currencies are not loaded
+        self.assertEqual(sorted(pruned.rates['EUR']['CZK']), [datetime.date(2019, 1, 4), datetime.date(2019, 1, 15)])
+        self.assertNotIn('USD', pruned.rates)
+        self.assertEqual(list(pruned.rates['EUR']['PLN']), [datetime.date(2019, 1, 4)])
+
+        day = datetime.date(2019, 1, 10)
+        while day <= s.date_to:
+            for currencies in (('EUR', 'CZK'), ('PLN', 'CZK'), ('CZK', 'EUR'), ('EUR', 'PLN')):
+                self.assertEqual(pruned.get_rate(*currencies, day), full.get_rate(*currencies, day))
+            day += datetime.timedelta(days=1)
+
+    def test_has_fee(self):
+        s = scope.Scope(['EUR'], datetime.date(2019, 1, 10), datetime.date(2019, 1, 20))
+        fee = {'valid_from': datetime.date(2019, 1, 1), 'valid_to': None, 'currency': None}
+        self.assertTrue(s.has_fee(fee))
+        self.assertFalse(s.has_fee(dict(fee, valid_to=datetime.date(2019, 1, 9))))
+        self.assertFalse(s.has_fee(dict(fee, valid_from=datetime.date(2019, 1, 21))))
+        self.assertFalse(s.has_fee(dict(fee, currency='USD')))
+        self.assertTrue(s.has_fee(dict(fee, currency='CZK')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import http.client
+import json
+import shutil
+import tempfile
+import threading
+
+from lib import config, service
+from tests.helpers import CARD, FEES, make_session, write_inputs
+
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.paths = write_inputs(self.tmp)
+
+        self.service = service.CostService(*self.paths, {})
+        self.server = service.make_server(self.service, port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        connection.request(method, path, body=None if body is None else json.dumps(body))
+        response = connection.getresponse()
+        data = json.loads(response.read())
+        connection.close()
+        return response.status, data
+
+    def test_quote(self):
+        # json values of the columns
+        status, data = self.request('POST', '/costs', make_session(amount=1000, amount_refunded=None, card_is_business=False,
+                                                                   interchange_fee=None, association_fee=None))
+        self.assertEqual(status, 200)
+        self.assertEqual(data['payment_session_id'], '1')
+        self.assertEqual(data['cost_algorithm'], 'STD')
+        self.assertEqual(data['total_fee'], '15.00000')
+
+        status, data = self.request('GET', '/health')
+        self.assertEqual((status, data['fees']), (200, 3))
+
+    def test_open_exception(self):
+        # the exception without date_to applies after the start day of the service too
+        cfg = config.Config(None).set_parameters({'date_performed_from': '', 'partnership_cost_exceptions': {
+            '1': [{'date_from': '2019-01-01', 'date_to': '', 'gopay_percent': '0.5'}]}})
+        self.server.service = service.CostService(*self.paths, cfg.get_cost_exceptions(unbounded=True))
+
+        card = dict(CARD, interchange_fee=2, association_fee=1)
+        for date in ('2019-07-01 10:00:00.000', '2999-07-01 10:00:00.000'):
+            status, data = self.request('POST', '/costs', make_session(date_performed=date, **card))
+            self.assertEqual((status, data['interchange_fee'], data['association_fee']), (200, '1.0000000000', '0.5000000000'))
+
+        status, data = self.request('POST', '/costs', make_session(partnership_id='2', **card))
+        self.assertEqual(data['interchange_fee'], '2.0000000000')
+
+    def test_batch_errors(self):
+        status, data = self.request('POST', '/costs', [make_session(), make_session(payment_session_id='2', payment_channel='PAYPAL')])
+        self.assertEqual(status, 200)
+        self.assertEqual(data[0]['total_fee'], '15.00000')
+        self.assertEqual(data[1]['payment_session_id'], '2')
+        self.assertIn('error_code', data[1])
+
+        status, data = self.request('POST', '/costs', make_session(payment_channel='PAYPAL'))
+        self.assertEqual(status, 422)
+
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        connection.request('POST', '/costs', body='{')
+        self.assertEqual(connection.getresponse().status, 400)
+        connection.close()
+
+    def test_missing_fields(self):
+        ps = make_session()
+        for k in ('amount', 'currency'):
+            del ps[k]
+        status, data = self.request('POST', '/costs', ps)
+        self.assertEqual((status, data['payment_session_id'], data['error_code']), (422, '1', 'MISSING_FIELD'))
+        self.assertEqual(data['error_message'], 'Error: missing fields: currency, amount')
+
+        # the other columns are empty if missing
+        ps = make_session()
+        for k in ('mid', 'partnership_id', 'card_type', 'card_is_business', 'interchange_fee', 'association_fee'):
+            del ps[k]
+        status, data = self.request('POST', '/costs', [ps])
+        self.assertEqual((status, data[0]['total_fee']), (200, '15.00000'))
+
+    def test_reload(self):
+        with open(self.paths[0], mode='w', encoding='utf-8') as f:
+            f.write(FEES.replace('1,5 %', '2 %'))
+        self.assertTrue(self.service.reload())
+        self.assertFalse(self.service.reload())
+        self.assertEqual(self.request('POST', '/costs', make_session())[1]['total_fee'], '20.00000')
+
+        # invalid fees - the old ones are kept
+        with open(self.paths[0], mode='w', encoding='utf-8') as f:
+            f.write(FEES.replace('2019-01-01', 'wrong'))
+        self.assertFalse(self.service.reload())
+        self.assertEqual(self.request('POST', '/costs', make_session())[1]['total_fee'], '20.00000')
+
+
+if __name__ == '__main__':
+    unittest.main()
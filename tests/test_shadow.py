@@ -0,0 +1,104 @@
+import unittest
+import datetime
+import shutil
+import tempfile
+from unittest import mock
+
+from lib import api, errors, fee, payment, rate, shadow
+from tests import helpers
+from tests.helpers import make_session
+
+
+# a rate change before the payments
+GOPAY_RATES = helpers.GOPAY_RATES + '2019-03-01,EUR,1,25.0\n'
+
+
+class TestShadow(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        paths = helpers.write_inputs(self.tmp, gopay_rates=GOPAY_RATES)
+        self.fees = api.load_fees(paths[0])
+        self.rates = api.load_rates(paths[1], paths[2])
+        self.sessions = [make_session(str(i), mid='M1', session_state='CANCELED' if i % 3 == 0 else 'PAID') for i in range(100)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_fee_scan(self):
+        scan = fee.FeeScan(self.fees)
+        for day in (datetime.date(2019, 2, 1), datetime.date(2019, 7, 1)):
+            for mid in ('M1', 'M2', None):
+                self.assertEqual(scan.find('GOPAY', 'CZK', mid, day), self.fees.find('GOPAY', 'CZK', mid, day))
+
+    def test_rate_scan(self):
+        scan = rate.RateScan(self.rates)
+        for day in (datetime.date(2019, 1, 1), datetime.date(2019, 2, 28), datetime.date(2019, 3, 1),
+                    datetime.date(2020, 1, 1)):
+            for from_currency, to_currency in (('EUR', 'CZK'), ('CZK', 'EUR'), ('EUR', 'USD'), ('CZK', 'CZK')):
+                self.assertEqual(scan.get_rate(from_currency, to_currency, day),
+                                 self.rates.get_rate(from_currency, to_currency, day))
+
+        self.assertEqual(scan.get_payment_rates('EUR', 'CZK', datetime.date(2019, 2, 1)),
+                         self.rates.get_payment_rates('EUR', 'CZK', datetime.date(2019, 2, 1)))
+        for from_currency, to_currency, day in (('EUR', 'CZK', datetime.date(2018, 12, 31)),
+                                                ('USD', 'CZK', datetime.date(2019, 2, 1))):
+            with self.assertRaises(errors.MissingRateError):
+                scan.get_rate(from_currency, to_currency, day)
+
+    def test_sample(self):
+        report = shadow.Report()
+        verified = shadow.Shadow(0.5, self.fees, self.rates, {}, report)
+        costs = api.calculate_costs_batch(self.sessions, self.fees, self.rates, {}, engine='batch', shadow=verified)
+
+        self.assertEqual(costs, api.calculate_costs_batch(self.sessions, self.fees, self.rates, {}, engine='batch'))
+        self.assertTrue(0 < verified.counts['checked'] < len(costs))
+        self.assertEqual((verified.counts['discrepant'], report), (0, []))
+
+    def test_discrepancy(self):
+        report = shadow.Report()
+        verified = shadow.Shadow(1, self.fees, self.rates, {}, report)
+
+        # output of an optimized path with a wrong value
+        rows = list(api.calculate_costs(verified.sample(self.sessions), self.fees, self.rates, {},
+                                        fields=shadow.COMPARED_FIELDS))
+        rows[1]['total_fee'] = '0'
+        costs = list(verified.verify(rows, api.payment.OUTPUT_FIELDS))
+
+        self.assertEqual(len(costs), 66)
+        self.assertNotIn('fee_rule', costs[0])
+        self.assertEqual(verified.counts, {'checked': 66, 'discrepant': 1})
+        self.assertEqual(len(report), 1)
+        self.assertEqual((report[0]['payment_session_id'], report[0]['column'], report[0]['value'], str(report[0]['reference_value'])),
+                         ('2', 'total_fee', '0', '15.00000'))
+        self.assertEqual(report[0]['fee_rule'], report[0]['reference_fee_rule'])
+
+    def test_reference_path(self):
+        sessions = [make_session(str(i), mid='M1', currency='EUR', amount='10,5') for i in range(10)]
+
+        # a wrong day table of the optimized rates - the reference scans the dated rates
+        report = shadow.Report()
+        verified = shadow.Shadow(1, self.fees, self.rates, {}, report)
+        first, days = self.rates.tables[('EUR', 'CZK')]
+        self.rates.tables[('EUR', 'CZK')] = (first, days[:-1] + [payment.D('26')])
+        self.rates.cache = {}
+        api.calculate_costs_batch(sessions, self.fees, self.rates, {}, engine='batch', shadow=verified)
+        self.assertEqual(verified.counts, {'checked': 10, 'discrepant': 10})
+        self.assertEqual({(r['column'], str(r['value']), str(r['reference_value'])) for r in report
+                          if r['column'] == 'amount_czk'}, {('amount_czk', '273.00000', '262.50000')})
+
+        # a wrong converter of the optimized parser - the reference parses the columns by itself
+        self.rates.set_tables()
+        converters = tuple((k, (lambda v: payment.D(v.replace(',', ''))) if k == 'amount' else convert)
+                           for k, convert in payment.CONVERTERS)
+        report = shadow.Report()
+        verified = shadow.Shadow(1, self.fees, self.rates, {}, report)
+        with mock.patch.object(payment, 'CONVERTERS', converters):
+            api.calculate_costs_batch(sessions, self.fees, self.rates, {}, engine='batch', shadow=verified)
+        self.assertEqual(verified.counts, {'checked': 10, 'discrepant': 10})
+        self.assertIn(('amount', '105.00000', '10.50000'),
+                      {(r['column'], str(r['value']), str(r['reference_value'])) for r in report})
+
+
+if __name__ == '__main__':
+    unittest.main()
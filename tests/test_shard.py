@@ -0,0 +1,140 @@
+import unittest
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future
+from unittest import mock
+
+from lib import api, payment, shard
+from tests.helpers import make_sessions, write_inputs
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.paths = write_inputs(self.tmp)
+        self.sessions = make_sessions(200)
+        self.path = os.path.join(self.tmp, 'payments-sessions-stage.csv')
+        with open(self.path, mode='w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=payment.INPUT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.sessions)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_text(self, text):
+        path = os.path.join(self.tmp, 'chunks.csv')
+        with open(path, mode='wb') as f:
+            f.write(text)
+        return path
+
+    def get_serial(self):
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=payment.OUTPUT_FIELDS)
+        stats = payment.get_stats()
+        writer.writerows(api.calculate_costs(self.sessions, api.load_fees(self.paths[0]),
+                                             api.load_rates(self.paths[1], self.paths[2]), {}, stats=stats))
+        return out.getvalue(), stats
+
+    def get_parallel(self, path):
+        out = io.StringIO()
+        stats = payment.get_stats()
+        with mock.patch.object(shard, 'MIN_CHUNK_SIZE', 1024):
+            shard.process_parallel(path, out, 3, *self.paths, datetime.date.min, {}, stats)
+        return out.getvalue(), stats
+
+    def test_chunk_on_newline(self):
+        # the end of the first chunk falls exactly after the newline of a line
+        path = self.write_text(b'a\n111\n222\n333\n')
+        self.assertEqual(shard.get_chunks(path, 4), (b'a\n', [(2, 6), (6, 10), (10, 14)]))
+        self.assertEqual(shard.get_chunks(path, 5), (b'a\n', [(2, 10), (10, 14)]))
+
+    def test_chunk_last_line(self):
+        path = self.write_text(b'a\n111\n222\n333')
+        header, chunks = shard.get_chunks(path, 4)
+        self.assertEqual(chunks, [(2, 6), (6, 10), (10, 13)])
+        self.assertEqual([row['a'] for start, end in chunks for row in shard.read_chunk(path, header, start, end)],
+                         ['111', '222', '333'])
+
+    def test_chunk_offset(self):
+        path = self.write_text(b'a\n111\n222\n333\n')
+        self.assertEqual(shard.get_chunks(path, 4, 6), (b'a\n', [(6, 10), (10, 14)]))
+        self.assertEqual(shard.get_chunks(path, 4, 14), (b'a\n', []))
+
+        # an offset within the header starts after it
+        self.assertEqual(shard.get_chunks(path, 100, 0), (b'a\n', [(2, 14)]))
+
+    def test_parallel(self):
+        serial, serial_stats = self.get_serial()
+        parallel, stats = self.get_parallel(self.path)
+
+        self.assertGreater(len(shard.get_chunks(self.path, 1024)[1]), 3)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(stats, serial_stats)
+
+    def test_parallel_sliced(self):
+        serial, serial_stats = self.get_serial()
+
+        # gzip-compressed file
+        with open(self.path, mode='rb') as f, gzip.open(self.path + '.gz', mode='wb') as g:
+            shutil.copyfileobj(f, g)
+        self.assertEqual(self.get_parallel(self.path + '.gz'), (serial, serial_stats))
+
+        # sliced table, the slices without a header
+        sliced = os.path.join(self.tmp, 'sliced.csv')
+        os.makedirs(sliced)
+        for i in range(3):
+            with open(os.path.join(sliced, 'part{}.csv' . format(i)), mode='w', encoding='utf-8', newline='') as f:
+                csv.DictWriter(f, fieldnames=payment.INPUT_COLUMNS).writerows(self.sessions[i * 70:(i + 1) * 70])
+        with open(sliced + '.manifest', mode='w', encoding='utf-8') as f:
+            json.dump({'columns': payment.INPUT_COLUMNS}, f)
+        self.assertEqual(self.get_parallel(sliced), (serial, serial_stats))
+
+    def test_parallel_window(self):
+        serial, serial_stats = self.get_serial()
+        counts = {'submitted': 0, 'written': 0, 'ahead': 0}
+        self.addCleanup(shard.worker.clear)
+
+        class Pool():
+            """
+            Pool running the chunks in the test process when submitted
+            """
+            def __init__(self, max_workers, initializer, initargs):
+                initializer(*initargs)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                return False
+
+            def submit(self, fn, args):
+                counts['submitted'] += 1
+                counts['ahead'] = max(counts['ahead'], counts['submitted'] - counts['written'])
+                future = Future()
+                future.set_result(fn(args))
+                return future
+
+        def on_chunk(end):
+            counts['written'] += 1
+
+        out = io.StringIO()
+        stats = payment.get_stats()
+        with mock.patch.object(shard, 'MIN_CHUNK_SIZE', 1024), mock.patch.object(shard, 'ProcessPoolExecutor', Pool):
+            shard.process_parallel(self.path, out, 2, *self.paths, datetime.date.min, {}, stats, on_chunk=on_chunk)
+
+        self.assertEqual((out.getvalue(), stats), (serial, serial_stats))
+        self.assertGreater(counts['written'], 2 * shard.CHUNKS_AHEAD)
+        self.assertEqual(counts['submitted'], counts['written'])
+        self.assertEqual(counts['ahead'], 2 * shard.CHUNKS_AHEAD)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import csv
+import gzip
+import json
+import os
+import tempfile
+
+from lib import tables
+
+
+class TestTables(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rows = [{'a': str(i), 'b': 'x' * (i % 3)} for i in range(2500)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_gzip(self):
+        path = os.path.join(self.tmp.name, 'table.csv')
+        with gzip.open(path + '.gz', mode='wt', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['a', 'b'])
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+        path = tables.get_input_path(path)
+        self.assertFalse(tables.is_plain(path))
+        self.assertEqual(list(tables.read_table(path)), self.rows)
+
+    def test_sliced_roundtrip(self):
+        path = os.path.join(self.tmp.name, 'table.csv')
+        with tables.SlicedWriter(path, ['a', 'b'], 3, compress=True) as writer:
+            writer.writerows(self.rows[:2000])
+            writer.write('2000,xx\r\n')
+            writer.writerows(self.rows[2001:])
+
+        with open(path + '.manifest', mode='w', encoding='utf-8') as f:
+            json.dump({'columns': ['a', 'b']}, f)
+
+        self.assertEqual(len(tables.get_slices(path)), 3)
+        self.assertEqual(sorted(tables.read_table(path), key=lambda r: int(r['a'])), self.rows)
+
+    def test_missing_input(self):
+        with self.assertRaises(Exception):
+            tables.get_input_path(os.path.join(self.tmp.name, 'missing.csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()